@@ -3,6 +3,8 @@ import sys, getopt, os
 from os import listdir
 from os.path import isfile, join
 
+import go_stats_store
+
 
 
 
@@ -31,12 +33,36 @@ def write_json(key, content):
     with open(key, 'w') as outfile:
         json.dump(content, outfile, indent=2)
 
+def update_store(store, folder, fileB):
+    """
+    Append to the store the summaries of a folder that are newer than its latest release, and / or a summary file
+    """
+    summaries = []
+    if folder != '':
+        summaries = [read_json(folder + stat) for stat in list_stats(folder)]
+    if fileB != '':
+        summaries.append(read_json(fileB))
+    for summary in sorted(summaries, key = lambda summary: summary["release_date"]):
+        if len(store) > 0 and summary["release_date"] <= store.releases[-1]:
+            continue
+        store.add_release(summary)
+        print("Release " + summary["release_date"] + " added to the store (" + str(len(store)) + " releases)")
+
+def print_series(store, metric, start, end):
+    print("release_date\t" + metric)
+    for date, val in store.series(metric, start, end):
+        print(date + "\t" + (val if isinstance(val, str) else json.dumps(val)))
+
 def print_help():
-    print("\nUsage: aggregate-stats.py -f <folder> -o <json_output>\nOR\n\taggregate-stats -a <json_file1> -b <json_file2> -o <json_output>\n")
+    print("\nUsage: aggregate-stats.py -f <folder> -o <json_output>\nOR\n\taggregate-stats -a <json_file1> -b <json_file2> -o <json_output>")
+    print("OR\n\taggregate-stats -s <store_dir> [-f <folder>] [-b <json_file>] [-o <json_output>] [-m <metric>] [--from <release_date>] [--to <release_date>]\n")
+    print("\t-s: append the new summaries of the folder and / or the json file to a time series store, instead of rewriting the aggregate")
+    print("\t-o: with -s, export the releases of the store (from / to release dates, included) to the aggregate json")
+    print("\t-m: with -s, print the values of a metric (e.g. annotations/by_aspect/P) across the releases (from / to release dates, included)\n")
 
 def main(argv):
     try:
-        opts, argv = getopt.getopt(argv, "f:o:a:b:",["folder=", "output=", "fileA=", "fileB="])
+        opts, argv = getopt.getopt(argv, "f:o:a:b:s:m:h",["folder=", "output=", "fileA=", "fileB=", "store=", "metric=", "from=", "to="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -49,6 +75,10 @@ def main(argv):
     output = ''
     fileA = ''
     fileB = ''
+    store_dir = ''
+    metric = ''
+    start = None
+    end = None
     for opt, arg in opts:
         if opt == '-h':
             print_help()
@@ -61,9 +91,26 @@ def main(argv):
             fileA = arg
         elif opt in ("-b", "--fileB"):
             fileB = arg
+        elif opt in ("-s", "--store"):
+            store_dir = arg
+        elif opt in ("-m", "--metric"):
+            metric = arg
+        elif opt == "--from":
+            start = arg
+        elif opt == "--to":
+            end = arg
 
     print("params: ", folder, fileA, fileB)
-    if folder != '':
+    if store_dir != '':
+        store = go_stats_store.StatsStore(store_dir)
+        update_store(store, folder, fileB)
+        if output != '':
+            print("Exporting the aggregate of stats as " , output)
+            write_json(output, store.export(start, end))
+        if metric != '':
+            print_series(store, metric, start, end)
+
+    elif folder != '':
         print("Creating initial aggregate of stats as " , output)
         aggregate = create_initial_set(folder)
         write_json(output, aggregate)
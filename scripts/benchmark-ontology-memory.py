@@ -0,0 +1,101 @@
+# Peak memory benchmark of loading two GO releases with obo_parser, as go_ontology_changes does
+#
+# Each term model is measured in a fresh process (peak RSS cannot go down within a process):
+#   * dict: the former term model, one __dict__ per term and mutable lists
+#   * slots: the current obo_parser.Term, with __slots__, tuple frozen lists and interned ids / namespaces
+#
+# Usage: python benchmark-ontology-memory.py -c <current_obo_url_or_file> -p <previous_obo_url_or_file>
+
+import sys, getopt, os, time, resource, subprocess
+
+import obo_parser
+import go_stats_utils as utils
+
+MODELS = ["dict", "slots"]
+
+
+def dict_term_class():
+    """
+    Same methods as obo_parser.Term, but with a per instance __dict__ and terms left unfrozen
+    """
+    methods = { key : val for key, val in vars(obo_parser.Term).items() if callable(val) }
+    methods["freeze"] = lambda self: None
+    return type("DictTerm", (object, ), methods)
+
+def open_obo(location):
+    if location.startswith("http://") or location.startswith("https://"):
+        return utils.fetch_lines(location)
+    return open(location, "r", encoding = "utf-8")
+
+def run_model(model, current_obo, previous_obo):
+    """
+    Load both releases with the given term model and print: model, peak RSS (MB), load time (s), number of terms
+    """
+    if model == "dict":
+        obo_parser.OBO_Parser.term_class = dict_term_class()
+
+    start = time.time()
+    currentgo = obo_parser.OBO_Parser(open_obo(current_obo))
+    oldgo = obo_parser.OBO_Parser(open_obo(previous_obo))
+    duration = time.time() - start
+
+    # ru_maxrss is in KB on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    print("RESULT\t" + model + "\t" + str(round(peak_mb, 1)) + "\t" + str(round(duration, 2)) + "\t" + str(len(currentgo.obo_graph) + len(oldgo.obo_graph)))
+
+
+
+def print_help():
+    print('\nUsage: python benchmark-ontology-memory.py -c <current_obo_url_or_file> -p <previous_obo_url_or_file>\n')
+
+
+def main(argv):
+    current_obo = ''
+    previous_obo = ''
+    model = ''
+
+    try:
+        opts, argv = getopt.getopt(argv,"c:p:m:h",["cobo=","pobo=","model="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-c", "--cobo"):
+            current_obo = arg
+        elif opt in ("-p", "--pobo"):
+            previous_obo = arg
+        elif opt in ("-m", "--model"):
+            model = arg
+
+    if current_obo == '' or previous_obo == '':
+        print_help()
+        sys.exit(2)
+
+    # child process: measure a single model
+    if model != '':
+        run_model(model, current_obo, previous_obo)
+        return
+
+    results = [ ]
+    for model in MODELS:
+        print("Loading both releases with the " + model + " term model...")
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "-c", current_obo, "-p", previous_obo, "-m", model], stdout = subprocess.PIPE, universal_newlines = True, check = True).stdout
+        for line in out.split("\n"):
+            if line.startswith("RESULT\t"):
+                results.append(line.split("\t")[1:])
+
+    print("\nmodel\tpeak_rss_mb\tload_seconds\tterms")
+    for result in results:
+        print("\t".join(result))
+    if len(results) == 2:
+        print("\npeak RSS saved by the slots model: " + str(round(float(results[0][1]) - float(results[1][1]), 1)) + " MB")
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
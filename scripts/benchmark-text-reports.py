@@ -0,0 +1,122 @@
+# Benchmark of the TSV rendering of the ontology changes and stats reports
+#
+# Each report is rendered with the same write_text_report function, to three kinds of outputs:
+#   * concat: a string grown by concatenation, like the former create_text_report (worst case: no in-place resize)
+#   * string: the whole report rendered in memory (utils.render_report), then written with utils.write_text
+#   * stream: rows written as they are rendered to a buffered file (utils.write_report)
+# and the time and peak memory allocated while rendering are reported.
+#
+# The reports are either existing JSON reports (go-ontology-changes.json, go-stats.json) or the changes between
+# consecutive releases of a list of OBO files, oldest first: a full multi-release change set.
+#
+# Usage: python benchmark-text-reports.py (-j <report_json>)* (-r <obo_url_or_file>)* [-o <output_dir>] [--snapshots <snapshot_dir>]
+
+import sys, getopt, os, json, time, tracemalloc
+
+import go_stats_utils as utils
+import go_stats
+import go_ontology_changes
+
+MODES = ["concat", "string", "stream"]
+
+
+class ConcatWriter:
+
+    def __init__(self):
+        self.text = ""
+
+    def write(self, text):
+        self.text += text
+
+
+def render(mode, write_text_report, report, path):
+    if mode == "concat":
+        out = ConcatWriter()
+        write_text_report(report, out)
+        utils.write_text(path, out.text)
+    elif mode == "string":
+        utils.write_text(path, utils.render_report(write_text_report, report))
+    else:
+        utils.write_report(path, write_text_report, report)
+
+def measure(mode, write_text_report, report, path):
+    """
+    Render a report in the given mode and return (seconds, peak MB allocated)
+    """
+    tracemalloc.start()
+    start = time.time()
+    render(mode, write_text_report, report, path)
+    duration = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / (1024 * 1024)
+
+def release_changes(obo_urls):
+    """
+    Changes between each pair of consecutive releases
+    """
+    reports = []
+    for previous_obo_url, current_obo_url in zip(obo_urls, obo_urls[1:]):
+        reports.append((current_obo_url, go_ontology_changes.compute_changes(current_obo_url, previous_obo_url)))
+    return reports
+
+
+
+def print_help():
+    print('\nUsage: python benchmark-text-reports.py (-j <report_json>)* (-r <obo_url_or_file>)* [-o <output_dir>] [--snapshots <snapshot_dir>]\n')
+
+
+def main(argv):
+    report_jsons = []
+    obo_urls = []
+    output_dir = '.'
+
+    try:
+        opts, argv = getopt.getopt(argv,"j:r:o:h",["json=","release=","output=","snapshots="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-j", "--json"):
+            report_jsons.append(arg)
+        elif opt in ("-r", "--release"):
+            obo_urls.append(arg)
+        elif opt in ("-o", "--output"):
+            output_dir = arg
+        elif opt == "--snapshots":
+            go_ontology_changes.enable_snapshots(arg)
+
+    if len(report_jsons) == 0 and len(obo_urls) < 2:
+        print_help()
+        sys.exit(2)
+
+    reports = []
+    for report_json in report_jsons:
+        with open(report_json, "r") as f:
+            reports.append((report_json, json.load(f)))
+    reports += release_changes(obo_urls)
+
+    path = os.path.join(output_dir, "benchmark-text-report.tsv")
+    totals = { mode : [0, 0] for mode in MODES }
+    print("\nreport\tmode\tseconds\tpeak_mb")
+    for name, report in reports:
+        write_text_report = go_ontology_changes.write_text_report if "detailed_changes" in report else go_stats.write_text_report
+        for mode in MODES:
+            duration, peak = measure(mode, write_text_report, report, path)
+            totals[mode][0] += duration
+            totals[mode][1] = max(totals[mode][1], peak)
+            print(name + "\t" + mode + "\t" + str(round(duration, 3)) + "\t" + str(round(peak, 1)))
+    os.remove(path)
+
+    print("\nmode\ttotal_seconds\tmax_peak_mb")
+    for mode in MODES:
+        print(mode + "\t" + str(round(totals[mode][0], 3)) + "\t" + str(round(totals[mode][1], 1)))
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
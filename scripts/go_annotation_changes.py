@@ -1,4 +1,5 @@
 import sys, getopt, os
+from functools import partial
 
 import json
 
@@ -69,7 +70,47 @@ def missing_fields(current_json, previous_json):
     return missing
 
 
-def alter_annotation_changes(current_stats, previous_stats, current_references, previous_references, json_annot_changes):
+# files of the detailed reference changes (see write_reference_changes)
+REFERENCE_CHANGES_FILES = {
+    "all" : { "added" : "go-references-added.tsv", "removed" : "go-references-removed.tsv" },
+    "pmids" : { "added" : "go-pmids-added.tsv", "removed" : "go-pmids-removed.tsv" }
+}
+
+def diff_references(current_references, previous_references):
+    """
+    Added and removed references and PMIDs between two releases, given as lists of reference ids or utils.ReferenceSet
+    Return { "all": { "added": ReferenceSet, "removed": ReferenceSet }, "pmids": { ... } }
+    """
+    if not isinstance(current_references, utils.ReferenceSet):
+        current_references = utils.ReferenceSet(current_references)
+    if not isinstance(previous_references, utils.ReferenceSet):
+        previous_references = utils.ReferenceSet(previous_references)
+
+    added_references = current_references.difference(previous_references)
+    removed_references = previous_references.difference(current_references)
+    return {
+        "all" : { "added" : added_references, "removed" : removed_references },
+        "pmids" : { "added" : added_references.filter("PMID:"), "removed" : removed_references.filter("PMID:") }
+    }
+
+def write_reference_changes(reference_changes, output_rep):
+    """
+    Stream the reference changes computed by diff_references to the REFERENCE_CHANGES_FILES of output_rep, one id per line
+    Return the paths of the files by change, to be given to write_text_report
+    """
+    paths = { }
+    for key, changes in reference_changes.items():
+        paths[key] = { }
+        for change, references in changes.items():
+            paths[key][change] = os.path.join(output_rep, REFERENCE_CHANGES_FILES[key][change])
+            references.write(paths[key][change])
+    return paths
+
+def alter_annotation_changes(current_stats, previous_stats, current_references, previous_references, json_annot_changes, reference_changes = None):
+    """
+    reference_changes: the diff_references of current_references and previous_references, when already computed
+    The detailed reference changes are not listed in the report, only the names of their REFERENCE_CHANGES_FILES (see write_reference_changes)
+    """
     addrem_species = utils.added_removed_species(current_stats, previous_stats)
 
     altered_json_annot_changes = {
@@ -146,134 +187,168 @@ def alter_annotation_changes(current_stats, previous_stats, current_references,
     altered_json_annot_changes["detailed_changes"]["references"]["pmids"]["removed"] = []
 
     # if pmid lists are provided, add the information to the stats
-    if current_references and previous_references:
-        # creating sets to accelerate the diff
-        set_cur = set(current_references)
-        set_prev = set(previous_references)
+    if reference_changes is None and current_references and previous_references:
+        reference_changes = diff_references(current_references, previous_references)
 
-        added_references = list(filter(lambda x: x not in set_prev, set_cur))
-        removed_references = list(filter(lambda x: x not in set_cur, set_prev))
+    if reference_changes is not None:
+        print("added references:   \t", len(reference_changes["all"]["added"]))
+        print("removed references: \t", len(reference_changes["all"]["removed"]))
+        print("added pmids:        \t", len(reference_changes["pmids"]["added"]))
+        print("removed pmids:      \t", len(reference_changes["pmids"]["removed"]))
 
-        added_pmids = list(filter(lambda x: "PMID:" in x, added_references))
-        removed_pmids = list(filter(lambda x: "PMID:" in x, removed_references))
+        altered_json_annot_changes["summary"]["changes"]["references"]["added"] = len(reference_changes["all"]["added"])
+        altered_json_annot_changes["summary"]["changes"]["references"]["removed"] = len(reference_changes["all"]["removed"])
 
-        print("added references:   \t", len(added_references))
-        print("removed references: \t", len(removed_references))
-        print("added pmids:        \t", len(added_pmids))
-        print("removed pmids:      \t", len(removed_pmids))
+        altered_json_annot_changes["summary"]["changes"]["pmids"]["added"] = len(reference_changes["pmids"]["added"])
+        altered_json_annot_changes["summary"]["changes"]["pmids"]["removed"] = len(reference_changes["pmids"]["removed"])
 
-        altered_json_annot_changes["summary"]["changes"]["references"]["added"] = len(added_references)
-        altered_json_annot_changes["summary"]["changes"]["references"]["removed"] = len(removed_references)
-
-        altered_json_annot_changes["summary"]["changes"]["pmids"]["added"] = len(added_pmids)
-        altered_json_annot_changes["summary"]["changes"]["pmids"]["removed"] = len(removed_pmids)
-
-        altered_json_annot_changes["detailed_changes"]["references"]["all"]["added"] = added_references
-        altered_json_annot_changes["detailed_changes"]["references"]["all"]["removed"] = removed_references
-
-        altered_json_annot_changes["detailed_changes"]["references"]["pmids"]["added"] = added_pmids
-        altered_json_annot_changes["detailed_changes"]["references"]["pmids"]["removed"] = removed_pmids
+        for key in ["all", "pmids"]:
+            for change in ["added", "removed"]:
+                altered_json_annot_changes["detailed_changes"]["references"][key][change] = REFERENCE_CHANGES_FILES[key][change]
 
     return altered_json_annot_changes  
 
 
-def create_text_report(json_changes):
-    text_report = ""
+def create_text_report(json_changes, reference_files = None):
+    return utils.render_report(partial(write_text_report, reference_files = reference_files), json_changes)
 
-    text_report = "CHANGES IN GO ANNOTATIONS"
+def report_warnings(json_changes):
+    """
+    Evidences and qualifiers of the model organisms no longer present, to be checked before release
+    """
+    warnings = ""
+    qualifiers = sorted(json_changes["summary"]["current"]["annotations"]["by_qualifier"].keys())
+    for taxon, val in json_changes["detailed_changes"]["annotations"]["by_model_organism"].items():
+        for evidence in utils.ev_all:
+            if evidence not in val["by_evidence"]:
+                print("WARNING: evidence " + evidence + " for taxon " + taxon + " is no longer present - QC should check before release")
+                warnings += "- evidence " + evidence + " for taxon " + taxon + " is no longer present\n"
+        for qualifier in qualifiers:
+            if qualifier not in val["by_qualifier"]:
+                print("WARNING: qualifier " + qualifier + " for taxon " + taxon + " is no longer present - QC should check before release")
+                warnings += "- qualifier " + qualifier + " for taxon " + taxon + " is no longer present\n"
+    return warnings
 
-    text_report += "\n\nSUMMARY: CURRENT RELEASE (" + json_changes["summary"]["current"]["release_date"] + ")"
-    text_report += "\nannotated bioentities:\t" + str(json_changes["summary"]["current"]["bioentities"])
-    text_report += "\ntaxa:\t" + str(json_changes["summary"]["current"]["taxa"])
-    text_report += "\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["current"]["taxa_filtered"])
-    text_report += "\nannotations:\t" + str(json_changes["summary"]["current"]["annotations"]["total"])
+def write_reference_lines(references, out, path = None):
+    """
+    Write detailed reference changes, one per line: copied line by line from the file listing them if given (see write_reference_changes),
+    otherwise from the list of the JSON report (a file name only when the changes were written to disk)
+    """
+    if path is not None:
+        with open(path, "r") as f:
+            for line in f:
+                out.write(line)
+        return
+    if isinstance(references, str):
+        out.write("see " + references)
+        return
+    for index, reference in enumerate(references):
+        out.write(("\n" if index > 0 else "") + reference)
+
+def write_text_report(json_changes, out, reference_files = None):
+    """
+    Write the TSV report to a text handle, section by section, without building it in memory (see utils.write_report)
+    reference_files: the files of the detailed reference changes returned by write_reference_changes, copied in the report
+    """
+    # the warnings come first in the report
+    warnings = report_warnings(json_changes)
+    if len(warnings) > 0:
+        out.write("WARNINGS:\n" + warnings + "\n")
+
+    out.write("CHANGES IN GO ANNOTATIONS")
+
+    out.write("\n\nSUMMARY: CURRENT RELEASE (" + json_changes["summary"]["current"]["release_date"] + ")")
+    out.write("\nannotated bioentities:\t" + str(json_changes["summary"]["current"]["bioentities"]))
+    out.write("\ntaxa:\t" + str(json_changes["summary"]["current"]["taxa"]))
+    out.write("\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["current"]["taxa_filtered"]))
+    out.write("\nannotations:\t" + str(json_changes["summary"]["current"]["annotations"]["total"]))
     for key, val in json_changes["summary"]["current"]["annotations"]["by_aspect"].items():
-        text_report += "\nannotations by aspect " + key + ":\t" + str(val)
+        out.write("\nannotations by aspect " + key + ":\t" + str(val))
     for key, val in json_changes["summary"]["current"]["annotations"]["by_evidence_cluster"].items():
-        text_report += "\nannotations by evidence cluster " + key + ":\t" + str(val)
+        out.write("\nannotations by evidence cluster " + key + ":\t" + str(val))
     for key, val in json_changes["summary"]["current"]["annotations"]["by_qualifier"].items():
-        text_report += "\nannotations by qualifier " + key + ":\t" + str(val)
-    text_report += "\nreferences:\t" + str(json_changes["summary"]["current"]["references"])
-    text_report += "\npmids:\t" + str(json_changes["summary"]["current"]["pmids"])
-
-    text_report += "\n\nSUMMARY: PREVIOUS RELEASE (" + json_changes["summary"]["previous"]["release_date"] + ")"
-    text_report += "\nannotated bioentities:\t" + str(json_changes["summary"]["previous"]["bioentities"])
-    text_report += "\ntaxa:\t" + str(json_changes["summary"]["previous"]["taxa"])
-    text_report += "\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["previous"]["taxa_filtered"])
-    text_report += "\nannotations:\t" + str(json_changes["summary"]["previous"]["annotations"]["total"])
+        out.write("\nannotations by qualifier " + key + ":\t" + str(val))
+    out.write("\nreferences:\t" + str(json_changes["summary"]["current"]["references"]))
+    out.write("\npmids:\t" + str(json_changes["summary"]["current"]["pmids"]))
+
+    out.write("\n\nSUMMARY: PREVIOUS RELEASE (" + json_changes["summary"]["previous"]["release_date"] + ")")
+    out.write("\nannotated bioentities:\t" + str(json_changes["summary"]["previous"]["bioentities"]))
+    out.write("\ntaxa:\t" + str(json_changes["summary"]["previous"]["taxa"]))
+    out.write("\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["previous"]["taxa_filtered"]))
+    out.write("\nannotations:\t" + str(json_changes["summary"]["previous"]["annotations"]["total"]))
     for key, val in json_changes["summary"]["previous"]["annotations"]["by_aspect"].items():
-        text_report += "\nannotations by aspect " + key + ":\t" + str(val)
+        out.write("\nannotations by aspect " + key + ":\t" + str(val))
     for key, val in json_changes["summary"]["previous"]["annotations"]["by_evidence_cluster"].items():
-        text_report += "\nannotations by evidence cluster " + key + ":\t" + str(val)
+        out.write("\nannotations by evidence cluster " + key + ":\t" + str(val))
     for key, val in json_changes["summary"]["previous"]["annotations"]["by_qualifier"].items():
-        text_report += "\nannotations by qualifier " + key + ":\t" + str(val)
-    text_report += "\nreferences:\t" + str(json_changes["summary"]["previous"]["references"])
-    text_report += "\npmids:\t" + str(json_changes["summary"]["previous"]["pmids"])
-
-    text_report += "\n\nSUMMARY: DIFF BETWEEN RELEASES"
-    text_report += "\nannotated bioentities:\t" + str(json_changes["summary"]["current"]["bioentities"] - json_changes["summary"]["previous"]["bioentities"])
-    text_report += "\ntaxa:\t" + str(json_changes["summary"]["current"]["taxa"] - json_changes["summary"]["previous"]["taxa"]) + "\t"
-    text_report += "\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["current"]["taxa_filtered"] - json_changes["summary"]["previous"]["taxa_filtered"])
-    text_report += "\nadded taxa\t" + str(json_changes["summary"]["changes"]["taxa"]["added"])
-    text_report += "\nremoved taxa\t" + str(json_changes["summary"]["changes"]["taxa"]["removed"])
-    text_report += "\nannotations:\t" + str(json_changes["summary"]["current"]["annotations"]["total"] - json_changes["summary"]["previous"]["annotations"]["total"])
+        out.write("\nannotations by qualifier " + key + ":\t" + str(val))
+    out.write("\nreferences:\t" + str(json_changes["summary"]["previous"]["references"]))
+    out.write("\npmids:\t" + str(json_changes["summary"]["previous"]["pmids"]))
+
+    out.write("\n\nSUMMARY: DIFF BETWEEN RELEASES")
+    out.write("\nannotated bioentities:\t" + str(json_changes["summary"]["current"]["bioentities"] - json_changes["summary"]["previous"]["bioentities"]))
+    out.write("\ntaxa:\t" + str(json_changes["summary"]["current"]["taxa"] - json_changes["summary"]["previous"]["taxa"]) + "\t")
+    out.write("\nfiltered taxa (> 1000 annotations):\t" + str(json_changes["summary"]["current"]["taxa_filtered"] - json_changes["summary"]["previous"]["taxa_filtered"]))
+    out.write("\nadded taxa\t" + str(json_changes["summary"]["changes"]["taxa"]["added"]))
+    out.write("\nremoved taxa\t" + str(json_changes["summary"]["changes"]["taxa"]["removed"]))
+    out.write("\nannotations:\t" + str(json_changes["summary"]["current"]["annotations"]["total"] - json_changes["summary"]["previous"]["annotations"]["total"]))
     for key, val in json_changes["summary"]["current"]["annotations"]["by_aspect"].items():
-        text_report += "\nannotations by aspect " + key + ":\t" + str(val - json_changes["summary"]["previous"]["annotations"]["by_aspect"][key])
+        out.write("\nannotations by aspect " + key + ":\t" + str(val - json_changes["summary"]["previous"]["annotations"]["by_aspect"][key]))
     for key, val in json_changes["summary"]["changes"]["annotations"]["by_evidence_cluster"].items():
-        text_report += "\nannotations by evidence cluster " + key + ":\t" + str(json_changes["summary"]["changes"]["annotations"]["by_evidence_cluster"][key])
+        out.write("\nannotations by evidence cluster " + key + ":\t" + str(json_changes["summary"]["changes"]["annotations"]["by_evidence_cluster"][key]))
     for key, val in json_changes["summary"]["changes"]["annotations"]["by_qualifier"].items():
-        text_report += "\nannotations by qualifier " + key + ":\t" + str(json_changes["summary"]["changes"]["annotations"]["by_qualifier"][key])
+        out.write("\nannotations by qualifier " + key + ":\t" + str(json_changes["summary"]["changes"]["annotations"]["by_qualifier"][key]))
 
     for key, val in json_changes["summary"]["changes"]["references"].items():
-        text_report += "\nreferences " + key + ":\t" + str(json_changes["summary"]["changes"]["references"][key])
+        out.write("\nreferences " + key + ":\t" + str(json_changes["summary"]["changes"]["references"][key]))
     
     for key, val in json_changes["summary"]["changes"]["pmids"].items():
-        text_report += "\npmids " + key + ":\t" + str(json_changes["summary"]["changes"]["pmids"][key])
+        out.write("\npmids " + key + ":\t" + str(json_changes["summary"]["changes"]["pmids"][key]))
 
 
 
 
-    text_report += "\n\nDETAILED CHANGES"
+    out.write("\n\nDETAILED CHANGES")
 
-    text_report += "\n\nCHANGES IN ANNOTATED BIOENTITIES\n"
-    text_report += "total\t" + str(json_changes["detailed_changes"]["bioentities"]["total"])
+    out.write("\n\nCHANGES IN ANNOTATED BIOENTITIES\n")
+    out.write("total\t" + str(json_changes["detailed_changes"]["bioentities"]["total"]))
 
-    # text_report += "\n\nCHANGES IN ANNOTATED BIOENTITIES BY TYPE (CLUSTER)"
+    # out.write("\n\nCHANGES IN ANNOTATED BIOENTITIES BY TYPE (CLUSTER)")
     # for key, val in json_changes["detailed_changes"]["bioentities"]["by_type"]["cluster"].items():
-    #     text_report += "\n" + key + "\t" + str(val)
+    #     out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nCHANGES IN ANNOTATED BIOENTITIES BY TYPE (ALL)"
+    out.write("\n\nCHANGES IN ANNOTATED BIOENTITIES BY TYPE (ALL)")
     for key, val in json_changes["detailed_changes"]["bioentities"]["by_type"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
 
 
 
-    text_report += "\n\nCHANGES IN ANNOTATIONS\n"
-    text_report += "total\t" + str(json_changes["detailed_changes"]["annotations"]["total"])
+    out.write("\n\nCHANGES IN ANNOTATIONS\n")
+    out.write("total\t" + str(json_changes["detailed_changes"]["annotations"]["total"]))
     for key, val in json_changes["detailed_changes"]["annotations"]["by_aspect"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
 
-    # text_report += "\n\nCHANGES IN ANNOTATIONS BY BIOENTITY TYPE (CLUSTER)"
+    # out.write("\n\nCHANGES IN ANNOTATIONS BY BIOENTITY TYPE (CLUSTER)")
     # for key, val in json_changes["detailed_changes"]["annotations"]["by_bioentity_type"]["cluster"].items():
-    #     text_report += "\n" + key + "\t" + str(val)
+    #     out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY BIOENTITY TYPE (ALL)"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY BIOENTITY TYPE (ALL)")
     for key, val in json_changes["detailed_changes"]["annotations"]["by_bioentity_type"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
             
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY QUALIFIER"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY QUALIFIER")
     for key, val in json_changes["detailed_changes"]["annotations"]["by_qualifier"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
-    # text_report += "\n\nCHANGES IN ANNOTATIONS BY EVIDENCE (CLUSTER)"
+    # out.write("\n\nCHANGES IN ANNOTATIONS BY EVIDENCE (CLUSTER)")
     # for key, val in json_changes["detailed_changes"]["annotations"]["by_evidence"]["cluster"].items():
-    #     text_report += "\n" + key + "\t" + str(val)
+    #     out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY EVIDENCE (ALL)"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY EVIDENCE (ALL)")
     for key, val in json_changes["detailed_changes"]["annotations"]["by_evidence"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
 
     ev_all = []
@@ -292,19 +367,17 @@ def create_text_report(json_changes):
     # using a hard coded evidence list
     ev_all = utils.ev_all
 
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY MODEL ORGANISM AND EVIDENCE (ALL) THEN QUALIFIER"
-    text_report += "\nTAXON\tALL"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY MODEL ORGANISM AND EVIDENCE (ALL) THEN QUALIFIER")
+    out.write("\nTAXON\tALL")
     for evidence in utils.ev_all:
-        text_report += "\t" + evidence
+        out.write("\t" + evidence)
 
     qualifiers = list(json_changes["summary"]["current"]["annotations"]["by_qualifier"].keys())
     qualifiers.sort()
     for qualifier in qualifiers:
-        text_report += "\t" + qualifier
+        out.write("\t" + qualifier)
 
-    text_report += "\n"
-
-    warnings = ""
+    out.write("\n")
 
     for taxon, val in json_changes["detailed_changes"]["annotations"]["by_model_organism"].items():
         taxon_all_annotations = 0
@@ -312,8 +385,6 @@ def create_text_report(json_changes):
 
         for evidence in ev_all:
             if evidence not in json_changes["detailed_changes"]["annotations"]["by_model_organism"][taxon]["by_evidence"]:
-                print("WARNING: evidence " + evidence + " for taxon " + taxon + " is no longer present - QC should check before release")
-                warnings += "- evidence " + evidence + " for taxon " + taxon + " is no longer present\n"
                 continue
 
             evival = json_changes["detailed_changes"]["annotations"]["by_model_organism"][taxon]["by_evidence"][evidence]
@@ -328,92 +399,76 @@ def create_text_report(json_changes):
                 taxon_all_annotations += te                
             else:
                 line += "\t0"
-        text_report += "\n" + taxon + "\t" + str(taxon_all_annotations) + line
+        out.write("\n" + taxon + "\t" + str(taxon_all_annotations) + line)
 
         for qualifier in qualifiers:
             if qualifier not in json_changes["detailed_changes"]["annotations"]["by_model_organism"][taxon]["by_qualifier"]:
-                print("WARNING: qualifier " + qualifier + " for taxon " + taxon + " is no longer present - QC should check before release")
-                warnings += "- qualifier " + qualifier + " for taxon " + taxon + " is no longer present\n"
                 continue
                 
             quaval = json_changes["detailed_changes"]["annotations"]["by_model_organism"][taxon]["by_qualifier"][qualifier]
             if isinstance(quaval, str):
                 quaval = int(quaval.split(" ")[0])
-            text_report += "\t" + str(quaval)
+            out.write("\t" + str(quaval))
 
 
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY GROUP"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY GROUP")
     for key, val in json_changes["detailed_changes"]["annotations"]["by_group"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
 
 
     
-    text_report += "\n\nADDED TAXA\t" + str(len(json_changes["detailed_changes"]["taxa"]["added"]))
+    out.write("\n\nADDED TAXA\t" + str(len(json_changes["detailed_changes"]["taxa"]["added"])))
     for key, val in json_changes["detailed_changes"]["taxa"]["added"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nREMOVED TAXA\t" + str(len(json_changes["detailed_changes"]["taxa"]["removed"]))
+    out.write("\n\nREMOVED TAXA\t" + str(len(json_changes["detailed_changes"]["taxa"]["removed"])))
     for key, val in json_changes["detailed_changes"]["taxa"]["removed"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
 
-    text_report += "\n\nCHANGES IN REFERENCES AND PMIDS\n"
-    text_report += "total\t" + str(json_changes["detailed_changes"]["references"]["all"]["total"])
-    text_report += "\t" + str(json_changes["detailed_changes"]["references"]["pmids"]["total"])
+    out.write("\n\nCHANGES IN REFERENCES AND PMIDS\n")
+    out.write("total\t" + str(json_changes["detailed_changes"]["references"]["all"]["total"]))
+    out.write("\t" + str(json_changes["detailed_changes"]["references"]["pmids"]["total"]))
  
-    text_report += "\n\nCHANGES IN REFERENCES AND PMIDS BY GROUP"
-    text_report += "\ngroup\treferences\t% references\tpmids\t% pmids"
+    out.write("\n\nCHANGES IN REFERENCES AND PMIDS BY GROUP")
+    out.write("\ngroup\treferences\t% references\tpmids\t% pmids")
     for key, val in json_changes["detailed_changes"]["references"]["all"]["by_group"].items():
-        text_report += "\n" + key + "\t" + str(val) + "\t" + str(json_changes["detailed_changes"]["references"]["pmids"]["by_group"][key])
+        out.write("\n" + key + "\t" + str(val) + "\t" + str(json_changes["detailed_changes"]["references"]["pmids"]["by_group"][key]))
 
-    text_report += "\n\nCHANGES IN REFERENCES AND PMIDS BY TAXON"
-    text_report += "\ntaxon\treferences\t% references\tpmids\t% pmids"
+    out.write("\n\nCHANGES IN REFERENCES AND PMIDS BY TAXON")
+    out.write("\ntaxon\treferences\t% references\tpmids\t% pmids")
     for key, val in json_changes["detailed_changes"]["references"]["all"]["by_filtered_taxon"].items():
         pmid_val = json_changes["detailed_changes"]["references"]["pmids"]["by_filtered_taxon"][key] if key in json_changes["detailed_changes"]["references"]["pmids"]["by_filtered_taxon"] else 0
-        text_report += "\n" + key + "\t" + str(val) + "\t" + str(pmid_val)
+        out.write("\n" + key + "\t" + str(val) + "\t" + str(pmid_val))
 
 
-    # text_report += "\n\nCHANGES IN ANNOTATED BIOENTITIES BY FILTERED TAXON AND BY BIOENTITY TYPE (CLUSTER)"
-    # text_report += "\ntaxon"
+    # out.write("\n\nCHANGES IN ANNOTATED BIOENTITIES BY FILTERED TAXON AND BY BIOENTITY TYPE (CLUSTER)")
+    # out.write("\ntaxon")
     # for type, nb in json_changes["detailed_changes"]["bioentities"]["by_type"]["cluster"].items():
-    #     text_report += "\t" + type
+    #     out.write("\t" + type)
     # for key, val in json_changes["detailed_changes"]["bioentities"]["by_filtered_taxon"]["cluster"].items():
-    #     text_report += "\n" + key
+    #     out.write("\n" + key)
     #     for type, nb in json_changes["detailed_changes"]["bioentities"]["by_type"]["cluster"].items():
-    #         text_report += "\t" + str(val[type]["A"]) if type in val else "\t0"
+    #         out.write("\t" + str(val[type]["A"]) if type in val else "\t0")
 
-    text_report += "\n\nCHANGES IN ANNOTATED BIOENTITIES BY FILTERED TAXON AND BY BIOENTITY TYPE (ALL)"
-    text_report += "\ntaxon"
+    out.write("\n\nCHANGES IN ANNOTATED BIOENTITIES BY FILTERED TAXON AND BY BIOENTITY TYPE (ALL)")
+    out.write("\ntaxon")
     for type, nb in json_changes["detailed_changes"]["bioentities"]["by_type"]["all"].items():
-        text_report += "\t" + type + "\t% " + type
+        out.write("\t" + type + "\t% " + type)
     for key, val in json_changes["detailed_changes"]["bioentities"]["by_filtered_taxon"]["all"].items():
-        text_report += "\n" + key
+        out.write("\n" + key)
         for type, nb in json_changes["detailed_changes"]["bioentities"]["by_type"]["all"].items():
-            text_report += "\t" + str(val[type]["A"]) if type in val else "\t0\t0"
+            out.write("\t" + str(val[type]["A"]) if type in val else "\t0\t0")
 
-    text_report += "\n\nCHANGES IN ANNOTATIONS BY TAXON"
+    out.write("\n\nCHANGES IN ANNOTATIONS BY TAXON")
     for key, val in json_changes["detailed_changes"]["annotations"]["by_taxon"].items():
-        text_report += "\n" + key + "\t" + str(val)
-
-    text_report += "\n\nADDED REFERENCES\n"
-    text_report += "\n".join(json_changes["detailed_changes"]["references"]["all"]["added"])
+        out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nREMOVED REFERENCES\n"
-    text_report += "\n".join(json_changes["detailed_changes"]["references"]["all"]["removed"])
+    for title, key, change in [("ADDED REFERENCES", "all", "added"), ("REMOVED REFERENCES", "all", "removed"), ("ADDED PMIDS", "pmids", "added"), ("REMOVED PMIDS", "pmids", "removed")]:
+        out.write("\n\n" + title + "\n")
+        write_reference_lines(json_changes["detailed_changes"]["references"][key][change], out, reference_files[key][change] if reference_files is not None else None)
 
-    text_report += "\n\nADDED PMIDS\n"
-    text_report += "\n".join(json_changes["detailed_changes"]["references"]["pmids"]["added"])
-
-    text_report += "\n\nREMOVED PMIDS\n"
-    text_report += "\n".join(json_changes["detailed_changes"]["references"]["pmids"]["removed"])
-
-
-    if len(warnings) == 0:
-        return text_report
-    else:
-        return "WARNINGS:\n" + warnings + "\n" + text_report
-    
 
 
 
@@ -470,8 +525,7 @@ def main(argv):
     print("Done.")
 
     print("Saving Stats to <" + output_tsv + "> ...")    
-    tsv_changes = create_text_report(json_changes)
-    utils.write_text(output_tsv, tsv_changes)
+    utils.write_report(output_tsv, write_text_report, json_changes)
     print("Done.")
     
 
@@ -1,4 +1,5 @@
 from obo_parser import OBO_Parser, TermState
+import obo_parser
 import sys, getopt, os, json
 
 import go_stats_utils as utils
@@ -10,113 +11,157 @@ release_date = "N/A"
 last_obo = None
 last_date = None
 
+# directory of the parsed ontology snapshots (see enable_snapshots)
+snapshot_dir = None
+
+def enable_snapshots(directory):
+    """
+    Keep a binary snapshot of each parsed ontology in directory, keyed by its url and data-version:
+    a release already parsed is then loaded from its snapshot, only its header being downloaded
+    """
+    global snapshot_dir
+    os.makedirs(directory, exist_ok = True)
+    snapshot_dir = directory
+
+def load_ontology(obo_url):
+    lines = utils.fetch_lines(obo_url)
+    if snapshot_dir is None:
+        return OBO_Parser(lines)
+
+    header, content = obo_parser.read_header(lines)
+    if "data-version" not in header:
+        return OBO_Parser(content)
+
+    path = obo_parser.snapshot_path(snapshot_dir, obo_url, header["data-version"])
+    if os.path.exists(path):
+        lines.close()
+        try:
+            return OBO_Parser.load(path)
+        except Exception as x:
+            print("Could not load snapshot <" + path + ">: ", x)
+            content = utils.fetch_lines(obo_url)
+
+    ontology = OBO_Parser(content)
+    ontology.save(path)
+    return ontology
+
+
+def ontology_version(obo_url):
+    """
+    data-version of an OBO file (None if it has none), only its header being downloaded
+    """
+    lines = utils.fetch_lines(obo_url)
+    try:
+        header, content = obo_parser.read_header(lines)
+        return header.get("data-version")
+    finally:
+        lines.close()
+
 
 def compute_changes(current_obo_url, previous_obo_url):
     # The new published OBO archive
     print("Loading current GO ontology (" + current_obo_url + ")...")
-    currentgo = OBO_Parser(utils.fetch(current_obo_url).text)
+    currentgo = load_ontology(current_obo_url)
 
     # A previously published OBO archive
     print("Loading previous GO ontology (" + previous_obo_url + ")...")
-    oldgo = OBO_Parser(utils.fetch(previous_obo_url).text)
+    oldgo = load_ontology(previous_obo_url)
 
-    # New GO Terms
     created = { }
     created_count = 0
-    for id, newterm in currentgo.get_terms().items():                                                                                                                                                                                
-        if not oldgo.has_term(id):
-            if newterm.namespace not in created:
-                created[newterm.namespace] = []
-            created[newterm.namespace].append({ "id": id, "name": newterm.name})
-            created_count += 1
-    print(str(created_count) + " terms created since last revision")
-
-    # Merged GO Terms    
     merged = { }
-    merged_list = []
     merged_count = 0
-    for id, oldterm in oldgo.get_terms().items():                                                                                                                                                                                  
-        if not currentgo.has_term(id):
-            if oldterm.namespace not in merged:
-                merged[oldterm.namespace] = []
-            alts = currentgo.get_alternate_terms(id)
-            if len(alts) > 0:
-                merged[oldterm.namespace].append( { "current": alts[0], "previous": { "id": id, "name": oldterm.name } } )
-                merged_count += 1
-                merged_list.append(oldterm.id)
-    print(str(merged_count) + " terms merged since last revision")
-    
-    # Obsoleted GO Terms
     obsoleted = { }
     obsoleted_count = 0
-    new_terms = currentgo.get_terms()
-    for id, oldterm in oldgo.get_terms().items():                                                                                                                                                                                  
-        if id not in new_terms:
-            if oldterm.namespace not in obsoleted:
-                obsoleted[oldterm.namespace] = []
-            if oldterm.id not in merged_list:
-                obsoleted[oldterm.namespace].append({ "id": id, "name": oldterm.name})
-                obsoleted_count += 1
-    print(str(obsoleted_count) + " terms obsoleted since last revision")
-    
-    # Existing GO Terms with structural changes (is_a, part_of, has_part etc)
     relations_changes = { }
     structural_count = 0
     structural_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.structural_equals(oldterm):
-                if newterm.namespace not in relations_changes:
-                    relations_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_structural_differences(oldterm).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                relations_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                structural_count += 1
-                structural_total_count += len(reasons)
-    print(str(structural_count) + " terms relation changes since last revision")
-    
-    
-    # Existing GO Terms with cross reference changes
     xrefs_changes = { }
     xrefs_count = 0
     xrefs_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.xrefs_equals(oldterm):
-                if newterm.namespace not in xrefs_changes:
-                    xrefs_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_xrefs_differences(oldterm).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                xrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                xrefs_count += 1
-                xrefs_total_count += newterm.count_xrefs_differences(oldterm)
-    print(str(xrefs_count) + " terms xrefs changes since last revision")
-
-    # Existing GO Terms with meta changes (synonyms, NO XREFS, definition, etc)
     meta_noxrefs_changes = { }
     meta_noxrefs_count = 0
     meta_noxrefs_total_count = 0
-    for id, newterm in currentgo.get_terms().items():
-        if oldgo.has_term(id):                                                                                                                                                                            
-            oldterm = oldgo.get_term(id)
-            if not newterm.meta_equals(oldterm, False):
-                if newterm.namespace not in meta_noxrefs_changes:
-                    meta_noxrefs_changes[newterm.namespace] = []
-                    
-                reasons = {}
-                for key, reason in newterm.explain_meta_differences(oldterm, False).items():
-                    reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
-                meta_noxrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
-                meta_noxrefs_count += 1                
-                meta_noxrefs_total_count += len(reasons)
+
+    # Single pass over the sorted ids of both releases; the fingerprints of the terms skip the unchanged ones
+    new_terms = currentgo.get_terms()
+    old_terms = oldgo.get_terms()
+    for id in sorted(new_terms.keys() | old_terms.keys()):
+        newterm = new_terms.get(id)
+        oldterm = old_terms.get(id)
+
+        if oldterm is not None and id not in new_terms:
+            # Merged GO Terms
+            merged_term = False
+            if not currentgo.has_term(id):
+                if oldterm.namespace not in merged:
+                    merged[oldterm.namespace] = []
+                alts = currentgo.get_alternate_terms(id)
+                if len(alts) > 0:
+                    merged[oldterm.namespace].append( { "current": alts[0], "previous": { "id": id, "name": oldterm.name } } )
+                    merged_count += 1
+                    merged_term = True
+
+            # Obsoleted GO Terms
+            if oldterm.namespace not in obsoleted:
+                obsoleted[oldterm.namespace] = []
+            if not merged_term:
+                obsoleted[oldterm.namespace].append({ "id": id, "name": oldterm.name})
+                obsoleted_count += 1
+
+        if newterm is None:
+            continue
+
+        # New GO Terms
+        if not oldgo.has_term(id):
+            if newterm.namespace not in created:
+                created[newterm.namespace] = []
+            created[newterm.namespace].append({ "id": id, "name": newterm.name})
+            created_count += 1
+            continue
+
+        oldterm = oldgo.get_term(id)
+
+        # Existing GO Terms with structural changes (is_a, part_of, has_part etc)
+        if not newterm.structural_equals(oldterm):
+            if newterm.namespace not in relations_changes:
+                relations_changes[newterm.namespace] = []
+            reasons = {}
+            for key, reason in newterm.explain_structural_differences(oldterm).items():
+                reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+            relations_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+            structural_count += 1
+            structural_total_count += len(reasons)
+
+        # Existing GO Terms with cross reference changes
+        if not newterm.xrefs_equals(oldterm):
+            if newterm.namespace not in xrefs_changes:
+                xrefs_changes[newterm.namespace] = []
+            reasons = {}
+            for key, reason in newterm.explain_xrefs_differences(oldterm).items():
+                reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+            xrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+            xrefs_count += 1
+            xrefs_total_count += newterm.count_xrefs_differences(oldterm)
+
+        # Existing GO Terms with meta changes (synonyms, NO XREFS, definition, etc)
+        if not newterm.meta_equals(oldterm, False):
+            if newterm.namespace not in meta_noxrefs_changes:
+                meta_noxrefs_changes[newterm.namespace] = []
+            reasons = {}
+            for key, reason in newterm.explain_meta_differences(oldterm, False).items():
+                reasons[key] = { "current" : reason['current'], "previous" : reason['previous'] }
+            meta_noxrefs_changes[newterm.namespace].append({ "id" : id, "name": newterm.name , "changes": reasons })
+            meta_noxrefs_count += 1
+            meta_noxrefs_total_count += len(reasons)
+
+    print(str(created_count) + " terms created since last revision")
+    print(str(merged_count) + " terms merged since last revision")
+    print(str(obsoleted_count) + " terms obsoleted since last revision")
+    print(str(structural_count) + " terms relation changes since last revision")
+    print(str(xrefs_count) + " terms xrefs changes since last revision")
     print(str(meta_noxrefs_count) + " terms meta (NO XREFS) changes since last revision")
- 
+
 
     release_date = currentgo.header['data-version']
     release_date = release_date[release_date.index("/") + 1:] if "/" in release_date else release_date
@@ -190,65 +235,67 @@ def flattern(A):
 
 
 def create_text_report(json_changes):
-    text_report = ""
+    return utils.render_report(write_text_report, json_changes)
 
-    text_report = "CHANGES IN GO ONTOLOGY"
+def write_text_report(json_changes, out):
+    """
+    Write the TSV report to a text handle, section by section, without building it in memory (see utils.write_report)
+    """
+    out.write("CHANGES IN GO ONTOLOGY")
     
-    text_report += "\n\nSUMMARY: CURRENT RELEASE"
+    out.write("\n\nSUMMARY: CURRENT RELEASE")
     for key, val in json_changes["summary"]["current"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nSUMMARY: PREVIOUS RELEASE"
+    out.write("\n\nSUMMARY: PREVIOUS RELEASE")
     for key, val in json_changes["summary"]["previous"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nSUMMARY: DIFF BETWEEN RELEASES"
+    out.write("\n\nSUMMARY: DIFF BETWEEN RELEASES")
     for key, val in json_changes["summary"]["changes"].items():
-        text_report += "\nchanges_" + key + "\t" + str(val)
+        out.write("\nchanges_" + key + "\t" + str(val))
 
 
-    text_report += "\n\nDETAILED CHANGES"
+    out.write("\n\nDETAILED CHANGES")
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["created_terms"]) + " CREATED TERMS"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["created_terms"]) + " CREATED TERMS")
     for key, val in json_changes["detailed_changes"]["created_terms"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["id"] + "\t" + item["name"]
+            out.write("\n" + key + "\t" + item["id"] + "\t" + item["name"])
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["obsolete_terms"]) + " OBSOLETED TERMS CHANGES"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["obsolete_terms"]) + " OBSOLETED TERMS CHANGES")
     for key, val in json_changes["detailed_changes"]["obsolete_terms"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["id"] + "\t" + item["name"]
+            out.write("\n" + key + "\t" + item["id"] + "\t" + item["name"])
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["merged_terms"]) + " MERGED TERMS CHANGES"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["merged_terms"]) + " MERGED TERMS CHANGES")
     for key, val in json_changes["detailed_changes"]["merged_terms"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["current"]["id"] + "\t" + item["current"]["name"] + "\tWAS\t" + "\t" + item["previous"]["id"] + "\t" + item["previous"]["name"]
+            out.write("\n" + key + "\t" + item["current"]["id"] + "\t" + item["current"]["name"] + "\tWAS\t" + "\t" + item["previous"]["id"] + "\t" + item["previous"]["name"])
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["meta_statements"]) + " META CHANGES"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["meta_statements"]) + " META CHANGES")
     for key, val in json_changes["detailed_changes"]["meta_statements"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["id"] + "\t" + item["name"]
+            out.write("\n" + key + "\t" + item["id"] + "\t" + item["name"])
             data = item["changes"]
             for field in data:
-                text_report += "\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"])
+                out.write("\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"]))
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["cross_references"]) + " CROSS REFERENCES CHANGES"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["cross_references"]) + " CROSS REFERENCES CHANGES")
     for key, val in json_changes["detailed_changes"]["cross_references"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["id"] + "\t" + item["name"]
+            out.write("\n" + key + "\t" + item["id"] + "\t" + item["name"])
             data = item["changes"]
             for field in data:
-                text_report += "\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"])
+                out.write("\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"]))
 
-    text_report += "\n\n" + count(json_changes["detailed_changes"]["relations"]) + " RELATION CHANGES"
+    out.write("\n\n" + count(json_changes["detailed_changes"]["relations"]) + " RELATION CHANGES")
     for key, val in json_changes["detailed_changes"]["relations"].items():
         for item in val:
-            text_report += "\n" + key + "\t" + item["id"] + "\t" + item["name"]
+            out.write("\n" + key + "\t" + item["id"] + "\t" + item["name"])
             data = item["changes"]
             for field in data:
-                text_report += "\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"])
-
-    return text_report
+                out.write("\n\t" + field + "\t" + format(data[field]["current"]) + "\tWAS\t" +format(data[field]["previous"]))
 
 def format(item):
     if type(item) == str:
@@ -267,7 +314,7 @@ def count(map):
 
 
 def print_help():
-    print('\nUsage: python go_ontology_changes.py -c <current_obo_url> -p <previous_obo_url> -o <output_rep>\n')
+    print('\nUsage: python go_ontology_changes.py -c <current_obo_url> -p <previous_obo_url> -o <output_rep> [--snapshots <snapshot_dir>]\n')
 
 
 def main(argv):
@@ -280,7 +327,7 @@ def main(argv):
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"c:p:o:",["cobo=","pobo=","orep="])
+        opts, argv = getopt.getopt(argv,"c:p:o:",["cobo=","pobo=","orep=","snapshots="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -295,6 +342,8 @@ def main(argv):
             previous_obo_url = arg
         elif opt in ("-o", "-orep"):
             output_rep = arg
+        elif opt == "--snapshots":
+            enable_snapshots(arg)
         
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -316,8 +365,7 @@ def main(argv):
     print("Done.")
 
     print("Saving Stats to <" + output_tsv + "> ...")    
-    tsv_changes = create_text_report(json_changes)
-    utils.write_text(output_tsv, tsv_changes)
+    utils.write_report(output_tsv, write_text_report, json_changes)
     print("Done.")
     
 
@@ -0,0 +1,312 @@
+# Release history index of the GO ontology, built from a sequence of OBO releases
+#
+# Instead of diffing two OBO files at a time, each release is appended once to the index, which keeps:
+#   * the versioned state of every term: a new record is only written when its state changes between two releases
+#     (status valid / obsolete / absent, namespace, structural / meta / xrefs fingerprints, term merged into)
+#   * the events of every term between two consecutive releases: created, merged, obsoleted, changed
+# Both are stored column-wise, one file per column, and appended in place when a new release lands.
+# The diff between any two releases indexed is then a lookup of the state of each term in both releases.
+#
+# Index directory:
+#   * history.json: releases (data-version, url), namespaces and the number of terms, records and events
+#   * terms.txt: the term ids, one per line, a term being referred to by its line number
+#   * records.<column>.bin and events.<column>.bin: little-endian arrays, one value per record / event
+
+import sys, getopt, os, json
+from bisect import bisect_right
+
+import go_ontology_changes
+import go_stats_utils as utils
+
+STATUS_ABSENT = 0
+STATUS_VALID = 1
+STATUS_OBSOLETE = 2
+
+# no target term (term not merged)
+NO_TARGET = 0xFFFFFFFF
+
+EVENTS = ["created", "merged", "obsoleted", "changed"]
+
+# bits of the changes of a "changed" event, named as in the detailed changes of go_ontology_changes
+CHANGES = [(1, "relations"), (2, "meta_statements"), (4, "cross_references")]
+
+RECORD_COLUMNS = [("term", "I"), ("release", "H"), ("status", "B"), ("namespace", "B"), ("structural", "Q"), ("meta", "Q"), ("xrefs", "Q"), ("target", "I")]
+EVENT_COLUMNS = [("term", "I"), ("release", "H"), ("event", "B"), ("target", "I"), ("changes", "B")]
+
+
+def compare(before, after):
+    """
+    Event of a term between two of its states (None if the term is unknown in a release)
+    Return (event, target, changes) or None, with the same rules as go_ontology_changes.compute_changes
+    """
+    if after is not None and after[0] == STATUS_VALID:
+        if before is None or before[0] == STATUS_ABSENT:
+            return ("created", NO_TARGET, 0)
+        changes = (1 if before[2] != after[2] else 0) | (2 if before[3] != after[3] else 0) | (4 if before[4] != after[4] else 0)
+        return ("changed", NO_TARGET, changes) if changes else None
+    if before is not None and before[0] == STATUS_VALID:
+        if after is not None and after[0] == STATUS_ABSENT and after[5] != NO_TARGET:
+            return ("merged", after[5], 0)
+        return ("obsoleted", NO_TARGET, 0)
+    return None
+
+
+class OntologyHistory:
+    """
+    Release history index stored in a directory (created if missing)
+    Releases are referred to by their position, their data-version (e.g. "releases/2020-01-01") or its date ("2020-01-01")
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        meta = { "releases" : [], "namespaces" : [], "terms" : 0, "records" : 0, "events" : 0 }
+        if os.path.exists(self.path("history.json")):
+            with open(self.path("history.json"), "r") as f:
+                meta = json.load(f)
+        self.releases = meta["releases"]
+        self.namespaces = meta["namespaces"]
+
+        self.term_ids = []
+        if meta["terms"] > 0:
+            with open(self.path("terms.txt"), "r") as f:
+                for line in f:
+                    if len(self.term_ids) == meta["terms"]:
+                        break
+                    self.term_ids.append(sys.intern(line.rstrip("\n")))
+        self.term_index = { id : position for position, id in enumerate(self.term_ids) }
+
+        self.records = { name : utils.read_column(self.path("records." + name + ".bin"), typecode, meta["records"]) for name, typecode in RECORD_COLUMNS }
+        self.events = { name : utils.read_column(self.path("events." + name + ".bin"), typecode, meta["events"]) for name, typecode in EVENT_COLUMNS }
+
+        # term position -> positions of its records and events, in release order
+        self.term_records = [[] for id in self.term_ids]
+        for position, term in enumerate(self.records["term"]):
+            self.term_records[term].append(position)
+        self.term_events = [[] for id in self.term_ids]
+        for position, term in enumerate(self.events["term"]):
+            self.term_events[term].append(position)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __len__(self):
+        return len(self.releases)
+
+    def release_index(self, release):
+        if isinstance(release, int):
+            if release < 0 or release >= len(self.releases):
+                raise KeyError(release)
+            return release
+        for index, known in enumerate(self.releases):
+            version = known["data-version"]
+            if release == version or release == version[version.find("/") + 1:] or release == str(index):
+                return index
+        raise KeyError(release)
+
+    def state(self, term, release):
+        """
+        State (status, namespace, structural, meta, xrefs, target) of a term position in a release, None if not known yet
+        """
+        positions = self.term_records[term]
+        releases = [self.records["release"][position] for position in positions]
+        found = bisect_right(releases, release) - 1
+        if found < 0:
+            return None
+        position = positions[found]
+        return tuple(self.records[name][position] for name, typecode in RECORD_COLUMNS[2:])
+
+
+    def add_release(self, ontology, url = None):
+        """
+        Append a parsed ontology (obo_parser.OBO_Parser) as the latest release of the index
+        Return the position of the release
+        """
+        version = ontology.header.get("data-version")
+        if version is None:
+            raise ValueError("Releases must have a data-version")
+        if any(known["data-version"] == version for known in self.releases):
+            raise ValueError("Release already indexed: " + version)
+
+        release = len(self.releases)
+        counts = (len(self.term_ids), len(self.records["term"]), len(self.events["term"]))
+
+        states = { }
+        for id, data in ontology.get_nodes():
+            term = data['object']
+            if term.namespace not in self.namespaces:
+                self.namespaces.append(term.namespace)
+            states[self.term_position(id)] = (STATUS_OBSOLETE if term.is_obsolete else STATUS_VALID, self.namespaces.index(term.namespace),
+                                              term.structural_fingerprint, term.meta_fingerprint, term.xrefs_fingerprint, NO_TARGET)
+
+        for term, id in enumerate(self.term_ids):
+            before = self.state(term, release - 1) if release > 0 else None
+            after = states.get(term)
+            if after is None:
+                # no longer in the ontology: possibly merged into the term declaring it as an alternate id
+                alternates = ontology.alt_index.get(id)
+                after = (STATUS_ABSENT, before[1] if before else 0, 0, 0, 0, self.term_position(alternates[0]) if alternates else NO_TARGET)
+            if after != before:
+                self.add_record(term, release, after)
+            event = compare(before, after) if release > 0 else None
+            if event is not None:
+                self.add_event(term, release, *event)
+
+        self.releases.append({ "data-version" : version, "url" : url })
+        self.save(*counts)
+        return release
+
+    def term_position(self, id):
+        if id not in self.term_index:
+            self.term_index[id] = len(self.term_ids)
+            self.term_ids.append(sys.intern(id))
+            self.term_records.append([])
+            self.term_events.append([])
+        return self.term_index[id]
+
+    def add_record(self, term, release, state):
+        self.term_records[term].append(len(self.records["term"]))
+        for (name, typecode), val in zip(RECORD_COLUMNS, (term, release) + state):
+            self.records[name].append(val)
+
+    def add_event(self, term, release, event, target, changes):
+        self.term_events[term].append(len(self.events["term"]))
+        for (name, typecode), val in zip(EVENT_COLUMNS, (term, release, EVENTS.index(event), target, changes)):
+            self.events[name].append(val)
+
+    def save(self, terms, records, events):
+        # append the new terms, records and events, then commit them by writing history.json
+        with open(self.path("terms.txt"), "a") as f:
+            f.truncate(sum(len(id.encode("utf-8")) + 1 for id in self.term_ids[:terms]))
+            for id in self.term_ids[terms:]:
+                f.write(id + "\n")
+        for name, typecode in RECORD_COLUMNS:
+            utils.append_column(self.path("records." + name + ".bin"), self.records[name], records)
+        for name, typecode in EVENT_COLUMNS:
+            utils.append_column(self.path("events." + name + ".bin"), self.events[name], events)
+
+        meta = { "releases" : self.releases, "namespaces" : self.namespaces, "terms" : len(self.term_ids), "records" : len(self.records["term"]), "events" : len(self.events["term"]) }
+        with open(self.path("history.json.tmp"), "w") as f:
+            json.dump(meta, f, indent = 2)
+        os.replace(self.path("history.json.tmp"), self.path("history.json"))
+
+
+    def term_history(self, id):
+        """
+        Events of a term across the indexed releases, e.g. [ { "release": "releases/2020-01-01", "event": "created" }, ... ]
+        """
+        if id not in self.term_index:
+            return []
+        history = []
+        for position in self.term_events[self.term_index[id]]:
+            event = { "release" : self.releases[self.events["release"][position]]["data-version"], "event" : EVENTS[self.events["event"][position]] }
+            if self.events["target"][position] != NO_TARGET:
+                event["into"] = self.term_ids[self.events["target"][position]]
+            if self.events["changes"][position]:
+                event["changes"] = [name for bit, name in CHANGES if self.events["changes"][position] & bit]
+            history.append(event)
+        return history
+
+    def diff(self, previous, current):
+        """
+        Terms created, obsoleted, merged or changed between two indexed releases, grouped by namespace
+        as in the detailed changes of go_ontology_changes.compute_changes (ids only, the index keeping no labels)
+        """
+        previous = self.release_index(previous)
+        current = self.release_index(current)
+        report = { "created_terms" : { }, "obsolete_terms" : { }, "merged_terms" : { }, "meta_statements" : { }, "cross_references" : { }, "relations" : { } }
+        for term in sorted(range(len(self.term_ids)), key = self.term_ids.__getitem__):
+            before = self.state(term, previous)
+            after = self.state(term, current)
+            event = compare(before, after)
+            if event is None:
+                continue
+            id = self.term_ids[term]
+            event, target, changes = event
+            if event == "created":
+                group(report["created_terms"], self.namespaces[after[1]], { "id" : id })
+            elif event == "merged":
+                group(report["merged_terms"], self.namespaces[before[1]], { "current" : { "id" : self.term_ids[target] }, "previous" : { "id" : id } })
+            elif event == "obsoleted":
+                group(report["obsolete_terms"], self.namespaces[before[1]], { "id" : id })
+            else:
+                for bit, name in CHANGES:
+                    if changes & bit:
+                        group(report[name], self.namespaces[after[1]], { "id" : id })
+        return report
+
+
+# utility function to add an item to a map of lists
+def group(map, key, item):
+    if key not in map:
+        map[key] = []
+    map[key].append(item)
+
+
+
+def print_help():
+    print('\nUsage: python go_ontology_history.py -i <history_dir> [-a <obo_url>]* [-t <term_id>] [-d <previous_release>,<current_release>] [-o <output_json>] [--snapshots <snapshot_dir>]\n')
+    print('\t-a: append a release to the history (repeat the option to append several releases, oldest first)')
+    print('\t-t: print the history of a term')
+    print('\t-d: print the changes between two indexed releases, given by data-version or date\n')
+
+
+def main(argv):
+    history_dir = ''
+    obo_urls = []
+    term_id = ''
+    releases = ''
+    output_json = ''
+
+    try:
+        opts, argv = getopt.getopt(argv,"i:a:t:d:o:h",["history=","append=","term=","diff=","output=","snapshots="])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-i", "--history"):
+            history_dir = arg
+        elif opt in ("-a", "--append"):
+            obo_urls.append(arg)
+        elif opt in ("-t", "--term"):
+            term_id = arg
+        elif opt in ("-d", "--diff"):
+            releases = arg
+        elif opt in ("-o", "--output"):
+            output_json = arg
+        elif opt == "--snapshots":
+            go_ontology_changes.enable_snapshots(arg)
+
+    if history_dir == '' or (releases != '' and "," not in releases):
+        print_help()
+        sys.exit(2)
+
+    history = OntologyHistory(history_dir)
+    for obo_url in obo_urls:
+        print("Loading GO ontology (" + obo_url + ")...")
+        ontology = go_ontology_changes.load_ontology(obo_url)
+        release = history.add_release(ontology, obo_url)
+        print("Release " + ontology.header["data-version"] + " indexed (" + str(release + 1) + " releases)")
+
+    result = None
+    if term_id != '':
+        result = history.term_history(term_id)
+    elif releases != '':
+        previous, current = releases.split(",", 1)
+        result = history.diff(previous, current)
+
+    if result is not None:
+        if output_json != '':
+            with open(output_json, "w") as f:
+                json.dump(result, f, indent = 2)
+        else:
+            print(json.dumps(result, indent = 2))
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
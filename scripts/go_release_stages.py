@@ -0,0 +1,385 @@
+# Stage graph of the release statistics pipeline shared by go_reports, go_refine_stats and go_bootstrap
+#
+# Each stage declares the run parameters and the other stages it reads, and the function computing its output:
+#   * a run only executes the stages needed by its targets, each at most once, its output being shared by the stages reading it
+#   * the stages whose inputs are ready run in parallel (e.g. the GOLr stats, the ontology changes and the previous stats):
+#     only the GOLr stats use the module globals of go_stats (GOLr url, shared responses, checkpoint), the references being
+#     given the GOLr url, and the request profile of go_stats only records the calls to the GOLr
+#   * with a memo directory, the output of the memoized stages is saved with the key of their inputs (parameters, version
+#     of the external data, keys of the stages read), so that a later run only recomputes the stages whose inputs changed
+#
+# The GOLr stats are keyed by the GOLr url and release date, and by the number of documents of each category in the GOLr
+# index, the taxon index and the go_stats queries (see golr_stats_version), so that a reloaded GOLr is not taken for the
+# memoized one; the ontology changes are keyed by the urls and data-versions of both OBO files.
+# The cheap stages deriving reports from the others, and the files of the previous release (no version), are not memoized.
+
+import os, json, copy, hashlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import go_stats
+import go_ontology_changes
+import go_annotation_changes
+
+import go_stats_utils as utils
+
+# number of stages run in parallel
+max_workers = 4
+
+
+class Stage:
+    """
+    A stage of the pipeline: compute is called with the outputs of the stages named in inputs and the run parameters named in params,
+    as keyword arguments. version(**params), if given, identifies the external data read by the stage (e.g. the data-version of a file):
+    the stage is not memoized when it returns None. A stage without version is keyed by its parameters and inputs only, so a stage
+    reading external data that has no version must be memo = False. The output of memoized stages must be JSON serializable
+    """
+
+    def __init__(self, name, compute, inputs = (), params = (), version = None, memo = True):
+        self.name = name
+        self.compute = compute
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.version = version
+        self.memo = memo
+
+
+class StageGraph:
+    """
+    Stages of a run, with their outputs memoized in memo_dir if given (created if missing)
+    """
+
+    def __init__(self, stages, memo_dir = None):
+        self.stages = { stage.name : stage for stage in stages }
+        self.memo_dir = memo_dir
+        if memo_dir is not None:
+            os.makedirs(memo_dir, exist_ok = True)
+        # stage name -> key of its inputs, once resolved (computed or found in memo_dir)
+        self.keys = { }
+        self.outputs = { }
+
+    def memo_path(self, name, extension):
+        return os.path.join(self.memo_dir, name + extension)
+
+    def needed(self, targets):
+        """
+        Names of the stages needed by the targets, in declaration order
+        """
+        needed = set()
+        stack = list(targets)
+        while len(stack) > 0:
+            name = stack.pop()
+            if name not in self.stages:
+                raise KeyError("Unknown stage: " + name)
+            if name not in needed:
+                needed.add(name)
+                stack += self.stages[name].inputs
+        return [name for name in self.stages if name in needed]
+
+    def key(self, stage, params):
+        """
+        Key of the inputs of a stage, None if the version of its external data is unknown
+        """
+        values = { name : params[name] for name in stage.params }
+        version = ""
+        # the version of the external data is only needed to find memoized outputs
+        if stage.version is not None and self.memo_dir is not None and stage.memo:
+            version = stage.version(**values)
+        if version is None:
+            return None
+        fields = [stage.name, values, version, [self.keys[name] for name in stage.inputs]]
+        return hashlib.blake2b(json.dumps(fields, sort_keys = True).encode("utf-8"), digest_size = 16).hexdigest()
+
+    def memoized(self, stage, key):
+        if self.memo_dir is None or not stage.memo or key is None or not os.path.exists(self.memo_path(stage.name, ".key")):
+            return False
+        with open(self.memo_path(stage.name, ".key"), "r") as f:
+            return f.read() == key
+
+    def save(self, stage, key, output):
+        # the key is written last: an interrupted save is never taken for a valid memo
+        if os.path.exists(self.memo_path(stage.name, ".key")):
+            os.remove(self.memo_path(stage.name, ".key"))
+        utils.write_json(self.memo_path(stage.name, ".json"), output)
+        utils.write_text(self.memo_path(stage.name, ".key"), key)
+
+    def output(self, name):
+        """
+        Output of a resolved stage, loaded from memo_dir if it was not computed by this run
+        """
+        if name not in self.outputs:
+            with open(self.memo_path(name, ".json"), "r") as f:
+                self.outputs[name] = json.load(f)
+        return self.outputs[name]
+
+    def resolve(self, stage, params):
+        """
+        Return the key of a stage whose inputs are resolved, and a function computing its output (None if memoized)
+        """
+        key = self.key(stage, params)
+        if self.memoized(stage, key):
+            print("Stage " + stage.name + ": inputs unchanged, using <" + self.memo_path(stage.name, ".json") + ">")
+            return key, None
+        kwargs = { name : params[name] for name in stage.params }
+        for name in stage.inputs:
+            kwargs[name] = self.output(name)
+
+        def compute():
+            print("Stage " + stage.name + ": running...")
+            output = stage.compute(**kwargs)
+            if self.memo_dir is not None and stage.memo and key is not None:
+                self.save(stage, key, output)
+            print("Stage " + stage.name + ": done")
+            return output
+        return key, compute
+
+    def run(self, targets, params):
+        """
+        Run the stages needed by the targets (names of stages) with the given parameters { name: value }
+        Return the { stage name: output } of the targets
+        """
+        pending = self.needed(targets)
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            running = { }
+            while len(pending) > 0 or len(running) > 0:
+                resolved = len(self.keys)
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if any(input not in self.keys for input in stage.inputs):
+                        continue
+                    pending.remove(name)
+                    key, compute = self.resolve(stage, params)
+                    if compute is None:
+                        self.keys[name] = key
+                    else:
+                        running[pool.submit(compute)] = (name, key)
+                if len(running) == 0:
+                    if len(self.keys) == resolved:
+                        raise ValueError("Stages waiting for each other: " + ", ".join(pending))
+                    continue
+                done, not_done = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    name, key = running.pop(future)
+                    self.outputs[name] = future.result()
+                    # a stage without versioned inputs gets a key of its own, so that the stages reading it are recomputed too
+                    self.keys[name] = key if key is not None else os.urandom(16).hex()
+        return { name : self.output(name) for name in targets }
+
+
+
+def compute_all_stats(golr_url, release_date):
+    """
+    Stats including and excluding protein binding, computed together to share their GOLr queries,
+    with the labels of the reference genomes (taxon_label) that the summary needs
+    """
+    all_stats = go_stats.compute_stats(golr_url, release_date, variants = [False, True])
+    return { "stats" : all_stats[False], "stats_no_pb" : all_stats[True], "taxon_labels" : { taxon : go_stats.taxon_label(taxon) for taxon in go_stats.reference_genomes_ids } }
+
+# GOLr query counting the documents of each category, which change when the GOLr index is reloaded
+golr_select_document_counts = 'select?q=*:*&rows=0&wt=json&facet=true&facet.field=document_category&facet.limit=-1'
+
+def golr_stats_version(golr_url, release_date):
+    """
+    Version of the GOLr stats: the number of documents of each category in the GOLr index (asked to GOLr, never to the
+    GOLr cache), the size and date of the taxon index and the go_stats queries; None if GOLr did not answer
+    """
+    r = utils.fetch(golr_url + golr_select_document_counts)
+    if r is None or r.status_code != 200:
+        return None
+    response = r.json()
+    taxon_index = None
+    if go_stats.taxon_index_path is not None and os.path.exists(go_stats.taxon_index_path):
+        taxon_index = [go_stats.taxon_index_path, os.path.getsize(go_stats.taxon_index_path), os.path.getmtime(go_stats.taxon_index_path)]
+    queries = { name : value for name, value in vars(go_stats).items() if name.startswith("golr_select") }
+    return {
+        "documents" : response["response"]["numFound"],
+        "by_category" : response["facet_counts"]["facet_fields"]["document_category"],
+        "taxon_index" : taxon_index,
+        "queries" : queries,
+        "reference_genomes" : go_stats.reference_genomes_ids
+    }
+
+def select_stats(all_stats):
+    return all_stats["stats"]
+
+def select_stats_no_pb(all_stats):
+    return all_stats["stats_no_pb"]
+
+def compute_references(all_stats, golr_url):
+    # all_stats is read so that the reference facet registered by compute_stats is reused
+    return go_stats.get_references(golr_url)
+
+def ontology_versions(current_obo_url, previous_obo_url):
+    current_version = go_ontology_changes.ontology_version(current_obo_url)
+    previous_version = go_ontology_changes.ontology_version(previous_obo_url)
+    if current_version is None or previous_version is None:
+        return None
+    return [current_version, previous_version]
+
+def fetch_stats(url):
+    r = utils.fetch(url)
+    if r is None or r.status_code != 200:
+        raise IOError("Query GET " + url + " failed: " + (str(r.status_code) if r is not None else "no response"))
+    return r.json()
+
+def fetch_previous_stats(previous_stats_url):
+    return fetch_stats(previous_stats_url)
+
+def fetch_previous_stats_no_pb(previous_stats_no_pb_url):
+    return fetch_stats(previous_stats_no_pb_url)
+
+def fetch_previous_references(previous_references_url):
+    return utils.ReferenceSet(line.split("\t")[0] for line in utils.fetch_lines(previous_references_url))
+
+def compare_references(references, previous_references):
+    current = utils.ReferenceSet(references.keys())
+    return { "current" : current, "previous" : previous_references, "changes" : go_annotation_changes.diff_references(current, previous_references) }
+
+def annotation_changes(stats, previous_stats):
+    return go_annotation_changes.compute_changes(stats, previous_stats)
+
+def annotation_changes_no_pb(stats_no_pb, previous_stats_no_pb):
+    return go_annotation_changes.compute_changes(stats_no_pb, previous_stats_no_pb)
+
+def annotation_report(stats, refine, previous_stats, reference_changes, annotation_changes):
+    """
+    go-annotation-changes of the release: the changes merged with the stats, with the reference changes
+    """
+    merged = utils.merge_dict(stats, annotation_changes)
+    return go_annotation_changes.alter_annotation_changes(refine["stats"], previous_stats, reference_changes["current"], reference_changes["previous"], merged, reference_changes["changes"])
+
+def annotation_report_no_pb(refine, previous_stats_no_pb, reference_changes, annotation_changes_no_pb):
+    return go_annotation_changes.alter_annotation_changes(refine["stats_no_pb"], previous_stats_no_pb, reference_changes["current"], reference_changes["previous"], annotation_changes_no_pb, reference_changes["changes"])
+
+
+def refine_stats(stats, stats_no_pb, ontology_changes):
+    """
+    Ontology stats of the release, and the go-stats / go-stats-no-pb refined with them
+    """
+    ontology = ontology_changes["summary"]["current"].copy()
+    del ontology["release_date"]
+    ontology["changes_created_terms"] = ontology_changes["summary"]["changes"]["created_terms"]
+    ontology["changes_valid_terms"] = ontology_changes["summary"]["changes"]["valid_terms"]
+    ontology["changes_obsolete_terms"] = ontology_changes["summary"]["changes"]["obsolete_terms"]
+    ontology["changes_merged_terms"] = ontology_changes["summary"]["changes"]["merged_terms"]
+
+    ontology["changes_biological_process_terms"] = ontology_changes["summary"]["changes"]["biological_process_terms"]
+    ontology["changes_molecular_function_terms"] = ontology_changes["summary"]["changes"]["molecular_function_terms"]
+    ontology["changes_cellular_component_terms"] = ontology_changes["summary"]["changes"]["cellular_component_terms"]
+
+    refined = { "ontology" : ontology }
+    for key, val in [("stats", stats), ("stats_no_pb", stats_no_pb)]:
+        refined[key] = {
+            "release_date" : val["release_date"],
+            "ontology" : ontology,
+            "annotations" : val["annotations"],
+            "taxa" : val["taxa"],
+            "bioentities" : val["bioentities"],
+            "references" : val["references"]
+        }
+    return refined
+
+def create_summary(refine, all_stats, annotation_report = None):
+    """
+    go-stats-summary of the release; with the annotation changes from the previous release (annotation_report), the summary
+    also has the annotations by qualifier and the references / pmids added and removed
+    """
+    json_stats = refine["stats"]
+    json_stats_no_pb = refine["stats_no_pb"]
+    labels = all_stats["taxon_labels"]
+
+    # copied as the B (protein binding) counts are added
+    annotations_by_reference_genome = copy.deepcopy(json_stats["annotations"]["by_model_organism"])
+    for taxon in annotations_by_reference_genome:
+        for ecode in annotations_by_reference_genome[taxon]["by_evidence"]:
+            annotations_by_reference_genome[taxon]["by_evidence"][ecode]["B"] = json_stats["annotations"]["by_model_organism"][taxon]["by_evidence"][ecode]["F"] - json_stats_no_pb["annotations"]["by_model_organism"][taxon]["by_evidence"][ecode]["F"]
+        for ecode in annotations_by_reference_genome[taxon]["by_evidence_cluster"]:
+            annotations_by_reference_genome[taxon]["by_evidence_cluster"][ecode]["B"] = json_stats["annotations"]["by_model_organism"][taxon]["by_evidence_cluster"][ecode]["F"] - json_stats_no_pb["annotations"]["by_model_organism"][taxon]["by_evidence_cluster"][ecode]["F"]
+
+    bioentities_by_reference_genome = { }
+    references_by_reference_genome = { }
+    pmids_by_reference_genome = { }
+    for taxon in go_stats.reference_genomes_ids:
+        key = labels[taxon]
+        bioentities_by_reference_genome[key] = json_stats["bioentities"]["by_filtered_taxon"]["cluster"][key] if key in json_stats["bioentities"]["by_filtered_taxon"]["cluster"] else { }
+        # TODO: we don't have a way to filter on bioentity documents without direct annotations to PB ?
+        references_by_reference_genome[key] = json_stats["references"]["all"]["by_filtered_taxon"][key] if key in json_stats["references"]["all"]["by_filtered_taxon"] else { }
+        pmids_by_reference_genome[key] = json_stats["references"]["pmids"]["by_filtered_taxon"][key] if key in json_stats["references"]["pmids"]["by_filtered_taxon"] else { }
+
+    annotations = {
+        "total" : json_stats["annotations"]["total"],
+        "total_no_pb" : json_stats_no_pb["annotations"]["total"],
+        "total_pb" : json_stats["annotations"]["total"] - json_stats_no_pb["annotations"]["total"],
+        "by_aspect" : {
+            "P" : json_stats["annotations"]["by_aspect"]["P"],
+            "F" : json_stats["annotations"]["by_aspect"]["F"],
+            "C" : json_stats["annotations"]["by_aspect"]["C"],
+            "B" : json_stats["annotations"]["by_aspect"]["F"] - json_stats_no_pb["annotations"]["by_aspect"]["F"]
+        },
+        "by_bioentity_type_cluster" : json_stats["annotations"]["by_bioentity_type"]["cluster"],
+        "by_bioentity_type_cluster_no_pb" : json_stats_no_pb["annotations"]["by_bioentity_type"]["cluster"]
+    }
+    if annotation_report is not None:
+        annotations["by_qualifier"] = json_stats["annotations"]["by_qualifier"]
+    annotations["by_evidence_cluster"] = json_stats["annotations"]["by_evidence"]["cluster"]
+    annotations["by_evidence_cluster_no_pb"] = json_stats_no_pb["annotations"]["by_evidence"]["cluster"]
+    annotations["by_model_organism"] = annotations_by_reference_genome
+
+    references = { }
+    for key, by_reference_genome in [("all", references_by_reference_genome), ("pmids", pmids_by_reference_genome)]:
+        references[key] = {
+            "total" : json_stats["references"][key]["total"],
+            "total_no_pb" : json_stats_no_pb["references"][key]["total"]
+        }
+        if annotation_report is not None:
+            changes = annotation_report["summary"]["changes"]["references" if key == "all" else key]
+            references[key]["added"] = changes["added"]
+            references[key]["removed"] = changes["removed"]
+        references[key]["by_model_organism"] = by_reference_genome
+
+    return {
+        "release_date" : json_stats["release_date"],
+        "ontology" : refine["ontology"],
+        "annotations" : annotations,
+        "taxa" : {
+            "total" : json_stats["taxa"]["total"],
+            "filtered" : json_stats["taxa"]["filtered"],
+        },
+        "bioentities" : {
+            "total" : json_stats["bioentities"]["total"],
+            "total_no_pb" : json_stats_no_pb["bioentities"]["total"],
+            "by_type_cluster" : json_stats["bioentities"]["by_type"]["cluster"],
+            "by_type_cluster_no_pb" : json_stats_no_pb["bioentities"]["by_type"]["cluster"],
+            "by_model_organism" : bioentities_by_reference_genome
+        },
+        "references" : references
+    }
+
+
+def release_stages(previous_release = False):
+    """
+    Stages of the release pipeline; with previous_release, the stages comparing it with the previous release (go_reports)
+    Parameters: golr_url, release_date, current_obo_url, previous_obo_url and, with previous_release, previous_stats_url,
+    previous_stats_no_pb_url, previous_references_url
+    """
+    stages = [
+        Stage("all_stats", compute_all_stats, params = ["golr_url", "release_date"], version = golr_stats_version),
+        Stage("stats", select_stats, inputs = ["all_stats"], memo = False),
+        Stage("stats_no_pb", select_stats_no_pb, inputs = ["all_stats"], memo = False),
+        Stage("references", compute_references, inputs = ["all_stats"], params = ["golr_url"]),
+        Stage("ontology_changes", go_ontology_changes.compute_changes, params = ["current_obo_url", "previous_obo_url"], version = ontology_versions),
+        Stage("refine", refine_stats, inputs = ["stats", "stats_no_pb", "ontology_changes"], memo = False)
+    ]
+    if not previous_release:
+        return stages + [Stage("summary", create_summary, inputs = ["refine", "all_stats"], memo = False)]
+
+    return stages + [
+        Stage("previous_stats", fetch_previous_stats, params = ["previous_stats_url"], memo = False),
+        Stage("previous_stats_no_pb", fetch_previous_stats_no_pb, params = ["previous_stats_no_pb_url"], memo = False),
+        Stage("previous_references", fetch_previous_references, params = ["previous_references_url"], memo = False),
+        Stage("reference_changes", compare_references, inputs = ["references", "previous_references"], memo = False),
+        Stage("annotation_changes", annotation_changes, inputs = ["stats", "previous_stats"], memo = False),
+        Stage("annotation_changes_no_pb", annotation_changes_no_pb, inputs = ["stats_no_pb", "previous_stats_no_pb"], memo = False),
+        Stage("annotation_report", annotation_report, inputs = ["stats", "refine", "previous_stats", "reference_changes", "annotation_changes"], memo = False),
+        Stage("annotation_report_no_pb", annotation_report_no_pb, inputs = ["refine", "previous_stats_no_pb", "reference_changes", "annotation_changes_no_pb"], memo = False),
+        Stage("summary", create_summary, inputs = ["refine", "all_stats", "annotation_report"], memo = False)
+    ]
@@ -3,16 +3,18 @@
 
 import json
 import sys, getopt, os
+from functools import partial
 
 import go_stats
 import go_ontology_changes
 import go_annotation_changes
+import go_release_stages
 
 import go_stats_utils as utils
 
 
 def print_help():
-    print('\nUsage: python go_reports.py -g <current_golr_url> -d <release_date> -s <previous_stats_url> -n <previous_stats_no_pb_url> -c <current_obo_url> -p <previous_obo_url> -r <previous_references_url> -o <output_rep>\n')
+    print('\nUsage: python go_reports.py -g <current_golr_url> -d <release_date> -s <previous_stats_url> -n <previous_stats_no_pb_url> -c <current_obo_url> -p <previous_obo_url> -r <previous_references_url> -o <output_rep> [-k <golr_cache_dir>] [-t <taxon_index>] [--snapshots <snapshot_dir>] [--stages <memo_dir>] [--checkpoint] [--resume] [--profile <profile.json|profile.prom>]\n')
 
 
 def main(argv):
@@ -24,6 +26,13 @@ def main(argv):
     previous_references_url = ''
     output_rep = ''
     release_date = ''
+    cache_dir = ''
+    snapshot_dir = ''
+    stages_dir = ''
+    taxon_index_file = ''
+    use_checkpoint = False
+    resume = False
+    profile_file = ''
 
     print(len(argv))
     if len(argv) < 16:
@@ -31,7 +40,7 @@ def main(argv):
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"g:s:n:c:p:o:d:r:",["golrurl=", "pstats=", "pnstats=", "cobo=", "pobo=", "orep=", "date=", "ref="])
+        opts, argv = getopt.getopt(argv,"g:s:n:c:p:o:d:r:k:t:",["golrurl=", "pstats=", "pnstats=", "cobo=", "pobo=", "orep=", "date=", "ref=", "cache=", "taxindex=", "snapshots=", "stages=", "checkpoint", "resume", "profile="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -58,6 +67,32 @@ def main(argv):
             output_rep = arg
         elif opt in ("-d", "--date"):
             release_date = arg
+        elif opt in ("-k", "--cache"):
+            cache_dir = arg
+        elif opt in ("-t", "--taxindex"):
+            taxon_index_file = arg
+        elif opt == "--snapshots":
+            snapshot_dir = arg
+        elif opt == "--stages":
+            stages_dir = arg
+        elif opt == "--checkpoint":
+            use_checkpoint = True
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            profile_file = arg
+
+    if cache_dir != '':
+        utils.enable_golr_cache(cache_dir, release_date)
+
+    if taxon_index_file != '':
+        go_stats.taxon_index_path = taxon_index_file
+
+    if snapshot_dir != '':
+        go_ontology_changes.enable_snapshots(snapshot_dir)
+
+    if profile_file != '':
+        go_stats.profile_path = profile_file
 
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -65,6 +100,10 @@ def main(argv):
     if not os.path.exists(output_rep):
         os.mkdir(output_rep)
 
+    # with --checkpoint, every completed GOLr unit is saved so that a crashed run can be restarted with --resume
+    if use_checkpoint or resume:
+        go_stats.enable_checkpoint(output_rep + "checkpoint", resume)
+
 
     # actual names of the files to be generated - can change here if needed
     output_stats =  output_rep + "go-stats.json"
@@ -81,201 +120,65 @@ def main(argv):
     output_annotation_changes_no_pb_tsv = output_rep + "go-annotation-changes_no_pb.tsv"
 
 
-    # 1 - Executing go_stats script
-    print("\n\n1a - EXECUTING GO_STATS SCRIPT (INCLUDING PROTEIN BINDING)...\n")
-    json_stats = go_stats.compute_stats(golr_url, release_date)
-    print("DONE.")
-
-    print("\n\n1b - EXECUTING GO_STATS SCRIPT (EXCLUDING PROTEIN BINDING)...\n")
-    json_stats_no_pb = go_stats.compute_stats(golr_url, release_date, True)
-    print("DONE.")
-
-    print("\n\n1c - EXECUTING GO_STATS SCRIPT (RETRIEVING PREVIOUS REFERENCES LIST)...\n")
-    previous_references_ids = utils.fetch(previous_references_url).text
-    previous_references_ids = previous_references_ids.split("\n")
-    previous_references_ids = list(map(lambda x: x.split("\t")[0], previous_references_ids))
+    # 1/2/3 - Executing the go_stats, go_ontology_changes and go_annotation_changes stages (independent stages run in parallel)
+    print("\n\n1/2/3 - EXECUTING GO_STATS, GO_ONTOLOGY_CHANGES AND GO_ANNOTATION_CHANGES STAGES...\n")
+    params = {
+        "golr_url" : golr_url,
+        "release_date" : release_date,
+        "current_obo_url" : current_obo_url,
+        "previous_obo_url" : previous_obo_url,
+        "previous_stats_url" : previous_stats_url,
+        "previous_stats_no_pb_url" : previous_stats_no_pb_url,
+        "previous_references_url" : previous_references_url
+    }
+    graph = go_release_stages.StageGraph(go_release_stages.release_stages(previous_release = True), stages_dir if stages_dir != '' else None)
+    results = graph.run(["references", "ontology_changes", "reference_changes", "annotation_report", "annotation_report_no_pb", "refine", "summary"], params)
     print("DONE.")
 
-    print("\n\n1d - EXECUTING GO_STATS SCRIPT (CREATING CURRENT REFERENCES LIST)...\n")
-    references = go_stats.get_references()
-    references_lines = []
-    for k,v in references.items():
-        references_lines.append(k + "\t" + str(v))
-    current_references_ids = list(map(lambda x: x.split("\t")[0], references_lines))
-
-    pmids_lines = list(filter(lambda x: "PMID:" in x, references_lines))
-    pmids_ids = list(map(lambda x: x.split("\t")[0].split(":")[1], pmids_lines))
-
-    utils.write_text(output_references, "\n".join(references_lines))
-    utils.write_text(output_pmids, "\n".join(pmids_lines))
-    utils.write_text(output_pubmed_pmids, "\n".join(pmids_ids))
+    print("\n\n1d - SAVING CURRENT REFERENCES LIST...\n")
+    go_stats.write_references(results["references"], output_references, output_pmids, output_pubmed_pmids)
     print("DONE.")
 
 
-    # 2 - Executing go_ontology_changes script
-    print("\n\n2 - EXECUTING GO_ONTOLOGY_CHANGES SCRIPT...\n")
-    json_onto_changes = go_ontology_changes.compute_changes(current_obo_url, previous_obo_url)
+    print("\n\n2 - SAVING GO-ONTOLOGY-CHANGES...\n")
+    json_onto_changes = results["ontology_changes"]
     utils.write_json(output_ontology_changes, json_onto_changes)
 
-    tsv_onto_changes = go_ontology_changes.create_text_report(json_onto_changes) 
-    utils.write_text(output_ontology_changes_tsv, tsv_onto_changes)
-    print("DONE.")
-
-
-    # 3 - Executing go_annotation_changes script
-    print("\n\n3a - EXECUTING GO_ANNOTATION_CHANGES SCRIPT (INCLUDING PROTEIN BINDING)...\n")
-    previous_stats = utils.fetch(previous_stats_url).json()    
-    json_annot_changes = go_annotation_changes.compute_changes(json_stats, previous_stats)
-    print("DONE.")
-    
-    print("\n\n3b - EXECUTING GO_ANNOTATION_CHANGES SCRIPT (EXCLUDING PROTEIN BINDING)...\n")
-    previous_stats_no_pb = utils.fetch(previous_stats_no_pb_url).json()    # WE STILL NEED TO CORRECT THAT: 1 FILE OR SEVERAL FILE ? IF SEVERAL, ONE MORE PARAMETER
-    json_annot_no_pb_changes = go_annotation_changes.compute_changes(json_stats_no_pb, previous_stats_no_pb)
+    utils.write_report(output_ontology_changes_tsv, go_ontology_changes.write_text_report, json_onto_changes)
     print("DONE.")
 
 
     # 4 - Refining go-stats with ontology stats
     print("\n\n4 - EXECUTING GO_REFINE_STATS SCRIPT...\n")
-    merged_annotations_diff = utils.merge_dict(json_stats, json_annot_changes)
-    json_annot_changes = merged_annotations_diff
-
-
-    ontology = json_onto_changes["summary"]["current"].copy()
-    del ontology["release_date"]
-    ontology["changes_created_terms"] = json_onto_changes["summary"]["changes"]["created_terms"]
-    ontology["changes_valid_terms"] = json_onto_changes["summary"]["changes"]["valid_terms"]
-    ontology["changes_obsolete_terms"] = json_onto_changes["summary"]["changes"]["obsolete_terms"]
-    ontology["changes_merged_terms"] = json_onto_changes["summary"]["changes"]["merged_terms"]
-
-    ontology["changes_biological_process_terms"] = json_onto_changes["summary"]["changes"]["biological_process_terms"]
-    ontology["changes_molecular_function_terms"] = json_onto_changes["summary"]["changes"]["molecular_function_terms"]
-    ontology["changes_cellular_component_terms"] = json_onto_changes["summary"]["changes"]["cellular_component_terms"]
-
-    json_stats = {
-        "release_date" : json_stats["release_date"],
-        "ontology" : ontology,
-        "annotations" : json_stats["annotations"],
-        "taxa" : json_stats["taxa"],
-        "bioentities" : json_stats["bioentities"],
-        "references" : json_stats["references"]
-    }
+    json_stats = results["refine"]["stats"]
+    json_stats_no_pb = results["refine"]["stats_no_pb"]
+
     print("\n4a - SAVING GO-STATS...\n")
     utils.write_json(output_stats, json_stats)
     print("DONE.")
 
-
-    json_stats_no_pb = {
-        "release_date" : json_stats_no_pb["release_date"],
-        "ontology" : ontology,
-        "annotations" : json_stats_no_pb["annotations"],
-        "taxa" : json_stats_no_pb["taxa"],
-        "bioentities" : json_stats_no_pb["bioentities"],
-        "references" : json_stats_no_pb["references"]
-    }
     print("\n4b - SAVING GO-STATS-NO-PB...\n")
     utils.write_json(output_stats_no_pb, json_stats_no_pb)
     print("DONE.")
 
 
-    annotations_by_reference_genome = json_stats["annotations"]["by_model_organism"]
-    for taxon in annotations_by_reference_genome:
-        for ecode in annotations_by_reference_genome[taxon]["by_evidence"]:
-            annotations_by_reference_genome[taxon]["by_evidence"][ecode]["B"] = json_stats["annotations"]["by_model_organism"][taxon]["by_evidence"][ecode]["F"] - json_stats_no_pb["annotations"]["by_model_organism"][taxon]["by_evidence"][ecode]["F"]
-        for ecode in annotations_by_reference_genome[taxon]["by_evidence_cluster"]:
-            annotations_by_reference_genome[taxon]["by_evidence_cluster"][ecode]["B"] = json_stats["annotations"]["by_model_organism"][taxon]["by_evidence_cluster"][ecode]["F"] - json_stats_no_pb["annotations"]["by_model_organism"][taxon]["by_evidence_cluster"][ecode]["F"]
-
-    bioentities_by_reference_genome = { }
-    for taxon in go_stats.reference_genomes_ids:
-        key = go_stats.taxon_label(taxon)
-        bioentities_by_reference_genome[key] = json_stats["bioentities"]["by_filtered_taxon"]["cluster"][key] if key in json_stats["bioentities"]["by_filtered_taxon"]["cluster"] else { }
-        # TODO: we don't have a way to filter on bioentity documents without direct annotations to PB ?
-        # for btype in bioentities_by_reference_genome[key]:
-        #     val = json_stats_no_pb["bioentities"]["by_filtered_taxon"]["cluster"][key]["F"] if (key in json_stats_no_pb["bioentities"]["by_filtered_taxon"]["cluster"] and "F" in json_stats_no_pb["bioentities"]["by_filtered_taxon"]["cluster"][key]) else 0
-        #     bioentities_by_reference_genome[key][btype]["B"] = bioentities_by_reference_genome[key][btype]["F"] - val
-
-    references_by_reference_genome = { }
-    for taxon in go_stats.reference_genomes_ids:
-        key = go_stats.taxon_label(taxon)
-        references_by_reference_genome[key] = json_stats["references"]["all"]["by_filtered_taxon"][key] if key in json_stats["references"]["all"]["by_filtered_taxon"] else { }
-
-    pmids_by_reference_genome = { }
-    for taxon in go_stats.reference_genomes_ids:
-        key = go_stats.taxon_label(taxon)
-        pmids_by_reference_genome[key] = json_stats["references"]["pmids"]["by_filtered_taxon"][key] if key in json_stats["references"]["pmids"]["by_filtered_taxon"] else { }
-        
-
-
-
-
     # This is to modify the structure of the annotation changes based on recent requests
     print("\n4c - SAVING GO-ANNOTATION-CHANGES...\n")
-    json_annot_changes = go_annotation_changes.alter_annotation_changes(json_stats, previous_stats, current_references_ids, previous_references_ids, json_annot_changes)
+    reference_files = go_annotation_changes.write_reference_changes(results["reference_changes"]["changes"], output_rep)
+    json_annot_changes = results["annotation_report"]
     utils.write_json(output_annotation_changes, json_annot_changes)
-    tsv_annot_changes = go_annotation_changes.create_text_report(json_annot_changes)
-    utils.write_text(output_annotation_changes_tsv, tsv_annot_changes)
+    utils.write_report(output_annotation_changes_tsv, partial(go_annotation_changes.write_text_report, reference_files = reference_files), json_annot_changes)
     print("DONE.")
 
 
     print("\n4d - SAVING GO-ANNOTATION-NO-PB-CHANGES...\n")
-    json_annot_no_pb_changes = go_annotation_changes.alter_annotation_changes(json_stats_no_pb, previous_stats_no_pb, current_references_ids, previous_references_ids, json_annot_no_pb_changes)
+    json_annot_no_pb_changes = results["annotation_report_no_pb"]
     utils.write_json(output_annotation_changes_no_pb, json_annot_no_pb_changes)
-    tsv_annot_changes_no_pb = go_annotation_changes.create_text_report(json_annot_no_pb_changes)
-    utils.write_text(output_annotation_changes_no_pb_tsv, tsv_annot_changes_no_pb)
+    utils.write_report(output_annotation_changes_no_pb_tsv, partial(go_annotation_changes.write_text_report, reference_files = reference_files), json_annot_no_pb_changes)
     print("DONE.")
 
-
-
-
-    json_stats_summary = {
-        "release_date" : json_stats["release_date"],
-        "ontology" : ontology,
-        "annotations" : {
-            "total" : json_stats["annotations"]["total"],
-            "total_no_pb" : json_stats_no_pb["annotations"]["total"],
-            "total_pb" : json_stats["annotations"]["total"] - json_stats_no_pb["annotations"]["total"],
-            "by_aspect" : {
-                "P" : json_stats["annotations"]["by_aspect"]["P"],
-                "F" : json_stats["annotations"]["by_aspect"]["F"],
-                "C" : json_stats["annotations"]["by_aspect"]["C"],
-                "B" : json_stats["annotations"]["by_aspect"]["F"] - json_stats_no_pb["annotations"]["by_aspect"]["F"]
-            },
-            "by_bioentity_type_cluster" : json_stats["annotations"]["by_bioentity_type"]["cluster"],
-            "by_bioentity_type_cluster_no_pb" : json_stats_no_pb["annotations"]["by_bioentity_type"]["cluster"],
-            "by_qualifier" : json_stats["annotations"]["by_qualifier"],
-            "by_evidence_cluster" : json_stats["annotations"]["by_evidence"]["cluster"],
-            "by_evidence_cluster_no_pb" : json_stats_no_pb["annotations"]["by_evidence"]["cluster"],
-            "by_model_organism" : annotations_by_reference_genome
-        },
-        "taxa" : {
-            "total" : json_stats["taxa"]["total"],
-            "filtered" : json_stats["taxa"]["filtered"],
-        },
-        "bioentities" : {
-            "total" : json_stats["bioentities"]["total"],
-            "total_no_pb" : json_stats_no_pb["bioentities"]["total"],
-            "by_type_cluster" : json_stats["bioentities"]["by_type"]["cluster"],
-            "by_type_cluster_no_pb" : json_stats_no_pb["bioentities"]["by_type"]["cluster"],
-            "by_model_organism" : bioentities_by_reference_genome
-        },
-        "references" : {
-            "all" : {
-                "total" : json_stats["references"]["all"]["total"],
-                "total_no_pb" : json_stats_no_pb["references"]["all"]["total"],
-                "added" : json_annot_changes["summary"]["changes"]["references"]["added"],
-                "removed" : json_annot_changes["summary"]["changes"]["references"]["removed"],
-                "by_model_organism" : references_by_reference_genome
-            },
-            "pmids" : {
-                "total" : json_stats["references"]["pmids"]["total"],
-                "total_no_pb" : json_stats_no_pb["references"]["pmids"]["total"],
-                "added" : json_annot_changes["summary"]["changes"]["pmids"]["added"],
-                "removed" : json_annot_changes["summary"]["changes"]["pmids"]["removed"],
-                "by_model_organism" : pmids_by_reference_genome
-            }
-        },
-    }
-
     # removing by_reference_genome.by_evidence
+    json_stats_summary = results["summary"]
     for gen in json_stats_summary["annotations"]["by_model_organism"]:
         del json_stats_summary["annotations"]["by_model_organism"][gen]["by_evidence"]
     print("\n4e - SAVING GO-STATS-SUMMARY...\n")
@@ -283,6 +186,8 @@ def main(argv):
     print("DONE.")
 
 
+    go_stats.clear_checkpoint()
+
     # Indicate all processes finished
     print("SUCCESS.")
 
@@ -1,15 +1,43 @@
 # GO Update Statistics
 
-import sys, getopt, os, json
+import sys, getopt, os, json, copy
 from xml.etree import ElementTree
 
 import go_stats_utils as utils
+import taxon_index
 
 
 # INPUT PARAMETERS
 golr_base_url = 'http://golr-aux.geneontology.io/solr/'
 
+# number of GOLr queries run concurrently and max number of queries per second sent to the GOLr host
+golr_max_workers = 8
+golr_max_rate = 10
+
+# responses shared by the variants of a compute_stats run: { (fetcher, select_query): response }, None outside of compute_stats
+shared_responses = None
+
+# reference facets materialized by the current run, by GOLr url (see register_references): { golr_url: Facet },
+# reused by get_references instead of downloading the whole reference facet again
+reference_facets = { }
+
+# optional checkpoint of the GOLr units completed by the current run (see enable_checkpoint), to resume it after a crash
+checkpoint = None
+
+# optional file receiving, at the end of compute_stats, the profile of the HTTP calls (.prom for Prometheus text, JSON otherwise)
+profile_path = None
+
+# query planner for the per taxon facets by aspect: "composite" sends one request per taxon (requires Solr 5+ JSON facets),
+# "split" sends one request per aspect (solr 3.6) and "auto" checks which one the GOLr instance supports
+golr_facet_mode = "auto"
+
+# query planner for the references by taxon and by group: "pivot" streams all the (taxon, reference) and (assigned_by, reference) pairs
+# in one request each (requires Solr 4+ pivot facets), "split" sends one reference facet query per taxon and per group
+# and "auto" checks which one the GOLr instance supports
+golr_reference_mode = "auto"
+
 ALL = "All"
+COMPOSITE = "Composite"
 BP = utils.BP_TERM_ID
 MF = utils.MF_TERM_ID
 CC = utils.CC_TERM_ID
@@ -27,6 +55,7 @@ golr_select_bioentities = 'select?fq=document_category:%22bioentity%22&q=*:*&wt=
 golr_select_bioentities_pb = 'select?fq=document_category:"bioentity"&q=*:*&wt=json&rows=100000&fq=annotation_class_list:"GO:0005515"&fl=annotation_class_list,type,taxon'
 golr_select_qualifiers = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.field=qualifier&facet.limit=1000000'
 golr_select_references = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.field=reference&facet.limit=10000000'
+golr_select_references_pivot = 'select?fq=document_category:%22annotation%22&q=*:*&rows=0&wt=json&facet=true&facet.limit=-1&facet.mincount=1&facet.pivot.mincount=1&facet.pivot='
 
 
 
@@ -47,6 +76,9 @@ taxon_base_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=t
 taxon_map_fallback_url = 'https://geneontology.s3.amazonaws.com/taxon_map.json'
 taxon_map = { }
 
+# optional local taxon label index (see taxon_index.py): only the taxa missing from it are asked to eutils, and then added to it
+taxon_index_path = None
+
 # auto computed set of groups doing annotations (assigned_by)
 groups = [ ]
 
@@ -60,32 +92,73 @@ bioentity_type_cluster = { }
 reverse_bioentity_type_cluster = { }
 
 
-def compute_stats(golr_url, release_date, exclude_pb_only = False):
+def compute_stats(golr_url, release_date, exclude_pb_only = False, variants = None):
     """
     compute stats on GO annotations - can specify if we include or exclude annotations to protein binding only
+    variants is an optional list of exclude_pb_only values to compute in the same run, e.g. [False, True]: the queries which
+    do not depend on the protein binding filter are only sent once and a map of { exclude_pb_only: stats } is returned
     """
     global golr_base_url
+    global shared_responses
     golr_base_url = golr_url
 
     print("Will use golr url: " , golr_base_url)
 
+    if variants is None:
+        return compute_stats(golr_url, release_date, variants = [exclude_pb_only])[exclude_pb_only]
+
+    # a new run may see another GOLr index behind the same url
+    reference_facets.pop(golr_base_url, None)
+
+    profile = None
+    if profile_path is not None:
+        profile = utils.RequestProfile(golr_base_url)
+        utils.add_observer(profile)
+
+    shared_responses = { }
+    try:
+        all_stats = { }
+        for variant in variants:
+            if len(variants) > 1:
+                print("Computing stats " + ("excluding" if variant else "including") + " protein binding...")
+            all_stats[variant] = compute_variant_stats(release_date, variant)
+    finally:
+        shared_responses = None
+        if profile is not None:
+            utils.remove_observer(profile)
+            print("Saving request profile to <" + profile_path + ">")
+            profile.write(profile_path)
+    return all_stats
+
+def compute_variant_stats(release_date, exclude_pb_only):
+    """
+    compute the stats of one variant of a compute_stats run
+    """
     print("1 / 4 - Fetching GO terms...")
-    all_terms = utils.golr_fetch(golr_base_url, golr_select_ontology)
+    terms = golr_fetch_shared(golr_select_ontology, golr_count_terms)
     print("Done.")
     
     print("2 / 4 - Fetching GO annotations...")
+    # not checkpointed: the annotation facets (~1M references) would make a huge checkpoint entry, read again on every resume
+    # (a GOLr cache, see -k, serves them again after a crash)
     if exclude_pb_only:
         all_annotations = utils.golr_fetch(golr_base_url, golr_select_annotations_no_pbinding)
     else:
         all_annotations = utils.golr_fetch(golr_base_url, golr_select_annotations)
+    # the annotation facets (in particular the ~1M references) are reused many times: keep them columnar
+    utils.columnar_facets(all_annotations)
+    if not exclude_pb_only:
+        register_references(all_annotations, golr_select_annotations)
     print("Done.")
     
     print("3 / 4 - Fetching GO bioentities...")
-    all_entities = utils.golr_fetch(golr_base_url, golr_select_bioentities)
+    all_entities = golr_fetch_shared(golr_select_bioentities)
 
     # we have to manually update the facts of the first query if we want to remove the bioentities annotated only to protein binding
     if exclude_pb_only:
-        all_entities_no_pb = utils.golr_fetch(golr_base_url, golr_select_bioentities_pb)
+        # the bioentities response is shared with the other variants: work on a copy
+        all_entities = copy.deepcopy(all_entities)
+        all_entities_no_pb = golr_fetch_shared(golr_select_bioentities_pb)
         # print(all_entities_no_pb)
         entities_type_no_pb = { }
         entities_taxon_no_pb = { }
@@ -126,7 +199,7 @@ def compute_stats(golr_url, release_date, exclude_pb_only = False):
     
     print("Done.")
 
-    qualifiers = utils.golr_fetch(golr_base_url, golr_select_qualifiers)
+    qualifiers = golr_fetch_shared(golr_select_qualifiers)
     qualifiers = utils.build_map(qualifiers['facet_counts']['facet_fields']['qualifier'])
 
 
@@ -134,23 +207,52 @@ def compute_stats(golr_url, release_date, exclude_pb_only = False):
     print("4 / 4 - Creating Stats...")    
     prepare_globals(all_annotations)
     print("\t4a - globals prepared")
-    stats = create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only)
+    stats = create_stats(terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only)
     print("Done.")
     
     return stats
 
-def load_taxon_map():
-    global taxon_map
+def load_taxon_map(taxon_ids):
+    """
+    Fill in taxon_map the labels of the given taxon ids from the fallback taxon map, keeping the labels already loaded
+    """
     print("Using ", taxon_map_fallback_url , " (created from ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdmp.zip) as a fallback to get taxon { id, label }")
     data = utils.fetch(taxon_map_fallback_url)
 
     if data is None or data.status_code != 200:
         return False
 
-    taxon_map = json.loads(data.content)
+    fallback_map = json.loads(data.content)
+    for taxon_id in taxon_ids:
+        if taxon_id in fallback_map:
+            taxon_map[taxon_id] = fallback_map[taxon_id]
     check = '9606' in taxon_map and taxon_map['9606'] == 'Homo sapiens'
     return check
 
+def fetch_taxon_labels(taxon_ids):
+    """
+    Get the { taxon id: scientific name } of a list of taxon ids from eutils, None if the call failed
+    """
+    params = { "id" : ",".join(taxon_ids) }
+    data = utils.post(taxon_base_url, params)
+
+    try :
+        if data and data.status_code == 200:
+            labels = { }
+            tree = ElementTree.fromstring(data.content)
+            elts = tree.findall("Taxon")
+            for i in range(0,len(elts)):
+                key = elts[i].findtext("TaxId")
+                val = elts[i].findtext("ScientificName")
+                labels[key] = val
+            print("Note: taxon map of ", len(labels), " taxa loaded from " , taxon_base_url + " - in case of issue could use https://www.ebi.ac.uk/ena/data/taxonomy/v1/taxon/tax-id/xxx")
+            return labels
+        else:
+            print("WARNING: could not get taxon labels from ", taxon_base_url , " (status code: " , str(data.status_code) + ")")
+    except Exception as x:
+        print("Should never happened but life is full of mysteries - API call + retries + check on None still crashed" , x)
+    return None
+
 def prepare_globals(all_annotations):
     global usable_taxons
     global taxon_map
@@ -159,36 +261,37 @@ def prepare_globals(all_annotations):
     global bioentity_type_cluster
     global reverse_bioentity_type_cluster    
 
-    temp = all_annotations['facet_counts']['facet_fields']['assigned_by']
-    groups = utils.build_list(temp)
+    facets = all_annotations['facet_counts']['facet_fields']
+    groups = list(facets['assigned_by'].keys)
 
-    temp = all_annotations['facet_counts']['facet_fields']['taxon']
-    usable_taxons = utils.build_list(temp, 1000)
-    all_taxons = utils.build_list(temp, None)
+    usable_taxons = list(facets['taxon'].threshold(1000).keys)
+    all_taxons = facets['taxon'].keys
 
     # this step will create the global taxon_map to get any name from an id
     temp_taxons = []
     for taxon in all_taxons:
         temp_taxons.append(taxon[taxon.index(":")+1:])
 
-    params = { "id" : ",".join(temp_taxons) }
-    data = utils.post(taxon_base_url, params)
-
-    try :
-        if data and data.status_code == 200:
-            tree = ElementTree.fromstring(data.content)
-            elts = tree.findall("Taxon")
-            for i in range(0,len(elts)):
-                key = elts[i].findtext("TaxId")
-                val = elts[i].findtext("ScientificName")
-                taxon_map[key] = val
-            print("Note: taxon map of ", len(taxon_map), " taxa loaded from " , taxon_base_url + " - in case of issue could use https://www.ebi.ac.uk/ena/data/taxonomy/v1/taxon/tax-id/xxx")
+    if taxon_index_path is not None and os.path.exists(taxon_index_path):
+        with taxon_index.TaxonIndex(taxon_index_path) as index:
+            missing_taxons = []
+            for taxon_id in temp_taxons:
+                label = index.get(taxon_id)
+                if label is None:
+                    missing_taxons.append(taxon_id)
+                else:
+                    taxon_map[taxon_id] = label
+        print("Note: taxon map of ", len(temp_taxons) - len(missing_taxons), " taxa loaded from " , taxon_index_path + ", " , len(missing_taxons) , " missing")
+        temp_taxons = missing_taxons
+
+    if len(temp_taxons) > 0:
+        labels = fetch_taxon_labels(temp_taxons)
+        if labels is None:
+            load_taxon_map(temp_taxons)
         else:
-            print("WARNING: could not get taxon labels from ", taxon_base_url , " (status code: " , str(data.status_code) + ")")
-            load_taxon_map()
-    except Exception as x:
-        print("Should never happened but life is full of mysteries - API call + retries + check on None still crashed" , x)
-        load_taxon_map()
+            taxon_map.update(labels)
+            if taxon_index_path is not None:
+                print("Adding ", taxon_index.update_index(taxon_index_path, labels.items()), " taxa to " , taxon_index_path)
 
 
     # verbose check on taxon label mapping
@@ -200,60 +303,231 @@ def prepare_globals(all_annotations):
         
 
     bioentity_type_cluster = { }
-    temp = all_annotations['facet_counts']['facet_fields']['type']
-    for i in range(0, len(temp), 2):
-        bioentity_types.append(temp[i])
-        bioentity_type_cluster[temp[i]] = utils.bioentity_type(temp[i])
+    for btype in facets['type'].keys:
+        bioentity_types.append(btype)
+        bioentity_type_cluster[btype] = utils.bioentity_type(btype)
 
     reverse_bioentity_type_cluster = utils.build_reverse_map(bioentity_type_cluster)
 
     
-def golr_fetch_bioentities_taxon(taxon):
-    url = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&rows=0&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&fq=taxon:\"" + taxon + "\""
-    response = utils.golr_fetch(golr_base_url, url)
+def use_composite_facets():
+    if golr_facet_mode == "auto":
+        return utils.golr_supports_composite_facets(golr_base_url)
+    return golr_facet_mode == "composite"
+
+def use_pivot_references():
+    if golr_reference_mode == "auto":
+        return utils.golr_supports_pivot_facets(golr_base_url)
+    return golr_reference_mode == "pivot"
+
+def aspect_closures():
+    return { BP : "isa_partof_closure:\"" + BP + "\"", MF : "isa_partof_closure:\"" + MF + "\"", CC : "isa_partof_closure:\"" + CC + "\"" }
+
+def golr_queries_bioentities_taxon(taxon):
+    if use_composite_facets():
+        url = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&rows=0&fq=taxon:\"" + taxon + "\""
+        return { COMPOSITE : url + utils.golr_composite_facet("type", aspect_closures(), 1) }
 
     # multiple queries: a bit complicated but necessary due to solr 3.6 unable to do composite faceting and for speed considerations
     # * can indicate the is_a closure to find the stats on that specific aspect
     # * if evidence code was present, we could use a similar strategy
+    url = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&rows=0&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&fq=taxon:\"" + taxon + "\""
     url_bp = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + BP + "\""
-    response_bp = utils.golr_fetch(golr_base_url, url_bp)
-
     url_mf = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + MF + "\""
-    response_mf = utils.golr_fetch(golr_base_url, url_mf)
-
     url_cc = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=type&facet.field=taxon&facet.limit=1000000&facet.mincount=1&rows=0&fq=taxon:\"" + taxon + "\"&fq=isa_partof_closure:\"" + CC + "\""
-    response_cc = utils.golr_fetch(golr_base_url, url_cc)
+    return { ALL : url, BP : url_bp, MF : url_mf, CC : url_cc }
 
-    return { ALL : response, BP : response_bp, MF : response_mf, CC : response_cc }
-    
-def golr_fetch_references_taxon(taxon):
-    url = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=taxon:\"" + taxon + "\""
-    response = utils.golr_fetch(golr_base_url, url)
-    return response
+def golr_query_references(field, value):
+    return "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=" + field + ":\"" + value + "\""
 
-def golr_fetch_references_group(group):
-    url = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&rows=0&facet.limit=10000000&facet.mincount=1&facet=true&facet.field=reference&fq=assigned_by:\"" + group + "\""
-    response = utils.golr_fetch(golr_base_url, url)
-    return response
+def golr_query_references_taxon(taxon):
+    return golr_query_references("taxon", taxon)
 
-def golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only):
+def golr_query_references_group(group):
+    return golr_query_references("assigned_by", group)
+
+def golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only):
     options = ""
     if exclude_pb_only:
         options = "&fq=!annotation_class:\"GO:0005515\""
 
-    url = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0' + options
-    response = utils.golr_fetch(golr_base_url, url)
+    if use_composite_facets():
+        # no facet.mincount in the original queries: keep the evidences without annotations
+        url = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&rows=0' + options
+        return { COMPOSITE : url + utils.golr_composite_facet("evidence_type", aspect_closures(), 0, 10000) }
 
+    url = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0' + options
     url_bp = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + BP + '\"' + options
-    response_bp = utils.golr_fetch(golr_base_url, url_bp)
-
     url_mf = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + MF + '\"' + options
-    response_mf = utils.golr_fetch(golr_base_url, url_mf)
-
     url_cc = 'select?fq=document_category:%22annotation%22&q=*:*&wt=json&fq=taxon:%22' + taxon + '%22&facet=true&facet.field=evidence_type&facet.limit=10000&rows=0&fq=isa_partof_closure:\"' + CC + '\"' + options
-    response_cc = utils.golr_fetch(golr_base_url, url_cc)
+    return { ALL : url, BP : url_bp, MF : url_mf, CC : url_cc }
+
+def golr_fetch_all(queries, fetcher = None):
+    """
+    Run a map of { key: select_query } concurrently against the current GOLr and return the map of { key: response }
+    fetcher(golr_base_url, select_query) can replace the default utils.golr_fetch, e.g. to stream the responses
+    Within a compute_stats run, only the queries not already answered for another variant or before a resume are sent
+    """
+    fetcher = fetcher or utils.golr_fetch
+    responses = { }
+    missing = { }
+    for key, query in queries.items():
+        responses[key] = recall(fetcher, query)
+        if responses[key] is None:
+            missing[key] = query
+
+    for key, response in utils.golr_fetch_iter(golr_base_url, missing, golr_max_workers, golr_max_rate, fetcher):
+        responses[key] = response
+        remember(fetcher, missing[key], response)
+    return responses
+
+def golr_fetch_shared(select_query, fetcher = None):
+    """
+    Fetch a single query with fetcher(golr_base_url, select_query) (utils.golr_fetch by default),
+    reusing the response already fetched for another variant of the current compute_stats run or before a resume
+    """
+    fetcher = fetcher or utils.golr_fetch
+    response = recall(fetcher, select_query)
+    if response is None:
+        response = fetcher(golr_base_url, select_query)
+        remember(fetcher, select_query, response)
+    return response
+
+def recall(fetcher, select_query):
+    """
+    Return the result of fetcher for a query if already known by the current run, None otherwise
+    """
+    if shared_responses is not None and (fetcher, select_query) in shared_responses:
+        return shared_responses[(fetcher, select_query)]
+    if checkpoint is not None:
+        response = checkpoint.get(fetcher.__name__, golr_base_url + select_query)
+        if response is not None and shared_responses is not None:
+            shared_responses[(fetcher, select_query)] = response
+        return response
+    return None
+
+def remember(fetcher, select_query, response):
+    """
+    Keep the result of fetcher for a query for the other variants of the current run and, if enabled, in the checkpoint
+    """
+    if response is None:
+        return
+    if shared_responses is not None:
+        shared_responses[(fetcher, select_query)] = response
+    if checkpoint is not None:
+        checkpoint.save(fetcher.__name__, golr_base_url + select_query, response)
+
+def register_references(response, select_query):
+    """
+    Keep the reference facet of an annotation response for get_references, if it has all the references of the current GOLr:
+    the select_query must not filter the annotations, and the facet must not be truncated by its facet.limit
+    """
+    facet = response['facet_counts']['facet_fields'].get('reference')
+    if facet is None:
+        return
+    # a Facet has one entry per reference, the facet array [ref, count, ...] two
+    facet = utils.Facet.from_facet(facet)
+    limit = utils.facet_limit(select_query)
+    if limit >= 0 and len(facet) >= limit:
+        print("Reference facet possibly truncated (" + str(len(facet)) + " references): get_references will fetch it")
+        return
+    reference_facets[golr_base_url] = facet
+
+def enable_checkpoint(directory, resume = False):
+    """
+    Save each completed GOLr unit of work in directory; with resume, reuse the units completed by a previous run
+    """
+    global checkpoint
+    checkpoint = utils.Checkpoint(directory, resume)
+    print("Using checkpoint <" + directory + ">" + (" (resuming)" if resume else ""))
+    return checkpoint
+
+def clear_checkpoint():
+    """
+    Forget the checkpoint once all the outputs are written
+    """
+    global checkpoint
+    if checkpoint is not None:
+        checkpoint.clear()
+        try:
+            os.rmdir(checkpoint.directory)
+        except OSError:
+            pass
+        checkpoint = None
+
+def golr_count_terms(golr_base_url, select_query):
+    """
+    Stream the ontology_class documents of a query and count the GO terms
+    Raise an IOError if fewer documents than numFound were streamed
+    """
+    num_found, docs = utils.golr_stream_docs(golr_base_url, select_query)
+    terms = count_terms(docs)
+    if terms["total"] != num_found:
+        raise IOError("Query " + golr_base_url + select_query + " streamed " + str(terms["total"]) + " of " + str(num_found) + " documents")
+    return terms
+
+def golr_count_references(golr_base_url, select_query):
+    """
+    Stream the reference facet of a query and return its (number of references, number of PMIDs)
+    The facet itself is never held in memory
+    """
+    return utils.count_facet(utils.golr_stream_facet(golr_base_url, select_query, 'reference'), "PMID:")
+
+def golr_count_references_pivot(golr_base_url, select_query):
+    """
+    Stream the pivot facet <field>,reference of a query and return { value of field: (number of references, number of PMIDs) }
+    """
+    pivot = select_query[select_query.rindex("facet.pivot=") + len("facet.pivot="):]
+    return utils.count_pivot(utils.golr_stream_pivot(golr_base_url, select_query, pivot), "PMID:")
+
+def golr_count_references_by(values):
+    """
+    Count the references and PMIDs of each value of some annotation fields, e.g. { "taxon": usable_taxons, "assigned_by": groups }
+    Return { field: { value: (number of references, number of PMIDs) } }
+    """
+    if use_pivot_references():
+        counts = golr_fetch_all({ field : golr_select_references_pivot + field + ",reference" for field in values }, golr_count_references_pivot)
+        # a value without any reference is simply absent from the pivot facet
+        return { field : { value : counts[field].get(value, (0, 0)) for value in values[field] } for field in values }
+
+    queries = { }
+    for field in values:
+        for value in values[field]:
+            queries[(field, value)] = golr_query_references(field, value)
+    counts = golr_fetch_all(queries, golr_count_references)
+    return { field : { value : counts[(field, value)] for value in values[field] } for field in values }
+
+def golr_fetch_facets_by_aspect(queries, field, mincount = 1):
+    """
+    Run a map of { key: { ALL|BP|MF|CC|COMPOSITE: select_query } } as planned by the golr_queries_* functions
+    Return a map of { key: { ALL: facet, BP: facet, MF: facet, CC: facet } }, whatever the planned strategy
+    """
+    flat_queries = { }
+    for key, planned in queries.items():
+        for aspect, url in planned.items():
+            flat_queries[(key, aspect)] = url
+    responses = golr_fetch_all(flat_queries)
+
+    facets = { }
+    for key, planned in queries.items():
+        if COMPOSITE in planned:
+            split = utils.golr_split_composite(responses[(key, COMPOSITE)], aspect_closures(), mincount)
+            facets[key] = { ALL : split[None], BP : split[BP], MF : split[MF], CC : split[CC] }
+        else:
+            facets[key] = { aspect : responses[(key, aspect)]['facet_counts']['facet_fields'][field] for aspect in planned }
+    return facets
+
+def golr_fetch_bioentities_taxon(taxon):
+    return golr_fetch_facets_by_aspect({ taxon : golr_queries_bioentities_taxon(taxon) }, 'type')[taxon]
+    
+def golr_fetch_references_taxon(taxon):
+    return golr_count_references(golr_base_url, golr_query_references_taxon(taxon))
+
+def golr_fetch_references_group(group):
+    return golr_count_references(golr_base_url, golr_query_references_group(group))
 
-    return { ALL : response, BP : response_bp, MF : response_mf, CC : response_cc }
+def golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only):
+    return golr_fetch_facets_by_aspect({ taxon : golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only) }, 'evidence_type', 0)[taxon]
     
 
 
@@ -282,14 +556,17 @@ def add_taxon_label(map):
                 new_map[key] = val
     return new_map
 
-def create_stats(all_terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only = False):
-    stats = { }
-
+def count_terms(docs):
+    """
+    Count the GO terms (valid, obsolete, by aspect) from an iterable of GOLr ontology_class documents
+    """
+    total = 0
     terms = 0
     obsoleted = 0
     terms_by_aspect = { "P" : 0, "F" : 0, "C" : 0 }
 
-    for doc in all_terms['response']['docs']:
+    for doc in docs:
+        total += 1
         if doc['is_obsolete']:
             obsoleted += 1
         else:
@@ -306,22 +583,27 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
             if "cellular_component" in doc['source']:
                 terms_by_aspect["C"] += 1
             
-    terms = { 
-        "total" : all_terms['response']['numFound'],
+    return { 
+        "total" : total,
         "valid" : terms,
         "obsolete" : obsoleted,
         "by_aspect" : terms_by_aspect
     }
+
+def create_stats(terms, all_annotations, all_entities, release_date, qualifiers, exclude_pb_only = False):
+    stats = { }
+
     print("\t4b - terms computed")
 
+    facets = golr_fetch_facets_by_aspect({ taxon : golr_queries_bioentities_taxon(taxon) for taxon in usable_taxons }, 'type')
+
     all_bioentities_by_taxon = { }
     cluster_bioentities_by_taxon = { }
     for taxon in usable_taxons:
-        responses = golr_fetch_bioentities_taxon(taxon)
-        all_map = utils.build_map(responses[ALL]['facet_counts']['facet_fields']['type'])
-        bp_map = utils.build_map(responses[BP]['facet_counts']['facet_fields']['type'])
-        mf_map = utils.build_map(responses[MF]['facet_counts']['facet_fields']['type'])
-        cc_map = utils.build_map(responses[CC]['facet_counts']['facet_fields']['type'])
+        all_map = utils.build_map(facets[taxon][ALL])
+        bp_map = utils.build_map(facets[taxon][BP])
+        mf_map = utils.build_map(facets[taxon][MF])
+        cc_map = utils.build_map(facets[taxon][CC])
 
         merged_map = {}
         for key, value in all_map.items():
@@ -334,14 +616,11 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
         # cluster_bioentities_by_taxon[taxon] =  cluster_map(all_bioentities_by_taxon[taxon], bioentity_type_cluster)
     print("\t4c - bioentities computed")
 
+    counts = golr_count_references_by({ "taxon" : usable_taxons, "assigned_by" : groups })
     references_by_taxon = { }
     pmids_by_taxon = { }
     for taxon in usable_taxons:
-        res = golr_fetch_references_taxon(taxon)
-        references_by_taxon[taxon] = int(len(res['facet_counts']['facet_fields']['reference']) / 2)
-        pmid_map = utils.build_map(res['facet_counts']['facet_fields']['reference'])
-        pmid_map = len(utils.extract_map(pmid_map, "PMID:"))
-        pmids_by_taxon[taxon] = pmid_map
+        references_by_taxon[taxon], pmids_by_taxon[taxon] = counts["taxon"][taxon]
     references_by_taxon = utils.ordered_map(references_by_taxon)
     pmids_by_taxon = utils.ordered_map(pmids_by_taxon)
     print("\t4d - taxa computed")
@@ -349,24 +628,22 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
     references_by_group = { }
     pmids_by_group = { }
     for group in groups:
-        res = golr_fetch_references_group(group)
-        references_by_group[group] = int(len(res['facet_counts']['facet_fields']['reference']) / 2)
-        pmid_map = utils.build_map(res['facet_counts']['facet_fields']['reference'])
-        pmid_map = len(utils.extract_map(pmid_map, "PMID:"))
-        pmids_by_group[group] = pmid_map
+        references_by_group[group], pmids_by_group[group] = counts["assigned_by"][group]
     references_by_group = utils.ordered_map(references_by_group)
     pmids_by_group = utils.ordered_map(pmids_by_group)
     print("\t4e - references computed")
 
 
 
+    facets = golr_fetch_facets_by_aspect({ taxon : golr_queries_annotation_by_evidence_by_species(taxon, exclude_pb_only) for taxon in reference_genomes_ids }, 'evidence_type', 0)
+    responses = golr_fetch_all({ taxon : golr_select_qualifiers + "&fq=taxon:\"" + taxon + "\"" for taxon in reference_genomes_ids })
+
     ref_genome_annotation_evidences = { }
     for taxon in reference_genomes_ids:
-        responses = golr_fetch_annotation_by_evidence_by_species(taxon, exclude_pb_only)
-        all_map = utils.build_map(responses[ALL]['facet_counts']['facet_fields']['evidence_type'])
-        bp_map = utils.build_map(responses[BP]['facet_counts']['facet_fields']['evidence_type'])
-        mf_map = utils.build_map(responses[MF]['facet_counts']['facet_fields']['evidence_type'])
-        cc_map = utils.build_map(responses[CC]['facet_counts']['facet_fields']['evidence_type'])
+        all_map = utils.build_map(facets[taxon][ALL])
+        bp_map = utils.build_map(facets[taxon][BP])
+        mf_map = utils.build_map(facets[taxon][MF])
+        cc_map = utils.build_map(facets[taxon][CC])
 
         merged_map = {}
         for key, value in all_map.items():
@@ -378,39 +655,39 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
         ref_genome_annotation_evidences[taxon]["by_evidence_cluster"] = utils.cluster_complex_map(ref_genome_annotation_evidences[taxon]["by_evidence"], reverse_evidence_groups)
 
         # adding qualifiers for each model organism
-        response_qualifiers = utils.golr_fetch_by_taxon(golr_base_url, golr_select_qualifiers, taxon)
-        response_qualifiers = response_qualifiers['facet_counts']['facet_fields']['qualifier']
+        response_qualifiers = responses[taxon]['facet_counts']['facet_fields']['qualifier']
         ref_genome_annotation_evidences[taxon]["by_qualifier"] = utils.build_map(response_qualifiers)
         
 
+    facets = all_annotations['facet_counts']['facet_fields']
     annotations = { 
         "total" : all_annotations['response']['numFound'],
 
-        "by_aspect" : utils.build_map(all_annotations['facet_counts']['facet_fields']['aspect']),
+        "by_aspect" : facets['aspect'].to_map(),
 
         "by_bioentity_type" : {
-            "all" : utils.build_map(all_annotations['facet_counts']['facet_fields']['type']),
-            "cluster" : utils.cluster_map(utils.build_map(all_annotations['facet_counts']['facet_fields']['type']), bioentity_type_cluster)
+            "all" : facets['type'].to_map(),
+            "cluster" : facets['type'].cluster(bioentity_type_cluster).to_map()
         },
 
         "by_qualifier" : qualifiers,
         
-        "by_taxon": utils.build_map(all_annotations['facet_counts']['facet_fields']['taxon']),
+        "by_taxon": facets['taxon'].to_map(),
 
         "by_evidence": {
-            "all" : utils.build_map(all_annotations['facet_counts']['facet_fields']['evidence_type']),
-            "cluster" : utils.cluster_map(utils.build_map(all_annotations['facet_counts']['facet_fields']['evidence_type']), reverse_evidence_groups)
+            "all" : facets['evidence_type'].to_map(),
+            "cluster" : facets['evidence_type'].cluster(reverse_evidence_groups).to_map()
         },
 
         "by_model_organism" : ref_genome_annotation_evidences,
 
-        "by_group": utils.build_map(all_annotations['facet_counts']['facet_fields']['assigned_by'])
+        "by_group": facets['assigned_by'].to_map()
         
     }
     annotations = add_taxon_label(annotations)
 
     taxa =  {
-        "total" : int(len(all_annotations['facet_counts']['facet_fields']['taxon']) / 2),
+        "total" : len(facets['taxon']),
         "filtered" : len(usable_taxons),
     }
 
@@ -437,12 +714,12 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
 
     references = {
         "all" : {
-            "total" : int(len(all_annotations['facet_counts']['facet_fields']['reference']) / 2),
+            "total" : len(facets['reference']),
             "by_filtered_taxon" : references_by_taxon,
             "by_group" : references_by_group
         },
         "pmids" : {
-            "total" : len(utils.extract_map(utils.build_map(all_annotations['facet_counts']['facet_fields']['reference']), "PMID:")),
+            "total" : facets['reference'].count_matching("PMID:"),
             "by_filtered_taxon" : pmids_by_taxon,
             "by_group" : pmids_by_group
         }
@@ -460,117 +737,119 @@ def create_stats(all_terms, all_annotations, all_entities, release_date, qualifi
 
 
 def create_text_report(stats_json):
-    text_report = ""
+    return utils.render_report(write_text_report, stats_json)
 
-    text_report = "GENE ONTOLOGY STATISTICS"
-    text_report += "\nrelease_date\t" + stats_json["release_date"]    
+def write_text_report(stats_json, out):
+    """
+    Write the TSV stats report to a text handle as each section is rendered (see utils.write_report)
+    """
+    out.write("GENE ONTOLOGY STATISTICS")
+    out.write("\nrelease_date\t" + stats_json["release_date"])
 
-    text_report += "\n\nTERMS\n"
-    text_report += "total\t" + str(stats_json["terms"]["total"]) + "\nobsolete\t" + str(stats_json["terms"]["obsolete"]) + "\nvalid total\t" + str(stats_json["terms"]["valid"])
-    text_report += "\nvalid P\t" + str(stats_json["terms"]["by_aspect"]["P"]) + "\nvalid F\t" + str(stats_json["terms"]["by_aspect"]["F"]) + "\nvalid C\t" + str(stats_json["terms"]["by_aspect"]["C"])
+    out.write("\n\nTERMS\n")
+    out.write("total\t" + str(stats_json["terms"]["total"]) + "\nobsolete\t" + str(stats_json["terms"]["obsolete"]) + "\nvalid total\t" + str(stats_json["terms"]["valid"]))
+    out.write("\nvalid P\t" + str(stats_json["terms"]["by_aspect"]["P"]) + "\nvalid F\t" + str(stats_json["terms"]["by_aspect"]["F"]) + "\nvalid C\t" + str(stats_json["terms"]["by_aspect"]["C"]))
 
 
-    text_report += "\n\nBIOENTITIES\n"
-    text_report += "total\t" + str(stats_json["bioentities"]["total"])
+    out.write("\n\nBIOENTITIES\n")
+    out.write("total\t" + str(stats_json["bioentities"]["total"]))
 
-    text_report += "\n\nBIOENTITIES BY TYPE (CLUSTER)"
+    out.write("\n\nBIOENTITIES BY TYPE (CLUSTER)")
     for key, val in stats_json["bioentities"]["by_type"]["cluster"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nBIOENTITIES BY TYPE (ALL)"
+    out.write("\n\nBIOENTITIES BY TYPE (ALL)")
     for key, val in stats_json["bioentities"]["by_type"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
-    text_report += "\n\nBIOENTITIES BY FILTERED TAXON AND BY TYPE (CLUSTER)"
-    text_report += "\ntaxon"
+    out.write("\n\nBIOENTITIES BY FILTERED TAXON AND BY TYPE (CLUSTER)")
+    out.write("\ntaxon")
     for type, nb in stats_json["bioentities"]["by_type"]["cluster"].items():
-        text_report += "\t" + type
+        out.write("\t" + type)
     for key, val in stats_json["bioentities"]["by_filtered_taxon"]["cluster"].items():
-        text_report += "\n" + key
+        out.write("\n" + key)
         for type, nb in stats_json["bioentities"]["by_type"]["cluster"].items():
-            text_report += "\t" + str(val[type]["A"]) if type in val else "\t0"
+            out.write("\t" + str(val[type]["A"]) if type in val else "\t0")
 
-    text_report += "\n\nBIOENTITIES BY FILTERED TAXON AND BY TYPE (ALL)"
-    text_report += "\ntaxon"
+    out.write("\n\nBIOENTITIES BY FILTERED TAXON AND BY TYPE (ALL)")
+    out.write("\ntaxon")
     for type, nb in stats_json["bioentities"]["by_type"]["all"].items():
-        text_report += "\t" + type
+        out.write("\t" + type)
     for key, val in stats_json["bioentities"]["by_filtered_taxon"]["all"].items():
-        text_report += "\n" + key
+        out.write("\n" + key)
         for type, nb in stats_json["bioentities"]["by_type"]["all"].items():
-            text_report += "\t" + str(val[type]["A"]) if type in val else "\t0"
+            out.write("\t" + str(val[type]["A"]) if type in val else "\t0")
 
 
-    text_report += "\n\nTAXA\n"
-    text_report += "total\t" + str(stats_json["taxa"]["total"]) + "\nfiltered\t" + str(stats_json["taxa"]["filtered"])
+    out.write("\n\nTAXA\n")
+    out.write("total\t" + str(stats_json["taxa"]["total"]) + "\nfiltered\t" + str(stats_json["taxa"]["filtered"]))
 
 
-    text_report += "\n\nANNOTATIONS\n"
-    text_report += "total\t" + str(stats_json["annotations"]["total"])
+    out.write("\n\nANNOTATIONS\n")
+    out.write("total\t" + str(stats_json["annotations"]["total"]))
     for key, val in stats_json["annotations"]["by_aspect"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
         
-    text_report += "\n\nANNOTATIONS BY BIOENTITY TYPE (CLUSTER)"
+    out.write("\n\nANNOTATIONS BY BIOENTITY TYPE (CLUSTER)")
     for key, val in stats_json["annotations"]["by_bioentity_type"]["cluster"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY BIOENTITY TYPE (ALL)"
+    out.write("\n\nANNOTATIONS BY BIOENTITY TYPE (ALL)")
     for key, val in stats_json["annotations"]["by_bioentity_type"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY QUALIFIER"
+    out.write("\n\nANNOTATIONS BY QUALIFIER")
     for key, val in stats_json["annotations"]["by_qualifier"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY EVIDENCE (CLUSTER)"
+    out.write("\n\nANNOTATIONS BY EVIDENCE (CLUSTER)")
     for key, val in stats_json["annotations"]["by_evidence"]["cluster"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY EVIDENCE (ALL)"
+    out.write("\n\nANNOTATIONS BY EVIDENCE (ALL)")
     for key, val in stats_json["annotations"]["by_evidence"]["all"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY GROUP"
+    out.write("\n\nANNOTATIONS BY GROUP")
     for key, val in stats_json["annotations"]["by_group"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
     
-    text_report += "\n\nANNOTATIONS BY TAXON"
+    out.write("\n\nANNOTATIONS BY TAXON")
     for key, val in stats_json["annotations"]["by_taxon"].items():
-        text_report += "\n" + key + "\t" + str(val)
+        out.write("\n" + key + "\t" + str(val))
 
 
 
-    text_report += "\n\nANNOTATIONS BY MODEL ORGANISM AND EVIDENCE CODE THEN QUALIFIER"
-    text_report += "\nTAXON"
+    out.write("\n\nANNOTATIONS BY MODEL ORGANISM AND EVIDENCE CODE THEN QUALIFIER")
+    out.write("\nTAXON")
     for evidence in utils.ev_all:
-        text_report += "\t" + evidence
+        out.write("\t" + evidence)
     qualifiers = list(stats_json["annotations"]["by_qualifier"].keys())
     qualifiers.sort()
     for qualifier in qualifiers:
-        text_report += "\t" + qualifier
+        out.write("\t" + qualifier)
 
     for taxon, val in stats_json["annotations"]["by_model_organism"].items():
-        text_report += "\n" + taxon
+        out.write("\n" + taxon)
         for evidence in utils.ev_all:
-            text_report += "\t" + str(stats_json["annotations"]["by_model_organism"][taxon]["by_evidence"][evidence]["A"])
+            out.write("\t" + str(stats_json["annotations"]["by_model_organism"][taxon]["by_evidence"][evidence]["A"]))
         for qualifier in qualifiers:
-            text_report += "\t" + str(stats_json["annotations"]["by_model_organism"][taxon]["by_qualifier"][qualifier])
+            out.write("\t" + str(stats_json["annotations"]["by_model_organism"][taxon]["by_qualifier"][qualifier]))
 
 
-    text_report += "\n\nREFERENCES AND PMIDS\n"
-    text_report += "total\t" + str(stats_json["references"]["all"]["total"]) + "\t" + str(stats_json["references"]["pmids"]["total"])
+    out.write("\n\nREFERENCES AND PMIDS\n")
+    out.write("total\t" + str(stats_json["references"]["all"]["total"]) + "\t" + str(stats_json["references"]["pmids"]["total"]))
 
-    text_report += "\n\nREFERENCES AND PMIDS BY GROUP"
-    text_report += "\ngroup\treferences\tpmids"
+    out.write("\n\nREFERENCES AND PMIDS BY GROUP")
+    out.write("\ngroup\treferences\tpmids")
     for key, val in stats_json["references"]["all"]["by_group"].items():
-        text_report += "\n" + key + "\t" + str(val) + "\t" + str(stats_json["references"]["pmids"]["by_group"][key])
+        out.write("\n" + key + "\t" + str(val) + "\t" + str(stats_json["references"]["pmids"]["by_group"][key]))
 
-    text_report += "\n\nREFERENCES AND PMIDS BY TAXON"
-    text_report += "\ntaxon\treferences\tpmids"
+    out.write("\n\nREFERENCES AND PMIDS BY TAXON")
+    out.write("\ntaxon\treferences\tpmids")
     for key, val in stats_json["references"]["all"]["by_filtered_taxon"].items():
         pmid_val = stats_json["references"]["pmids"]["by_filtered_taxon"][key] if key in stats_json["references"]["pmids"]["by_filtered_taxon"] else 0
-        text_report += "\n" + key + "\t" + str(val) + "\t" + str(pmid_val)
-
-    return text_report
+        out.write("\n" + key + "\t" + str(val) + "\t" + str(pmid_val))
 
 def create_meta(json_stats):
     meta = {
@@ -600,20 +879,28 @@ def create_meta(json_stats):
     
 
 def print_help():
-    print('\nUsage: python go_stats.py -g <golr_url> -d <release_date> -o <output_rep>\n')
+    print('\nUsage: python go_stats.py -g <golr_url> -d <release_date> -o <output_rep> [-k <golr_cache_dir>] [-t <taxon_index>] [--checkpoint] [--resume] [--profile <profile.json|profile.prom>]\n')
 
 
 def main(argv):
+    global taxon_index_path
+    global profile_path
+
     golr_url = ''
     output_rep = ''
     release_date = ''
+    cache_dir = ''
+    taxon_index_file = ''
+    use_checkpoint = False
+    resume = False
+    profile_file = ''
 
     if len(argv) < 6:
         print_help()
         sys.exit(2)
 
     try:
-        opts, argv = getopt.getopt(argv,"g:b:o:d:",["golrurl=","orep=","date="])
+        opts, argv = getopt.getopt(argv,"g:b:o:d:k:t:",["golrurl=","orep=","date=","cache=", "taxindex=", "checkpoint", "resume", "profile="])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -630,6 +917,25 @@ def main(argv):
             output_rep = arg
         elif opt in ("-d", "--date"):
             release_date = arg
+        elif opt in ("-k", "--cache"):
+            cache_dir = arg
+        elif opt in ("-t", "--taxindex"):
+            taxon_index_file = arg
+        elif opt == "--checkpoint":
+            use_checkpoint = True
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            profile_file = arg
+
+    if cache_dir != '':
+        utils.enable_golr_cache(cache_dir, release_date)
+
+    if taxon_index_file != '':
+        taxon_index_path = taxon_index_file
+
+    if profile_file != '':
+        profile_path = profile_file
 
     if not output_rep.endswith("/"):
         output_rep += "/"
@@ -637,6 +943,10 @@ def main(argv):
     if not os.path.exists(output_rep):
         os.mkdir(output_rep)
 
+    # with --checkpoint, every completed GOLr unit is saved so that a crashed run can be restarted with --resume
+    if use_checkpoint or resume:
+        enable_checkpoint(output_rep + "checkpoint", resume)
+
 
     # actual names of the files to be generated - can change here if needed
     output_meta = output_rep + "go-meta.json"
@@ -651,26 +961,25 @@ def main(argv):
 
 
     print("Will write stats to " + output_stats + " and " + output_stats_tsv)
-    json_stats = compute_stats(golr_url, release_date, False)
+    all_stats = compute_stats(golr_url, release_date, variants = [False, True])
+    json_stats = all_stats[False]
     print("Saving Stats to <" + output_stats + "> ...")    
     utils.write_json(output_stats, json_stats)
     print("Done.")
 
     print("Saving Stats to <" + output_stats_tsv + "> ...")    
-    tsv_stats = create_text_report(json_stats)
-    utils.write_text(output_stats_tsv, tsv_stats)
+    utils.write_report(output_stats_tsv, write_text_report, json_stats)
     print("Done.")
 
 
     print("Will write stats (excluding protein binding) to " + output_stats_no_pb + " and " + output_stats_no_pb_tsv)
-    json_stats_no_pb = compute_stats(golr_url, release_date, True)
+    json_stats_no_pb = all_stats[True]
     print("Saving Stats to <" + output_stats_no_pb + "> ...")    
     utils.write_json(output_stats_no_pb, json_stats_no_pb)
     print("Done.")
 
     print("Saving Stats (excluding protein binding) to <" + output_stats_no_pb_tsv + "> ...")    
-    tsv_stats_no_pb = create_text_report(json_stats_no_pb)
-    utils.write_text(output_stats_no_pb_tsv, tsv_stats_no_pb)
+    utils.write_report(output_stats_no_pb_tsv, write_text_report, json_stats_no_pb)
     print("Done.")
 
 
@@ -687,27 +996,48 @@ def main(argv):
 
 
     print("Saving PMID file to <" + output_pmids + "> and PubMed PMID file to <" + output_pubmed_pmids + ">")
-    references = get_references()
-    pmids = {k:v for k,v in references.items() if "PMID:" in k}
-    pmids_ids = map(lambda x : x.split(":")[1], pmids)
-
-    pmids_lines = []
-    for k,v in pmids.items():
-        pmids_lines.append(k + "\t" + str(v))
-
-    utils.write_text(output_pmids, "\n".join(pmids_lines))
-    utils.write_text(output_pubmed_pmids, "\n".join(pmids_ids))
+    write_references(get_references(golr_base_url), None, output_pmids, output_pubmed_pmids)
     print("Done.")
 
+    clear_checkpoint()
+
     
 
 
 
-def get_references():
-    refs = utils.golr_fetch(golr_base_url, golr_select_references)
-    refs = utils.build_map(refs['facet_counts']['facet_fields']['reference'])
+def get_references(golr_url):
+    """
+    { reference: number of annotations } of a GOLr, from the reference facet registered by compute_stats if any
+    """
+    if golr_url in reference_facets:
+        print("Using the reference facet of the annotations (" + str(len(reference_facets[golr_url])) + " references)")
+        refs = reference_facets[golr_url].to_map()
+        # the annotation facet leaves out the references counted 0 (facet.mincount=1), which golr_select_references
+        # lists after all the others (sorted by count): only fetch these
+        for reference, count in utils.golr_stream_facet(golr_url, golr_select_references + "&facet.offset=" + str(len(refs)), 'reference'):
+            if count == 0:
+                refs[reference] = count
+        return refs
+    refs = utils.build_map(utils.golr_stream_facet(golr_url, golr_select_references, 'reference'))
     return refs
 
+def write_references(references, output_references, output_pmids, output_pubmed_pmids):
+    """
+    Write the { reference: number of annotations } of get_references as a TSV (skipped if output_references is None),
+    its PMIDs as a TSV and the PMID numbers as a PubMed list (GO.uid)
+    """
+    if output_references is not None:
+        utils.write_report(output_references, write_reference_lines, references.items())
+    pmids = [(k, v) for k, v in references.items() if "PMID:" in k]
+    utils.write_report(output_pmids, write_reference_lines, pmids)
+    utils.write_text(output_pubmed_pmids, "\n".join(k.split(":")[1] for k, v in pmids))
+
+def write_reference_lines(references, out):
+    separator = ""
+    for k, v in references:
+        out.write(separator + k + "\t" + str(v))
+        separator = "\n"
+
 
 
 
@@ -0,0 +1,235 @@
+# Time series store of the GO release statistics summaries (go-stats-summary.json), one row per release date
+#
+# Each summary is flattened into metrics, a metric being the path of keys to a value (e.g. annotations/by_aspect/P),
+# and each metric is stored as a column, one file per column, so that:
+#   * appending a release writes one value at the end of each column, without reading or rewriting the previous releases
+#   * a metric is read for a range of releases without loading the other metrics
+#   * the summaries can be exported back to the JSON aggregate (list of summaries) used by the website
+#
+# Store directory:
+#   * store.json: release dates (one per row, oldest first) and columns (metric path, kind, size of the JSON columns)
+#   * column.<position>.bin: little-endian array of the values of an "int" or "float" metric
+#   * column.<position>.jsonl: values of a "json" metric (strings, lists, empty maps...), one JSON value per line
+# A release without a metric holds MISSING_INT, NaN or an empty line in its column.
+
+import os, json
+from array import array
+from bisect import bisect_left, bisect_right
+
+import go_stats_utils as utils
+
+# typecode of the column files of the numeric kinds
+KINDS = { "int" : "q", "float" : "d" }
+
+MISSING_INT = -2 ** 63
+
+# metric not in a release (see StatsStore.value)
+MISSING = object()
+
+# separator of the keys of a metric given as a string
+METRIC_SEPARATOR = "/"
+
+
+def kind(val):
+    tp = type(val)
+    if tp == int:
+        return "int"
+    if tp == float:
+        return "float"
+    return "json"
+
+def flatten_summary(summary):
+    """
+    Metrics of a release summary, in document order: list of (path, value), path being the tuple of keys to the value
+    """
+    metrics = []
+    stack = [((), iter(summary.items()))]
+    while len(stack) > 0:
+        prefix, items = stack[-1]
+        for key, val in items:
+            path = prefix + (key, )
+            if type(val) == dict and len(val) > 0:
+                stack.append((path, iter(val.items())))
+                break
+            metrics.append((path, val))
+        else:
+            stack.pop()
+    return metrics
+
+def metric_path(metric):
+    return tuple(metric.split(METRIC_SEPARATOR)) if isinstance(metric, str) else tuple(metric)
+
+
+class StatsStore:
+    """
+    Release statistics store in a directory (created if missing)
+    Releases are referred to by their row or their release date, and must be added in release date order
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        meta = { "releases" : [], "columns" : [] }
+        if os.path.exists(self.path("store.json")):
+            with open(self.path("store.json"), "r") as f:
+                meta = json.load(f)
+        self.releases = meta["releases"]
+        self.columns = meta["columns"]
+
+        # (path, kind) -> column position, path -> column positions (a metric may change kind between releases)
+        self.column_index = { }
+        self.path_index = { }
+        for position, column in enumerate(self.columns):
+            self.index_column(position)
+
+        # column position -> values loaded (raw JSON lines for the "json" kind)
+        self.loaded = { }
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def column_file(self, position):
+        return self.path("column." + str(position) + (".jsonl" if self.columns[position]["kind"] == "json" else ".bin"))
+
+    def index_column(self, position):
+        path = tuple(self.columns[position]["path"])
+        self.column_index[(path, self.columns[position]["kind"])] = position
+        if path not in self.path_index:
+            self.path_index[path] = []
+        self.path_index[path].append(position)
+
+    def __len__(self):
+        return len(self.releases)
+
+    def metrics(self):
+        """
+        Metrics stored, as strings (keys joined by METRIC_SEPARATOR)
+        """
+        return [METRIC_SEPARATOR.join(path) for path in self.path_index]
+
+    def release_range(self, start = None, end = None):
+        """
+        Rows of the releases between two release dates, both included (None: no bound)
+        """
+        first = 0 if start is None else bisect_left(self.releases, start)
+        last = len(self.releases) if end is None else bisect_right(self.releases, end)
+        return range(first, max(first, last))
+
+
+    def add_release(self, summary):
+        """
+        Append a release summary as the latest row of the store
+        Return the row of the release
+        """
+        date = summary.get("release_date")
+        if date is None:
+            raise ValueError("Release summaries must have a release_date")
+        if len(self.releases) > 0 and date <= self.releases[-1]:
+            raise ValueError("Release already stored or older than the latest one (" + self.releases[-1] + "): " + date)
+
+        row = len(self.releases)
+        values = { }
+        new_columns = set()
+        for path, val in flatten_summary(summary):
+            if (path, kind(val)) not in self.column_index:
+                new_columns.add(len(self.columns))
+                self.columns.append({ "path" : list(path), "kind" : kind(val) })
+                if kind(val) == "json":
+                    self.columns[-1]["bytes"] = 0
+                self.index_column(len(self.columns) - 1)
+            values[self.column_index[(path, kind(val))]] = val
+
+        for position in range(len(self.columns)):
+            self.append_value(position, row, values.get(position, MISSING), position in new_columns)
+        self.releases.append(date)
+        self.save()
+        return row
+
+    def append_value(self, position, row, val, new_column):
+        """
+        Write the value of a column in the release at the given row; a new column is first filled as missing in the previous releases
+        """
+        column = self.columns[position]
+        self.loaded.pop(position, None)
+        start = 0 if new_column else row
+        padding = row if new_column else 0
+        if column["kind"] == "json":
+            data = ("\n" * padding + ("" if val is MISSING else json.dumps(val)) + "\n").encode("utf-8")
+            with open(self.column_file(position), "ab") as f:
+                f.truncate(0 if new_column else column["bytes"])
+                f.write(data)
+            column["bytes"] = (0 if new_column else column["bytes"]) + len(data)
+        else:
+            missing = MISSING_INT if column["kind"] == "int" else float("nan")
+            utils.write_column(self.column_file(position), array(KINDS[column["kind"]], [missing] * padding + [missing if val is MISSING else val]), start)
+
+    def save(self):
+        # the new values are committed by writing store.json
+        with open(self.path("store.json.tmp"), "w") as f:
+            json.dump({ "releases" : self.releases, "columns" : self.columns }, f, indent = 2)
+        os.replace(self.path("store.json.tmp"), self.path("store.json"))
+
+
+    def column(self, position):
+        """
+        Values of a column, one per release; loaded once
+        """
+        if position not in self.loaded:
+            column = self.columns[position]
+            if column["kind"] == "json":
+                with open(self.column_file(position), "rb") as f:
+                    self.loaded[position] = f.read(column["bytes"]).decode("utf-8").split("\n")[:len(self.releases)]
+            else:
+                self.loaded[position] = utils.read_column(self.column_file(position), KINDS[column["kind"]], len(self.releases))
+        return self.loaded[position]
+
+    def value(self, position, row):
+        """
+        Value of a column in a release, MISSING if the release does not have it
+        """
+        val = self.column(position)[row]
+        kind = self.columns[position]["kind"]
+        if kind == "json":
+            return json.loads(val) if len(val) > 0 else MISSING
+        if (kind == "int" and val == MISSING_INT) or (kind == "float" and val != val):
+            return MISSING
+        return val
+
+    def series(self, metric, start = None, end = None):
+        """
+        Values of a metric (string or tuple of keys) in the releases between two release dates: list of (release_date, value)
+        """
+        path = metric_path(metric)
+        if path not in self.path_index:
+            raise KeyError(metric)
+        series = []
+        for row in self.release_range(start, end):
+            for position in self.path_index[path]:
+                val = self.value(position, row)
+                if val is not MISSING:
+                    series.append((self.releases[row], val))
+                    break
+        return series
+
+    def summary(self, row):
+        """
+        Summary of the release at the given row, as added to the store
+        """
+        summary = { }
+        for position, column in enumerate(self.columns):
+            val = self.value(position, row)
+            if val is MISSING:
+                continue
+            parent = summary
+            for key in column["path"][:-1]:
+                if key not in parent:
+                    parent[key] = { }
+                parent = parent[key]
+            parent[column["path"][-1]] = val
+        return summary
+
+    def export(self, start = None, end = None):
+        """
+        Summaries of the releases between two release dates, in the JSON aggregate format (list of summaries, oldest first)
+        """
+        return [self.summary(row) for row in self.release_range(start, end)]
@@ -1,5 +1,18 @@
 import json
+import codecs
+import gzip
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+import time
 import requests
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import compress
+from urllib.parse import urlparse, quote
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from enum import Enum
@@ -86,10 +99,43 @@ def requests_retry(retries = 3, backoff = 0.3, session = None):
     return session
 
 
-def fetch(url):
+# callables notified of each HTTP call (and GOLr cache hit) with an event:
+# { method, url, status, seconds, bytes, retries, cache ("hit" or None), error }
+observers = [ ]
+
+def add_observer(observer):
+    observers.append(observer)
+
+def remove_observer(observer):
+    if observer in observers:
+        observers.remove(observer)
+
+def notify(method, url, start, r = None, size = None, cache = None, error = None):
+    """
+    Send an event to the observers, start being the time.time() before the call
+    """
+    if len(observers) == 0:
+        return
+    retries = getattr(r.raw, "retries", None) if r is not None else None
+    event = {
+        "method" : method,
+        "url" : url,
+        "status" : r.status_code if r is not None else None,
+        "seconds" : time.time() - start,
+        "bytes" : size if size is not None else (len(r.content) if r is not None else 0),
+        "retries" : len(retries.history) if retries is not None else 0,
+        "cache" : cache,
+        "error" : str(error) if error is not None else None
+    }
+    for observer in list(observers):
+        observer(event)
+
+def fetch(url, stream = False):
     """
     Error proof method to get data from HTTP request
     If an error occured, return None
+    With stream = True, the body is only downloaded as it is iterated over (r.iter_content)
+    and the caller reports the call to the observers once the body is consumed
     """
     global global_session
 
@@ -97,35 +143,680 @@ def fetch(url):
     if global_session is None:
         global_session = requests_retry(global_session)
     
+    start = time.time()
     try:
-        r = global_session.get(url)
+        r = global_session.get(url, stream = stream)
+        if not stream:
+            notify("GET", url, start, r)
         return r
     except Exception as x:
         print("Query GET " , url , " failed: ", x)
+        notify("GET", url, start, error = x)
         return None
 
+def fetch_lines(url, chunk_size = 1024 * 1024):
+    """
+    Stream a text document and yield its lines (split on "\n" only, like text.split("\n")) without holding the whole text in memory
+    The body is decoded as r.text would, with the encoding given by the server (utf-8 if none)
+    """
+    start = time.time()
+    r = fetch(url, stream = True)
+    if r is None or r.status_code != 200:
+        raise IOError("Query GET " + url + " failed: " + (str(r.status_code) if r is not None else "no response"))
+
+    decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors = "replace")
+    size = 0
+    buffer = ""
+    try:
+        for chunk in r.iter_content(chunk_size = chunk_size):
+            size += len(chunk)
+            lines = (buffer + decoder.decode(chunk)).split("\n")
+            buffer = lines.pop()
+            for line in lines:
+                yield line
+        buffer += decoder.decode(b"", final = True)
+        if buffer:
+            yield buffer
+    finally:
+        r.close()
+        notify("GET", url, start, r, size)
+
 def post(url, params):
     global global_session
     global_session = requests_retry(global_session)
+    start = time.time()
     try:
         r = global_session.post(url, data = params)
+        notify("POST", url, start, r)
         return r  
     except Exception as x:
         print("Query POST " , url , " failed: ", x)
+        notify("POST", url, start, error = x)
         return None
+
+
+# filter queries reported under a same template, e.g. all the fq=taxon:"NCBITaxon:xxx" queries as fq=taxon:*
+TEMPLATE_FIELDS = ("taxon", "assigned_by")
+
+def query_template(url):
+    """
+    Reduce a query URL to its template by replacing the values of the per taxon / per group filters by *
+    """
+    base, sep, query = url.partition("?")
+    params = [ ]
+    for param in query.split("&") if sep else [ ]:
+        name, _, value = param.partition("=")
+        field = value.partition(":")[0]
+        if name == "fq" and field.lstrip("!") in TEMPLATE_FIELDS:
+            param = name + "=" + field + ":*"
+        params.append(param)
+    return base + sep + "&".join(params)
+
+class RequestProfile:
+    """
+    Observer aggregating the HTTP calls by query template: number of requests, errors, cache hits,
+    latency histogram, bytes received and retries
+    With url_prefix, only the calls to urls starting with it are recorded (e.g. those of one GOLr, other downloads running at the same time)
+    The profile can be written as JSON or in the Prometheus text format
+    """
+
+    # upper bounds (seconds) of the latency histogram buckets
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, url_prefix = None):
+        self.lock = threading.Lock()
+        self.templates = { }
+        self.url_prefix = url_prefix
+
+    def __call__(self, event):
+        if self.url_prefix is not None and not event["url"].startswith(self.url_prefix):
+            return
+        template = query_template(event["url"])
+        with self.lock:
+            if template not in self.templates:
+                self.templates[template] = { "requests" : 0, "errors" : 0, "cache_hits" : 0, "bytes" : 0, "retries" : 0,
+                                             "seconds" : 0.0, "max_seconds" : 0.0, "buckets" : [0] * (len(self.BUCKETS) + 1) }
+            stats = self.templates[template]
+            if event["cache"] == "hit":
+                stats["cache_hits"] += 1
+                return
+            stats["requests"] += 1
+            if event["error"] is not None or (event["status"] is not None and event["status"] >= 400):
+                stats["errors"] += 1
+            stats["bytes"] += event["bytes"]
+            stats["retries"] += event["retries"]
+            stats["seconds"] += event["seconds"]
+            stats["max_seconds"] = max(stats["max_seconds"], event["seconds"])
+            index = 0
+            while index < len(self.BUCKETS) and event["seconds"] > self.BUCKETS[index]:
+                index += 1
+            stats["buckets"][index] += 1
+
+    def to_json(self):
+        """
+        Return the profile as { template: stats }, the most time consuming templates first
+        """
+        profile = { }
+        with self.lock:
+            for template, stats in sorted(self.templates.items(), key = lambda item: item[1]["seconds"], reverse = True):
+                profile[template] = dict(stats)
+                profile[template]["buckets"] = { str(bound) : count for bound, count in zip(self.BUCKETS + ("+Inf",), stats["buckets"]) }
+        return profile
+
+    def to_prometheus(self):
+        lines = [ ]
+        metrics = (("golr_requests_total", "counter", "requests"), ("golr_errors_total", "counter", "errors"),
+                   ("golr_cache_hits_total", "counter", "cache_hits"), ("golr_response_bytes_total", "counter", "bytes"),
+                   ("golr_retries_total", "counter", "retries"))
+        profile = self.to_json()
+        labels = { template : '{template="' + template.replace("\\", "\\\\").replace('"', '\\"') + '"}' for template in profile }
+
+        for metric, kind, field in metrics:
+            lines.append("# TYPE " + metric + " " + kind)
+            for template, stats in profile.items():
+                lines.append(metric + labels[template] + " " + str(stats[field]))
+
+        lines.append("# TYPE golr_request_seconds histogram")
+        for template, stats in profile.items():
+            cumulative = 0
+            for bound, count in stats["buckets"].items():
+                cumulative += count
+                lines.append("golr_request_seconds_bucket" + labels[template][:-1] + ',le="' + bound + '"} ' + str(cumulative))
+            lines.append("golr_request_seconds_sum" + labels[template] + " " + str(stats["seconds"]))
+            lines.append("golr_request_seconds_count" + labels[template] + " " + str(stats["requests"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the profile as Prometheus text if path ends with .prom, as JSON otherwise
+        """
+        if path.endswith(".prom"):
+            write_text(path, self.to_prometheus())
+        else:
+            write_json(path, self.to_json())
     
 
+# default bounds of the on-disk GOLr cache: entries live one week and the whole cache is capped to 10 GB
+GOLR_CACHE_TTL = 7 * 24 * 3600
+GOLR_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+golr_cache = None
+
+class GolrCache:
+    """
+    Persistent cache of GOLr responses, stored as gzipped JSON files
+    Entries are keyed by a hash of the base url and select query and grouped in one folder per namespace (e.g. a release date)
+    Entries older than ttl seconds are ignored; when the cache grows over max_size bytes, least recently used entries are evicted
+    """
+
+    def __init__(self, directory, namespace = "default", ttl = GOLR_CACHE_TTL, max_size = GOLR_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, namespace), exist_ok = True)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self):
+        for namespace in os.listdir(self.directory):
+            folder = os.path.join(self.directory, namespace)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".json.gz"):
+                    yield os.path.join(folder, name)
+
+    def key(self, golr_base_url, select_query):
+        return hashlib.sha256((golr_base_url + select_query).encode("utf-8")).hexdigest()
+
+    def path(self, golr_base_url, select_query):
+        return os.path.join(self.directory, self.namespace, self.key(golr_base_url, select_query) + ".json.gz")
+
+    def lookup(self, golr_base_url, select_query):
+        """
+        Return the path of a valid entry for this query, or None on a cache miss
+        """
+        path = self.path(golr_base_url, select_query)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                self.remove(path)
+                path = None
+        except OSError:
+            path = None
+
+        with self.lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if path is not None:
+            # keep track of the last access for the LRU eviction, without losing the creation time used by the TTL
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        return path
+
+    def get(self, golr_base_url, select_query):
+        """
+        Return the cached json object for this query, or None on a cache miss
+        """
+        path = self.lookup(golr_base_url, select_query)
+        if path is None:
+            return None
+        try:
+            with gzip.open(path, "rt", encoding = "utf-8") as infile:
+                return json.load(infile)
+        except (OSError, EOFError, ValueError) as x:
+            print("Could not read GOLr cache entry ", path, ": ", x)
+            self.remove(path)
+            return None
+
+    def put(self, golr_base_url, select_query, content):
+        """
+        Store the raw (bytes) JSON body of a GOLr response
+        """
+        path = self.path(golr_base_url, select_query)
+        tmp_path = path + "." + str(threading.get_ident()) + ".tmp"
+        with gzip.open(tmp_path, "wb", compresslevel = 6) as outfile:
+            outfile.write(content)
+        self.add(tmp_path, path)
+
+    def add(self, tmp_path, path):
+        """
+        Atomically move a fully written entry in place and enforce the size bound of the cache
+        """
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.size += os.path.getsize(path)
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def remove(self, path):
+        with self.lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+    def evict(self):
+        """
+        Remove entries, least recently used first, until the cache fits in max_size
+        """
+        entries = sorted(self._entries(), key = os.path.getatime)
+        for path in entries:
+            if self.size <= self.max_size:
+                break
+            self.remove(path)
+
+
+def enable_golr_cache(directory, namespace = "default", ttl = GOLR_CACHE_TTL, max_size = GOLR_CACHE_MAX_SIZE):
+    """
+    Store and reuse all GOLr responses in the given folder, namespace being typically the release date
+    """
+    global golr_cache
+    golr_cache = GolrCache(directory, namespace, ttl, max_size)
+    print("Using GOLr cache <" + os.path.join(directory, namespace) + ">")
+    return golr_cache
+
+
+class Checkpoint:
+    """
+    Local store of the units of work (e.g. the per taxon or per group GOLr queries) already completed by a run,
+    so that a restarted run resumes from the last finished unit instead of starting over
+    Each stage is a JSON lines file of { key, result } appended as soon as a unit completes
+    """
+
+    def __init__(self, directory, resume = False):
+        self.directory = directory
+        self.stages = { }
+        self.files = { }
+        os.makedirs(directory, exist_ok = True)
+        if not resume:
+            self.clear()
+
+    def path(self, stage):
+        return os.path.join(self.directory, stage + ".jsonl")
+
+    def load(self, stage):
+        """
+        Return the { key: result } already completed for a stage
+        """
+        if stage not in self.stages:
+            results = { }
+            path = self.path(stage)
+            if os.path.exists(path):
+                valid = 0
+                with open(path, "rb") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            break
+                        if not line.endswith(b"\n"):
+                            break
+                        results[entry["key"]] = entry["result"]
+                        valid += len(line)
+                # drop what an interrupted run may have partially written
+                if valid < os.path.getsize(path):
+                    os.truncate(path, valid)
+                if len(results) > 0:
+                    print("Resuming stage " + stage + " with ", len(results), " completed units")
+            self.stages[stage] = results
+        return self.stages[stage]
+
+    def get(self, stage, key):
+        return self.load(stage).get(key)
+
+    def save(self, stage, key, result):
+        # the result is only written: the caller keeps it in memory if needed
+        self.load(stage)
+        if stage not in self.files:
+            self.files[stage] = open(self.path(stage), "a")
+        self.files[stage].write(json.dumps({ "key" : key, "result" : result }) + "\n")
+        self.files[stage].flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = { }
+
+    def clear(self):
+        """
+        Forget all the completed units, e.g. once the run is over
+        """
+        self.close()
+        self.stages = { }
+        for name in os.listdir(self.directory):
+            if name.endswith(".jsonl"):
+                os.remove(os.path.join(self.directory, name))
+
+
 def golr_fetch(golr_base_url, select_query):
     """
     Error proof method to get data from GOLr
     If an HTTP error occurs, return None, otherwise return the json object
+    If a GOLr cache is enabled, responses are first looked up in (and then saved to) the cache
     """
+    if golr_cache is not None:
+        start = time.time()
+        response = golr_cache.get(golr_base_url, select_query)
+        if response is not None:
+            notify("GET", golr_base_url + select_query, start, cache = "hit")
+            return response
+
     r = fetch(golr_base_url + select_query)
     if r is None:
         return None
     response = r.json()
+    if golr_cache is not None and r.status_code == 200:
+        golr_cache.put(golr_base_url, select_query, r.content)
     return response
 
+# size of the chunks read when streaming GOLr responses
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+def golr_stream_chunks(golr_base_url, select_query):
+    """
+    Yield the JSON body of a GOLr response as chunks of text, without holding the whole body in memory
+    If a GOLr cache is enabled, the body is read from (or on a miss, written to) the cache while streaming
+    """
+    start = time.time()
+    path = golr_cache.lookup(golr_base_url, select_query) if golr_cache is not None else None
+    if path is not None:
+        notify("GET", golr_base_url + select_query, start, cache = "hit")
+        with gzip.open(path, "rt", encoding = "utf-8") as infile:
+            while True:
+                chunk = infile.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    r = fetch(golr_base_url + select_query, stream = True)
+    if r is not None and r.status_code != 200:
+        notify("GET", golr_base_url + select_query, start, r)
+    if r is None or r.status_code != 200:
+        raise IOError("Query GET " + golr_base_url + select_query + " failed: " + (str(r.status_code) if r is not None else "no response"))
+
+    outfile = None
+    if golr_cache is not None:
+        path = golr_cache.path(golr_base_url, select_query)
+        tmp_path = path + "." + str(threading.get_ident()) + ".tmp"
+        outfile = gzip.open(tmp_path, "wb", compresslevel = 6)
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    completed = False
+    size = 0
+    try:
+        for chunk in r.iter_content(chunk_size = STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            if outfile is not None:
+                outfile.write(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final = True)
+        completed = True
+    finally:
+        r.close()
+        notify("GET", golr_base_url + select_query, start, r, size, error = None if completed else "incomplete body")
+        if outfile is not None:
+            outfile.close()
+            # only complete bodies are added to the cache
+            if completed:
+                golr_cache.add(tmp_path, path)
+            else:
+                os.remove(tmp_path)
+
+def seek_json_key(chunks, buffer, keys, opening = r"\["):
+    """
+    Read the text chunks of a JSON document until the value of the nested keys is found (the last key being followed by opening)
+    Return the text right after the opening of that value
+    Raise a ValueError naming the missing key if the document ends before, e.g. on a GOLr error body or a renamed facet
+    """
+    for index, key in enumerate(keys):
+        pattern = re.compile('"' + re.escape(key) + r'"\s*:\s*' + (opening if index == len(keys) - 1 else r"\{"))
+        match = pattern.search(buffer)
+        while match is None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("Key " + "/".join(keys[:index + 1]) + " not found in the JSON document")
+            # keep enough of the previous chunk to match a key split over two chunks
+            buffer = buffer[-(len(key) + 64):] + chunk
+            match = pattern.search(buffer)
+        buffer = buffer[match.end():]
+    return buffer
+
+def iter_json_items(chunks, keys, buffer = ""):
+    """
+    Incrementally parse a JSON document given as an iterable of text chunks and yield the items of the array found under the nested keys
+    e.g. keys = ["facet_fields", "reference"] yields A, 1, B, 2 from { ... "facet_fields": { ..., "reference": [A, 1, B, 2] } }
+    Only the items of that array are decoded, the rest of the document is skipped
+    buffer is text of the document already read from chunks
+    Raise a ValueError if the document has no such array
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+
+    # move the buffer right after the opening bracket of the array
+    buffer = seek_json_key(chunks, buffer, keys)
+
+    pos = 0
+    ended = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            # consume the rest of the document so that the response is complete (e.g. to be cached)
+            for chunk in chunks:
+                pass
+            return
+        if pos < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # an item ending with the buffer may be a truncated number: only trust it once more text is read
+                if end < len(buffer) or ended:
+                    yield item
+                    pos = end
+                    continue
+            except ValueError:
+                if ended:
+                    raise
+        if ended:
+            raise ValueError("Truncated JSON document: array " + "/".join(keys) + " not closed")
+        chunk = next(chunks, None)
+        if chunk is None:
+            ended = True
+            continue
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def golr_stream(golr_base_url, select_query, keys):
+    """
+    Yield the items of the array found under the nested keys of a GOLr response, parsing the response as it is downloaded
+    e.g. keys = ["response", "docs"] to iterate over the documents
+    """
+    return iter_json_items(golr_stream_chunks(golr_base_url, select_query), keys)
+
+def golr_stream_docs(golr_base_url, select_query):
+    """
+    Return the numFound of a GOLr query and an iterator over its documents, parsing the response as it is downloaded
+    """
+    chunks = iter(golr_stream_chunks(golr_base_url, select_query))
+    buffer = seek_json_key(chunks, "", ["response", "numFound"], "")
+    # a number is only complete once followed by another character
+    match = re.match(r"\s*(\d+)\D", buffer)
+    while match is None:
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Truncated numFound in the response of " + golr_base_url + select_query)
+        buffer += chunk
+        match = re.match(r"\s*(\d+)\D", buffer)
+    return int(match.group(1)), iter_json_items(chunks, ["docs"], buffer[match.end(1):])
+
+def golr_stream_facet(golr_base_url, select_query, field):
+    """
+    Yield the (value, count) pairs of a facet field of a GOLr response, parsing the response as it is downloaded
+    """
+    items = golr_stream(golr_base_url, select_query, ["facet_fields", field])
+    return zip(items, items)
+
+
+class RateLimiter:
+    """
+    Space out requests sent to a same host so that no more than max_rate requests per second are issued
+    Safe to share between threads
+    """
+
+    def __init__(self, max_rate = 10):
+        self.interval = 1.0 / max_rate if max_rate else 0
+        self.next_slot = { }
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if self.interval == 0:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def golr_fetch_all(golr_base_url, queries, max_workers = 8, max_rate = 10, fetcher = None):
+    """
+    Concurrently run a map of { key: select_query } against GOLr
+    Return a map of { key: response } with the same keys, a response being None if the query failed
+    The shared session (and its retries) is used by all workers; max_rate bounds the requests per second per host
+    """
+    return dict(golr_fetch_iter(golr_base_url, queries, max_workers, max_rate, fetcher))
+
+def golr_fetch_iter(golr_base_url, queries, max_workers = 8, max_rate = 10, fetcher = None):
+    """
+    Same as golr_fetch_all but yield (key, response) as soon as each query completes
+    fetcher(golr_base_url, select_query) is golr_fetch by default
+    """
+    global global_session
+
+    fetcher = fetcher or golr_fetch
+    if len(queries) == 0:
+        return
+
+    # create the shared session before starting the workers so that they don't race to create it
+    if global_session is None:
+        global_session = requests_retry(global_session)
+
+    limiter = RateLimiter(max_rate)
+
+    def run(select_query):
+        limiter.wait(golr_base_url)
+        return fetcher(golr_base_url, select_query)
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(queries)))) as executor:
+        futures = { executor.submit(run, select_query) : key for key, select_query in queries.items() }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as x:
+                print("Query ", queries[futures[future]], " failed: ", x)
+                yield futures[future], None
+
+
+# GOLr instances already probed for composite faceting support: { golr_base_url: bool }
+golr_composite_support = { }
+
+def golr_supports_composite_facets(golr_base_url):
+    """
+    Check (once per GOLr instance) if the JSON facet API of Solr 5+ is available
+    Older instances (e.g. Solr 3.6) silently ignore the json.facet parameter
+    """
+    if golr_base_url not in golr_composite_support:
+        probe = { "probe" : { "type" : "query", "q" : "*:*" } }
+        r = fetch(golr_base_url + "select?q=*:*&rows=0&wt=json&json.facet=" + quote(json.dumps(probe)))
+        try:
+            supported = r is not None and r.status_code == 200 and "facets" in r.json()
+        except ValueError:
+            supported = False
+        golr_composite_support[golr_base_url] = supported
+        print("GOLr composite faceting supported by " + golr_base_url + ": ", supported)
+    return golr_composite_support[golr_base_url]
+
+def golr_composite_facet(field, sub_queries, mincount = 1, limit = -1):
+    """
+    Build the json.facet parameter faceting on field and counting, inside each bucket, the documents matching each of the sub_queries { key: query }
+    This replaces one facet query per sub query by a single request
+    """
+    sub_facets = { }
+    for index, sub_query in enumerate(sub_queries.values()):
+        sub_facets["q" + str(index)] = { "type" : "query", "q" : sub_query }
+    facet = { "all" : { "type" : "terms", "field" : field, "limit" : limit, "mincount" : mincount, "facet" : sub_facets } }
+    return "&json.facet=" + quote(json.dumps(facet))
+
+def golr_split_composite(response, sub_queries, mincount = 1):
+    """
+    Turn the response of a composite facet into solr/golr facet arrays [A, 1, B, 2]
+    Return { None: facet of all documents, key: facet of the documents matching each sub query }
+    """
+    facets = { None : [ ] }
+    for key in sub_queries:
+        facets[key] = [ ]
+
+    buckets = response['facets']['all']['buckets'] if 'all' in response['facets'] else [ ]
+    for bucket in buckets:
+        facets[None] += [bucket['val'], bucket['count']]
+        for index, key in enumerate(sub_queries):
+            count = bucket["q" + str(index)]['count'] if "q" + str(index) in bucket else 0
+            if count >= mincount:
+                facets[key] += [bucket['val'], count]
+    return facets
+
+
+# GOLr instances already probed for pivot faceting support: { golr_base_url: bool }
+golr_pivot_support = { }
+
+def golr_supports_pivot_facets(golr_base_url):
+    """
+    Check (once per GOLr instance) if pivot faceting (Solr 4+) is available
+    Older instances (e.g. Solr 3.6) silently ignore the facet.pivot parameter
+    """
+    if golr_base_url not in golr_pivot_support:
+        r = fetch(golr_base_url + "select?q=*:*&rows=0&wt=json&facet=true&facet.limit=1&facet.pivot=document_category,document_category")
+        try:
+            supported = r is not None and r.status_code == 200 and "facet_pivot" in r.json().get("facet_counts", { })
+        except ValueError:
+            supported = False
+        golr_pivot_support[golr_base_url] = supported
+        print("GOLr pivot faceting supported by " + golr_base_url + ": ", supported)
+    return golr_pivot_support[golr_base_url]
+
+def golr_stream_pivot(golr_base_url, select_query, pivot):
+    """
+    Yield the entries { field, value, count, pivot: [...] } of a pivot facet (e.g. "taxon,reference") of a GOLr response, parsing the response as it is downloaded
+    Only one first level value and its sub facet is decoded at a time
+    """
+    return golr_stream(golr_base_url, select_query, ["facet_pivot", pivot])
+
+def count_pivot(entries, key_str):
+    """
+    Count, for each first level value of a pivot facet, the number of distinct second level values and how many of them contain key_str
+    Return { value: (total, matching) }
+    """
+    counts = { }
+    for entry in entries:
+        total = 0
+        matching = 0
+        for sub in entry.get('pivot', [ ]):
+            total += 1
+            if key_str in sub['value']:
+                matching += 1
+        counts[entry['value']] = (total, matching)
+    return counts
+
+
 def golr_fetch_by_taxon(golr_base_url, select_query, taxon):
     return golr_fetch(golr_base_url, select_query + "&fq=taxon:\"" + taxon + "\"")
 
@@ -138,20 +829,139 @@ def golr_fetch_by_taxa(golr_base_url, select_query, taxa):
     print("*** ", golr_base_url + select_query + tmp)
     return golr_fetch(golr_base_url, select_query + tmp)
 
+# utility function to iterate over the (A, 1) pairs of a facet
+# a facet is either a solr/golr facet array [A, 1, B, 2], a Facet or an iterable of pairs such as the ones streamed by golr_stream_facet
+def facet_pairs(items):
+    if isinstance(items, list):
+        it = iter(items)
+        return zip(it, it)
+    if isinstance(items, Facet):
+        return items.items()
+    return items
+
+
+class Facet:
+    """
+    Columnar representation of a solr/golr facet: a list of interned keys and a parallel int64 array of counts
+    Filtering, clustering, sorting and thresholding work column-wise and return new facets;
+    to_map() / to_list() give back the usual dict / facet array shapes, typically when writing the JSON stats
+    """
+
+    __slots__ = ("keys", "counts")
+
+    def __init__(self, keys = None, counts = None):
+        self.keys = keys if keys is not None else [ ]
+        self.counts = counts if counts is not None else array("q")
+
+    @classmethod
+    def from_facet(cls, items):
+        """
+        Build a Facet from a solr/golr facet array [A, 1, B, 2] or an iterable of (A, 1) pairs
+        """
+        if isinstance(items, Facet):
+            return items
+        if isinstance(items, list):
+            return cls(list(map(sys.intern, items[0::2])), array("q", items[1::2]))
+        facet = cls()
+        for key, val in items:
+            facet.keys.append(sys.intern(key))
+            facet.counts.append(val)
+        return facet
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        return zip(self.keys, self.counts)
+
+    def select(self, mask):
+        return Facet(list(compress(self.keys, mask)), array("q", compress(self.counts, mask)))
+
+    def threshold(self, min_size = None):
+        """
+        Keep the entries with a count strictly greater than min_size
+        """
+        if min_size is None:
+            return self
+        return self.select([count > min_size for count in self.counts])
+
+    def filter(self, key_str):
+        """
+        Keep the entries whose key contains key_str (e.g. "PMID:")
+        """
+        return self.select([key_str in key for key in self.keys])
+
+    def count_matching(self, key_str):
+        return sum(key_str in key for key in self.keys)
+
+    def sorted(self, reverse = True):
+        """
+        Sort the entries by count (decreasing by default), keeping the current order of equal counts
+        """
+        order = sorted(range(len(self.counts)), key = self.counts.__getitem__, reverse = reverse)
+        return Facet([self.keys[i] for i in order], array("q", [self.counts[i] for i in order]))
+
+    def cluster(self, synonyms):
+        """
+        Sum up the counts of the keys sharing a same synonym, e.g. to cluster evidences by evidence group
+        """
+        positions = { }
+        facet = Facet()
+        for key, count in zip(self.keys, self.counts):
+            cluster_key = synonyms[key]
+            if cluster_key in positions:
+                facet.counts[positions[cluster_key]] += count
+            else:
+                positions[cluster_key] = len(facet.keys)
+                facet.keys.append(cluster_key)
+                facet.counts.append(count)
+        return facet
+
+    def to_map(self):
+        return dict(zip(self.keys, self.counts))
+
+    def to_list(self):
+        ls = [ ]
+        for key, count in zip(self.keys, self.counts):
+            ls.append(key)
+            ls.append(count)
+        return ls
+
+
+def facet_limit(select_query):
+    """
+    facet.limit of a solr/golr query (-1: no limit), 100 (solr default) if not given
+    """
+    limits = re.findall(r"[?&]facet\.limit=(-?\d+)", select_query)
+    return int(limits[-1]) if len(limits) > 0 else 100
+
+def columnar_facets(response):
+    """
+    Replace in place the facet arrays of a GOLr response by Facets, releasing the original lists
+    """
+    facet_fields = response['facet_counts']['facet_fields']
+    for field in facet_fields:
+        facet_fields[field] = Facet.from_facet(facet_fields[field])
+    return response
+
 # utility function to build a list from a solr/golr facet array
 def build_list(items_list, min_size = None):
+    if isinstance(items_list, Facet):
+        return list(items_list.threshold(min_size).keys)
     ls = []
-    for i in range(0, len(items_list), 2):
-        if min_size is None or items_list[i + 1] > min_size:
-            ls.append(items_list[i])
+    for key, val in facet_pairs(items_list):
+        if min_size is None or val > min_size:
+            ls.append(key)
     return ls
 
 # utility function to transform a list [A, 1, B, 2] into a map {A: 1, B: 2}
 def build_map(items_list, min_size = None):
+    if isinstance(items_list, Facet):
+        return items_list.threshold(min_size).to_map()
     map = {}
-    for i in range(0, len(items_list), 2):
-        if min_size is None or items_list[i + 1] > min_size:
-            map[items_list[i]] = items_list[i + 1]
+    for key, val in facet_pairs(items_list):
+        if min_size is None or val > min_size:
+            map[key] = val
     return map
 
 # utility function to build a reverse map: { "a": 1, "b": 1, "c": 2 } -> {1: ["a", "b"], 2: ["c"]}
@@ -168,6 +978,8 @@ def build_reverse_map(map):
 
 # utility function to cluster elements of an input map based on another map of synonyms
 def cluster_map(input_map, synonyms):
+    if isinstance(input_map, Facet):
+        return input_map.cluster(synonyms).to_map()
     cluster = { }
     for key, val in input_map.items():
         temp = synonyms[key]
@@ -196,18 +1008,37 @@ def cluster_complex_map(input_map, synonyms):
 
 # reorder map (python 3.6 keeps order in which items are inserted in map: https://stackoverflow.com/questions/613183/how-do-i-sort-a-dictionary-by-value)
 def ordered_map(map):
+    if isinstance(map, Facet):
+        return map.sorted().to_map()
     ordered_map = { }
     for w in sorted(map, key=map.get, reverse=True):
         ordered_map[w] = map[w]
     return ordered_map
     
 def extract_map(map, key_str):
+    if isinstance(map, Facet):
+        return map.filter(key_str).to_map()
     extracted = { }
-    for key, val in map.items():
+    for key, val in (map.items() if isinstance(map, dict) else facet_pairs(map)):
         if key_str in key:
             extracted[key] = val
     return extracted
 
+def count_facet(items, key_str):
+    """
+    Count in a single pass the entries of a facet and the ones containing key_str (e.g. "PMID:")
+    Return (total, matching), without building any intermediate map
+    """
+    if isinstance(items, Facet):
+        return len(items), items.count_matching(key_str)
+    total = 0
+    matching = 0
+    for key, val in facet_pairs(items):
+        total += 1
+        if key_str in key:
+            matching += 1
+    return total, matching
+
 
 def merge_dict(dict_total, dict_diff):
     new_dict = { }
@@ -268,6 +1099,111 @@ def added_removed_species(current_stats, previous_stats):
     return results    
 
 
+def sorted_difference(values, exclude):
+    """
+    Yield the values not in exclude, both being sorted without duplicates: one linear merge of the two sequences
+    """
+    j = 0
+    length = len(exclude)
+    for value in values:
+        while j < length and exclude[j] < value:
+            j += 1
+        if j == length or exclude[j] != value:
+            yield value
+
+
+class ReferenceSet:
+    """
+    Set of reference ids (PMID:1234, GO_REF:0000033, DOI:10.1/abc...) packed by prefix, to diff releases of tens of millions of references:
+    the numeric ids of a prefix are kept in a sorted array of integers (one per zero padding width, to render them back as given),
+    the other ids in a sorted list of strings
+    """
+
+    def __init__(self, references = ()):
+        self.numbers = { }
+        self.others = { }
+        for reference in references:
+            if not reference:
+                continue
+            prefix, sep, local = reference.partition(":")
+            if sep and local.isdigit() and local.isascii() and len(local) < 20:
+                width = len(local) if local[0] == "0" and len(local) > 1 else 0
+                key = (prefix, width)
+                if key not in self.numbers:
+                    self.numbers[key] = array("Q")
+                self.numbers[key].append(int(local))
+            else:
+                if prefix not in self.others:
+                    self.others[prefix] = []
+                self.others[prefix].append(reference)
+        for key, numbers in self.numbers.items():
+            self.numbers[key] = array("Q", sorted(set(numbers)))
+        for prefix, others in self.others.items():
+            self.others[prefix] = sorted(set(others))
+
+    def __len__(self):
+        return sum(len(numbers) for numbers in self.numbers.values()) + sum(len(others) for others in self.others.values())
+
+    def __iter__(self):
+        """
+        Yield the reference ids, by prefix then in ascending order
+        """
+        for prefix in self.prefixes():
+            for reference in self.iter_prefix(prefix):
+                yield reference
+
+    def prefixes(self):
+        return sorted(set(prefix for prefix, width in self.numbers) | set(self.others))
+
+    def iter_prefix(self, prefix):
+        for (number_prefix, width), numbers in sorted(self.numbers.items()):
+            if number_prefix == prefix:
+                for number in numbers:
+                    yield prefix + ":" + (str(number).zfill(width) if width else str(number))
+        for reference in self.others.get(prefix, ()):
+            yield reference
+
+    def count(self, prefix):
+        return sum(len(numbers) for (number_prefix, width), numbers in self.numbers.items() if number_prefix == prefix) + len(self.others.get(prefix, ()))
+
+    def difference(self, other):
+        """
+        References of this set that are not in other, as a new ReferenceSet
+        """
+        diff = ReferenceSet()
+        for key, numbers in self.numbers.items():
+            diff.numbers[key] = array("Q", sorted_difference(numbers, other.numbers.get(key, ())))
+        for prefix, others in self.others.items():
+            diff.others[prefix] = list(sorted_difference(others, other.others.get(prefix, ())))
+        return diff
+
+    def filter(self, key_str):
+        """
+        References whose id contains key_str, as a new ReferenceSet
+        e.g. filter("PMID:"), the PMID predicate of go_stats (see extract_map and count_facet), which also keeps MGI:PMID:1234
+        """
+        selected = ReferenceSet()
+        for (prefix, width), numbers in self.numbers.items():
+            if key_str in prefix + ":":
+                selected.numbers[(prefix, width)] = numbers
+            else:
+                # key_str may still span the prefix and the number
+                selected.numbers[(prefix, width)] = array("Q", (number for number in numbers if key_str in prefix + ":" + (str(number).zfill(width) if width else str(number))))
+        for prefix, others in self.others.items():
+            selected.others[prefix] = [reference for reference in others if key_str in reference]
+        return selected
+
+    def write(self, key):
+        """
+        Stream the reference ids to a file, one per line
+        """
+        with open(key, 'w', buffering = REPORT_BUFFER_SIZE) as outfile:
+            first = True
+            for reference in self:
+                outfile.write(reference if first else "\n" + reference)
+                first = False
+
+
 def bioentity_type(str_type):
     """
     In a nutshell, collapse all RNA related types into RNA
@@ -285,6 +1221,36 @@ def sum_map_values(map):
         total += val
     return total
 
+def read_column(path, typecode, count):
+    """
+    Read the first count values of a column file: a little-endian array of the given typecode
+    """
+    column = array(typecode)
+    if count > 0:
+        with open(path, "rb") as f:
+            column.frombytes(f.read(count * column.itemsize))
+        if sys.byteorder != "little":
+            column.byteswap()
+    return column
+
+def append_column(path, column, start):
+    """
+    Write the values of a column from position start to its column file, in place of anything after them
+    """
+    write_column(path, column[start:], start)
+
+def write_column(path, values, start):
+    """
+    Write an array of values to a column file at position start, in place of anything after it
+    """
+    # a crashed append only leaves unused bytes after the count committed by the caller: cut them first
+    with open(path, "ab") as f:
+        f.truncate(start * values.itemsize)
+        if sys.byteorder != "little":
+            values = array(values.typecode, values)
+            values.byteswap()
+        f.write(values.tobytes())
+
 def write_json(key, content):
     with open(key, 'w') as outfile:
         try:
@@ -299,3 +1265,20 @@ def write_text(key, content):
         finally:
             outfile.close()
 
+# buffer size of the report files written by write_report
+REPORT_BUFFER_SIZE = 1024 * 1024
+
+def write_report(key, render, content):
+    """
+    Stream a text report to a file: render(content, out) writes its rows to a buffered handle, the report never being held in memory
+    """
+    with open(key, 'w', buffering = REPORT_BUFFER_SIZE) as outfile:
+        render(content, outfile)
+
+def render_report(render, content):
+    """
+    Same as write_report, but return the report as a string
+    """
+    out = io.StringIO()
+    render(content, out)
+    return out.getvalue()
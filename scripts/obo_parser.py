@@ -1,10 +1,37 @@
 import networkx as nx
+import io
 import re
 
 from enum import Enum
 
 import requests
 import sys
+import os
+import pickle
+import gc
+import itertools
+
+from array import array
+from hashlib import blake2b
+
+from go_stats_utils import CLOSURE_LABELS
+
+# relations followed by each GOLr closure
+CLOSURE_RELATIONS = {
+    CLOSURE_LABELS.ISA : ("is_a", ),
+    CLOSURE_LABELS.ISA_PARTOF : ("is_a", "part_of"),
+    CLOSURE_LABELS.REGULATES : ("is_a", "part_of", "regulates", "negatively_regulates", "positively_regulates")
+}
+
+def closure_relations(relations):
+    """
+    Return the sorted tuple of relations of a closure, given as a CLOSURE_LABELS, its GOLr field name or any iterable of relations
+    """
+    if isinstance(relations, str):
+        relations = CLOSURE_LABELS(relations) if relations in [label.value for label in CLOSURE_LABELS] else (relations, )
+    if isinstance(relations, CLOSURE_LABELS):
+        relations = CLOSURE_RELATIONS[relations]
+    return tuple(sorted(set(relations)))
 
 class TermState:
     ANY = 1
@@ -13,6 +40,9 @@ class TermState:
     MERGED = 4
 
 def value(var):
+    # frozen terms hold tuples: report them as lists, as before
+    if isinstance(var, tuple):
+        return list(var)
     return var if var is not None else "N/A"
     
 def relationValue(array):
@@ -21,6 +51,22 @@ def relationValue(array):
     
     
     
+def intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+def freeze(items, interned = False):
+    if items is None or isinstance(items, tuple):
+        return items
+    return tuple(map(intern, items)) if interned else tuple(items)
+
+def fingerprint(*fields):
+    """
+    Stable 64 bits hash of a tuple of term fields (str, bool, None or tuples of them): the same across processes and runs,
+    unlike hash(), so that it can be kept with the pickled terms
+    """
+    return int.from_bytes(blake2b(repr(fields).encode("utf-8"), digest_size = 8).digest(), "little")
+    
+    
 class NamedEntity:
     
     def __init__(self):
@@ -29,6 +75,11 @@ class NamedEntity:
     
     
 class Term:
+
+    # one term per GO class and two releases loaded at once: no per instance __dict__
+    __slots__ = ("id", "alt_ids", "is_obsolete", "is_a", "namespace", "name", "comment", "synonyms", "definition",
+                 "created_by", "creation_date", "subsets", "xrefs", "intersection_of", "relationship",
+                 "structural_fingerprint", "meta_fingerprint", "xrefs_fingerprint")
     
     def __init__(self):
         self.id = None
@@ -46,6 +97,9 @@ class Term:
         self.xrefs = None
         self.intersection_of = None
         self.relationship = None
+        self.structural_fingerprint = None
+        self.meta_fingerprint = None
+        self.xrefs_fingerprint = None
         
         
     def count_metas(self, includeXRefs = True):
@@ -102,90 +156,84 @@ class Term:
         return False
         
         
-    def add_intersection_of(self, relationship, target_id, target_label):
-        if self.intersection_of is None:
-            self.intersection_of = []
-
-        relation = Relation()
-        if relationship == "":
-            relation.name = "is_a"
+    def freeze(self):
+        """
+        Called once the term is parsed: lists become tuples and the ids and namespace are interned,
+        so that the many references to a same term or namespace share a single string
+        Also computes the fingerprints of the term: call it again after any change to a frozen term
+        """
+        self.id = intern(self.id)
+        self.namespace = intern(self.namespace)
+        self.alt_ids = freeze(self.alt_ids, True)
+        self.is_a = freeze(self.is_a, True)
+        self.synonyms = freeze(self.synonyms)
+        self.subsets = freeze(self.subsets, True)
+        self.xrefs = freeze(self.xrefs)
+        self.intersection_of = freeze(self.intersection_of)
+        self.relationship = freeze(self.relationship)
+        # fingerprints of the fields compared by structural_equals, meta_equals (without xrefs) and xrefs_equals
+        self.structural_fingerprint = fingerprint(self.is_a, self.relationship, self.intersection_of)
+        self.meta_fingerprint = fingerprint(self.id, self.is_obsolete, self.alt_ids, self.name, self.namespace, self.definition, self.comment, self.synonyms, self.subsets)
+        self.xrefs_fingerprint = fingerprint(self.xrefs)
+
+    def __getstate__(self):
+        # compact snapshot (see OBO_Parser.save): the values of the slots, in order
+        return tuple(getattr(self, slot) for slot in Term.__slots__)
+
+    def __setstate__(self, state):
+        for slot, val in zip(Term.__slots__, state):
+            setattr(self, slot, val)
+
+    def _append(self, field, item):
+        items = getattr(self, field)
+        if self.meta_fingerprint is not None:
+            # already frozen: stay frozen, with up to date fingerprints
+            setattr(self, field, (items or ()) + (item, ))
+            self.freeze()
+        elif items is None:
+            setattr(self, field, [item])
         else:
-            relation.name = relationship
-
-#        print("relation: " + relation.name + " id: " + target_id + " label: " + target_label)
-
-        target = NamedEntity()
-        target.id = target_id
-        target.label = target_label
-        
-        relationTarget = RelationTarget()
-        relationTarget.relation = relation
-        relationTarget.target = target
+            items.append(item)
         
-#        self.intersection_of.append(relationTarget)
-        self.intersection_of.append(relation.name + " " + target_id)
+    def add_intersection_of(self, relationship, target_id, target_label):
+        self._append("intersection_of", ("is_a" if relationship == "" else relationship) + " " + target_id)
         
     def add_relationship(self, relationship, target_id, target_label):
-        if self.relationship is None:
-            self.relationship = []
-
-        relation = Relation()
-        if relationship == "":
-            relation.name = "is_a"
-        else:
-            relation.name = relationship
-
-#        print("relation: " + relation.name + " id: " + target_id + " label: " + target_label)
-
-        target = NamedEntity()
-        target.id = target_id
-        target.label = target_label
-        
-        relationTarget = RelationTarget()
-        relationTarget.relation = relation
-        relationTarget.target = target
-        
-#        self.relationship.append(relationTarget)
-        self.relationship.append(relation.name + " " + target_id)
-        
+        self._append("relationship", ("is_a" if relationship == "" else relationship) + " " + target_id)
         
     def add_is_a(self, is_a):
-        if self.is_a is None:
-            self.is_a = []
-        self.is_a.append(is_a)
+        self._append("is_a", is_a)
         
     def add_alternate_id(self, alt_id):
-        if self.alt_ids is None:
-            self.alt_ids = []
-        self.alt_ids.append(alt_id)
+        self._append("alt_ids", alt_id)
         
     def add_synonym(self, synonym):
-        if self.synonyms is None:
-            self.synonyms = []
-        self.synonyms.append(synonym)
+        self._append("synonyms", synonym)
         
     def add_subset(self, subset):
-        if self.subsets is None:
-            self.subsets = []
-        self.subsets.append(subset)
+        self._append("subsets", subset)
         
     def add_xref(self, xref):
-        if self.xrefs is None:
-            self.xrefs = []
-        self.xrefs.append(xref)
+        self._append("xrefs", xref)
 
     def equals(self, other):
         return self.id == other.id and self.is_obsolete == other.is_obsolete and self.alt_ids == other.alt_ids and self.name == other.name and self.is_a == other.is_a and self.namespace == other.namespace and self.definition == other.definition and self.comment == other.comment and self.synonyms == other.synonyms and self.subsets == other.subsets and self.xrefs == other.xrefs and self.relationship == other.relationship and self.intersection_of == other.intersection_of
 
     def structural_equals(self, other):
+        if self.structural_fingerprint is not None and other.structural_fingerprint is not None:
+            return self.structural_fingerprint == other.structural_fingerprint
         return self.is_a == other.is_a and self.relationship == other.relationship and self.intersection_of == other.intersection_of
 
     def meta_equals(self, other, includeXRefs = True):
+        if self.meta_fingerprint is not None and other.meta_fingerprint is not None:
+            return self.meta_fingerprint == other.meta_fingerprint and (not includeXRefs or self.xrefs_fingerprint == other.xrefs_fingerprint)
         if includeXRefs:
             return self.id == other.id and self.is_obsolete == other.is_obsolete and self.alt_ids == other.alt_ids and self.name == other.name and self.namespace == other.namespace and self.definition == other.definition and self.comment == other.comment and self.synonyms == other.synonyms and self.subsets == other.subsets and self.xrefs == other.xrefs
         return self.id == other.id and self.is_obsolete == other.is_obsolete and self.alt_ids == other.alt_ids and self.name == other.name and self.namespace == other.namespace and self.definition == other.definition and self.comment == other.comment and self.synonyms == other.synonyms and self.subsets == other.subsets
 
     def xrefs_equals(self, other):
+        if self.xrefs_fingerprint is not None and other.xrefs_fingerprint is not None:
+            return self.xrefs_fingerprint == other.xrefs_fingerprint
         return self.xrefs == other.xrefs
 
     def explain_structural_differences(self, other):
@@ -311,146 +359,442 @@ class RelationTarget:
         target = None   # NamedEntity
 
 
+# a tag ends at the first ":" followed by a space, and so does a value
+SEPARATOR = re.compile(r":(?=\s)")
+
+def tokenize(line):
+    """
+    Return the (tag, value) of an OBO line, None if the line has no tag
+    As in the OBO files produced by GO, the value stops at the next ":" followed by a space
+    """
+    tag, sep, rest = line.partition(":")
+    if not sep:
+        return None
+    if not rest[:1].isspace():
+        # slow path: a ":" inside the tag
+        match = SEPARATOR.search(line)
+        if match is None:
+            return None
+        tag = line[:match.start()]
+        rest = line[match.end():]
+    if ":" in rest:
+        match = SEPARATOR.search(rest)
+        if match is not None:
+            rest = rest[:match.start()]
+    return tag, rest.strip()
+
+# known tags of the [Term] and [Typedef] stanzas, matched as prefixes in this order
+TERM_TAGS = ["id", "alt_id", "namespace", "name", "comment", "def", "synonym", "subset", "is_obsolete", "xref", "is_a", "relationship", "intersection_of"]
+RELATION_TAGS = ["id", "name", "namespace", "xref", "is_transitive"]
+
+def match_tag(tag, known_tags, cache):
+    if tag not in cache:
+        cache[tag] = next((known for known in known_tags if tag.startswith(known)), None)
+    return cache[tag]
+
+term_tags = { }
+relation_tags = { }
+
+def term_tag(tag):
+    return match_tag(tag, TERM_TAGS, term_tags)
+
+def relation_tag(tag):
+    return match_tag(tag, RELATION_TAGS, relation_tags)
+
+
+def read_header(lines):
+    """
+    Read the header of an OBO document from an iterable of lines, e.g. to get its data-version before downloading the whole document
+    Return the header { tag: value } and an iterator on all the lines of the document, header included
+    """
+    lines = iter(lines)
+    read = []
+    header = { }
+    for line in lines:
+        read.append(line)
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if line.startswith("["):
+            break
+        kv = tokenize(line.rstrip("\r\n"))
+        if kv is not None:
+            header[kv[0].strip()] = kv[1]
+    return header, itertools.chain(read, lines)
+
+
+# bumped whenever the parsed model changes, so that older snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+def snapshot_path(directory, url, data_version):
+    """
+    Path of the snapshot of an ontology in directory, given its url and the data-version of its header
+    """
+    key = blake2b((url + "\n" + data_version).encode("utf-8"), digest_size = 16).hexdigest()
+    return os.path.join(directory, "obo-v" + str(SNAPSHOT_VERSION) + "-" + key + ".pickle")
+
+
 # TODO: I have to add the is_a: term_id ! term_name but I have to add it in the edges of the graph
 # TODO: I can also add the consider (who link to other term_ids)
 # TODO: Other relations: intersection_of, relationship
 class OBO_Parser:
     
+    # class of the parsed terms: anything offering the Term API (freeze() being called once a term is parsed)
+    term_class = Term
     term_key = "[Term]"
     type_def_key = "[Typedef]"
     header = None
     obo_graph = None
     relation_graph = None
+    alt_index = None
+    parents = None
+    children = None
+    views = None
     
     def __init__(self, content):
-        self.content = content
+        """
+        content is either the whole OBO text, a file handle or any iterable of lines (str or utf-8 bytes),
+        e.g. a streamed HTTP response: the ontology is parsed in a single pass, line by line
+        """
         self.obo_graph = nx.Graph()
         self.relation_graph = nx.Graph()
         self.header = { }
-        self._parseHeader()
-        self._parseTerms()
-        self._parseRelations()
+        if isinstance(content, str):
+            content = io.StringIO(content)
+        self._parse(content)
+        print(self.header)
+        self._indexAlternates()
+        self._indexRelations()
+        self.views = { }
         print("oboparser: ", len(self.obo_graph) , " terms")
             
-            
-    def _parseHeader(self):
-        lines = self.content.split(self.term_key)[0].split("\n")
+
+    def __getstate__(self):
+        # the closures and views are recomputed on demand
+        state = dict(self.__dict__)
+        state["closures"] = { }
+        state["views"] = { }
+        return state
+
+
+    def save(self, path):
+        """
+        Write a binary snapshot of the parsed ontology, read back with OBO_Parser.load(path)
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+    @staticmethod
+    def load(path):
+        """
+        Read a snapshot written by OBO_Parser.save(path)
+        """
+        # the many objects created by the load are all kept: no point in running the garbage collector meanwhile
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as f:
+                ontology = pickle.load(f)
+        finally:
+            if enabled:
+                gc.enable()
+        if not isinstance(ontology, OBO_Parser):
+            raise ValueError("Not an ontology snapshot: " + path)
+        print("oboparser: ", len(ontology.obo_graph) , " terms (snapshot <" + path + ">)")
+        return ontology
+
+
+    def _parse(self, lines):
+        term = None
+        relation = None
         for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            line = line.rstrip("\r\n")
             if len(line) == 0:
                 continue
-            kv = re.split(":(?=\s)", line)
-#            print("line: " , line , " kv: ", kv)
-            self.header[kv[0].strip()] = kv[1].strip()
-        print(self.header)
-
 
-    def _parseTerms(self):
-        terms = self.content.split(self.term_key)
-        for i in range(1, len(terms)):
-            term = Term()
-
-            for line in terms[i].split("\n"):
-                if len(line) == 0:
+            if line.startswith("["):
+                if self.term_key in line or self.type_def_key in line:
+                    if term is not None:
+                        term.freeze()
+                        self.obo_graph.add_node(term.id, object=term)
+                    if relation is not None:
+                        self.relation_graph.add_node(relation.id, object=relation)
+                    term = self.term_class() if self.term_key in line else None
+                    relation = Relation() if term is None else None
                     continue
-                
-                if line.startswith(self.type_def_key):
-                    break
-                
-                value = re.split(":(?=\s)", line)[1].strip()
-                if line.startswith("id"):
-                    term.id = value
-                elif line.startswith("alt_id"):
-                    term.add_alternate_id(value)
-                elif line.startswith("namespace"):
-                    term.namespace = value
-                elif line.startswith("name"):
-                    term.name = value
-                elif line.startswith("comment"):
-                    term.comment = value
-                elif line.startswith("def"):
-                    term.definition = value
-                elif line.startswith("synonym"):
-                    term.add_synonym(value)
-                elif line.startswith("subset"):
-                    term.add_subset(value)
-                elif line.startswith("is_obsolete"):
-                    term.is_obsolete = value
-                    if term.is_obsolete == "true":
-                        term.is_obsolete = True
-                elif line.startswith("xref"):
-                    term.add_xref(value)
-                elif line.startswith("is_a"):
-                    term.add_is_a(value.split(" ! ")[0].strip())
-                elif line.startswith("relationship"):
-                    split = value.split("GO:")
-                    split2 = split[1].split(" ! ");
-                    target_id = "GO:" + split2[0].strip()
-                    target_label = split2[1].strip()
-                    term.add_relationship(split[0].strip(), target_id, target_label)
-                elif line.startswith("intersection_of"):
-                    split = value.split("GO:")
-                    split2 = split[1].split(" ! ");
-                    target_id = "GO:" + split2[0].strip()
-                    target_label = split2[1].strip()
-                    term.add_intersection_of(split[0].strip(), target_id, target_label)
 
-            self.obo_graph.add_node(term.id, object=term)
-            
+            if term is not None:
+                self._parseTermLine(term, line)
+            elif relation is not None:
+                self._parseRelationLine(relation, line)
+            else:
+                self._parseHeaderLine(line)
 
-    def _parseRelations(self):
-        relations = self.content.split(self.type_def_key)
+        if term is not None:
+            term.freeze()
+            self.obo_graph.add_node(term.id, object=term)
+        if relation is not None:
+            self.relation_graph.add_node(relation.id, object=relation)
 
-        for i in range(1, len(relations)):
-            relation = Relation()
 
-            for line in relations[i].split("\n"):
-                if len(line) == 0:
-                    continue
-                
-                value = line.split(":")[1].strip()
-                if line.startswith("id"):
-                    relation.id = value
-                elif line.startswith("name"):
-                    relation.name = value
-                elif line.startswith("namespace"):
-                    relation.namespace = value
-                elif line.startswith("xref"):
-                    relation.xref = value
-                elif line.startswith("is_transitive"):
-                    relation.is_transitive = value
-
-            self.relation_graph.add_node(relation.id, object=relation)
+    def _parseHeaderLine(self, line):
+        kv = tokenize(line)
+        if kv is not None:
+            self.header[kv[0].strip()] = kv[1]
+
+
+    def _parseTermLine(self, term, line):
+        kv = tokenize(line)
+        if kv is None:
+            return
+        tag = term_tag(kv[0])
+        value = kv[1]
+        if tag == "id":
+            term.id = value
+        elif tag == "alt_id":
+            term.add_alternate_id(value)
+        elif tag == "namespace":
+            term.namespace = value
+        elif tag == "name":
+            term.name = value
+        elif tag == "comment":
+            term.comment = value
+        elif tag == "def":
+            term.definition = value
+        elif tag == "synonym":
+            term.add_synonym(value)
+        elif tag == "subset":
+            term.add_subset(value)
+        elif tag == "is_obsolete":
+            term.is_obsolete = value
+            if term.is_obsolete == "true":
+                term.is_obsolete = True
+        elif tag == "xref":
+            term.add_xref(value)
+        elif tag == "is_a":
+            term.add_is_a(value.split(" ! ")[0].strip())
+        elif tag == "relationship":
+            split = value.split("GO:")
+            split2 = split[1].split(" ! ");
+            target_id = "GO:" + split2[0].strip()
+            target_label = split2[1].strip()
+            term.add_relationship(split[0].strip(), target_id, target_label)
+        elif tag == "intersection_of":
+            split = value.split("GO:")
+            split2 = split[1].split(" ! ");
+            target_id = "GO:" + split2[0].strip()
+            target_label = split2[1].strip()
+            term.add_intersection_of(split[0].strip(), target_id, target_label)
+
+
+    def _parseRelationLine(self, relation, line):
+        split = line.split(":", 2)
+        if len(split) < 2:
+            return
+        tag = relation_tag(split[0])
+        value = split[1].strip()
+        if tag == "id":
+            relation.id = value
+        elif tag == "name":
+            relation.name = value
+        elif tag == "namespace":
+            relation.namespace = value
+        elif tag == "xref":
+            relation.xref = value
+        elif tag == "is_transitive":
+            relation.is_transitive = value
             
             
+    def _indexAlternates(self):
+        # alt_id -> ids of the terms declaring it, in the order of the ontology
+        self.alt_index = { }
+        for id, data in self.obo_graph.nodes(data=True):
+            if data['object'].alt_ids:
+                for alt_id in data['object'].alt_ids:
+                    if alt_id not in self.alt_index:
+                        self.alt_index[alt_id] = []
+                    if id not in self.alt_index[alt_id]:
+                        self.alt_index[alt_id].append(id)
+
+
+    def _indexRelations(self):
+        # directed, typed adjacency: term id -> ((relation, parent id), ...) and term id -> ((relation, child id), ...)
+        # only the terms of the ontology are indexed, e.g. not the targets of has_part to other ontologies
+        parents = { }
+        children = { }
+        for id, data in self.obo_graph.nodes(data=True):
+            term = data['object']
+            edges = [("is_a", parent) for parent in term.is_a or ()]
+            for relationship in term.relationship or ():
+                relation, _, parent = relationship.partition(" ")
+                edges.append((sys.intern(relation), parent))
+            edges = tuple(edge for edge in edges if edge[1] in self.obo_graph)
+            if edges:
+                parents[id] = edges
+                for relation, parent in edges:
+                    if parent not in children:
+                        children[parent] = []
+                    children[parent].append((relation, id))
+        self.parents = parents
+        self.children = { id : tuple(edges) for id, edges in children.items() }
+        # term id <-> position, and the closures computed so far (see _closure)
+        self.term_ids = list(self.obo_graph.nodes)
+        self.term_index = { id : index for index, id in enumerate(self.term_ids) }
+        self.closures = { }
+
+
+    def _closure(self, relations):
+        """
+        Ancestors of every term for a set of relations, as sorted arrays of term positions,
+        computed once per relation set by propagating the ancestors of the parents in topological order
+        """
+        relations = closure_relations(relations)
+        if relations in self.closures:
+            return self.closures[relations]
+
+        index = self.term_index
+        parents = [ ]
+        pending = [0] * len(self.term_ids)
+        waiting = [[] for i in range(len(self.term_ids))]
+        for position, id in enumerate(self.term_ids):
+            ids = set(index[parent] for relation, parent in self.parents.get(id, ()) if relation in relations)
+            parents.append(ids)
+            pending[position] = len(ids)
+            for parent in ids:
+                waiting[parent].append(position)
+
+        ancestors = [None] * len(self.term_ids)
+        queue = [position for position in range(len(self.term_ids)) if pending[position] == 0]
+        while queue:
+            position = queue.pop()
+            closure = set(parents[position])
+            for parent in parents[position]:
+                closure.update(ancestors[parent])
+            ancestors[position] = array("I", sorted(closure))
+            for child in waiting[position]:
+                pending[child] -= 1
+                if pending[child] == 0:
+                    queue.append(child)
+
+        # terms in a cycle (never expected for these relations): plain traversal
+        for position in range(len(self.term_ids)):
+            if ancestors[position] is None:
+                closure = set()
+                stack = list(parents[position])
+                while stack:
+                    parent = stack.pop()
+                    if parent not in closure:
+                        closure.add(parent)
+                        stack.extend(parents[parent])
+                ancestors[position] = array("I", sorted(closure))
+
+        self.closures[relations] = { "ancestors" : ancestors, "descendants" : None }
+        return self.closures[relations]
+
+
+    def get_parents(self, id, relations = None):
+        """
+        Ids of the direct parents of a term, following all the relations or only the given ones (see closure_relations)
+        """
+        relations = closure_relations(relations) if relations is not None else None
+        return [parent for relation, parent in self.parents.get(id, ()) if relations is None or relation in relations]
+
+
+    def get_child_ids(self, id, relations = None):
+        """
+        Ids of the direct children of a term, following all the relations or only the given ones (see closure_relations)
+        """
+        relations = closure_relations(relations) if relations is not None else None
+        return [child for relation, child in self.children.get(id, ()) if relations is None or relation in relations]
+
+
+    def get_ancestors(self, id, relations = CLOSURE_LABELS.ISA_PARTOF):
+        """
+        Ids of all the ancestors of a term (itself excluded) for a closure, e.g. CLOSURE_LABELS.ISA
+        """
+        if id not in self.term_index:
+            return set()
+        closure = self._closure(relations)
+        return set(self.term_ids[position] for position in closure["ancestors"][self.term_index[id]])
+
+
+    def get_descendants(self, id, relations = CLOSURE_LABELS.ISA_PARTOF):
+        """
+        Ids of all the descendants of a term (itself excluded) for a closure, e.g. CLOSURE_LABELS.ISA
+        """
+        if id not in self.term_index:
+            return set()
+        closure = self._closure(relations)
+        if closure["descendants"] is None:
+            descendants = [array("I") for i in range(len(self.term_ids))]
+            for position, ancestors in enumerate(closure["ancestors"]):
+                for ancestor in ancestors:
+                    descendants[ancestor].append(position)
+            closure["descendants"] = descendants
+        return set(self.term_ids[position] for position in closure["descendants"][self.term_index[id]])
+
+
     def get_nodes(self):
         return self.obo_graph.nodes(data=True)
 
 
-    def get_terms(self, term_state = TermState.VALID):
-        map = { }
+    def add_term(self, term):
+        """
+        Add (or replace) a term after the ontology was parsed, and invalidate the indexes and views depending on it
+        """
+        term.freeze()
+        self.obo_graph.add_node(term.id, object=term)
+        self.invalidate()
+
+
+    def invalidate(self):
+        """
+        Must be called after any change to the terms of the ontology: the alternate ids, relations,
+        closures and term views are recomputed on demand
+        """
+        self._indexAlternates()
+        self._indexRelations()
+        self.views = { }
+
+
+    def _view(self, key, compute):
+        # memoized result of compute(), until the next invalidate()
+        if key not in self.views:
+            self.views[key] = compute()
+        return self.views[key]
+
+
+    def _terms(self, term_state):
+        terms = { }
         for id, data in self.obo_graph.nodes(data=True):
             if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                map[id] = data['object']
-        return map
+                terms[id] = data['object']
+        return terms
+
+
+    def get_terms(self, term_state = TermState.VALID):
+        """
+        Map { id: term } of the terms in the given state, in the order of the ontology
+        The map is computed once and shared between calls: it must not be modified
+        """
+        return self._view(("terms", term_state), lambda: self._terms(term_state))
         
         
     def get_terms_in(self, aspect, term_state = TermState.VALID):
-        list = []
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                if data['object'].namespace == aspect:
-                    list.append(data['object'].id)
-        return list
+        """
+        Ids of the terms of a namespace in the given state; the list is shared between calls and must not be modified
+        """
+        return self._view(("terms_in", aspect, term_state), lambda: [term.id for term in self.get_terms(term_state).values() if term.namespace == aspect])
         
     def get_merged_terms(self, term_state = TermState.VALID):
-        list = set()
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                if data['object'].alt_ids:
-                    for alt_id in data['object'].alt_ids:
-                        if self.term_used_as_alternate(alt_id):
-                            list.add(data['object'].id)
-        return list
+        """
+        Ids of the terms in the given state with an alternate id; the set is shared between calls and must not be modified
+        """
+        return self._view(("merged", term_state), lambda: set(term.id for term in self.get_terms(term_state).values() if term.alt_ids and any(alt_id in self.alt_index for alt_id in term.alt_ids)))
         
     def has_term(self, query):
         return self.obo_graph.has_node(query)
@@ -463,52 +807,30 @@ class OBO_Parser:
         
     
     def term_used_as_alternate(self, query):
-        for id, data in self.obo_graph.nodes(data=True):
-            if data['object'].has_alt_id(query):
-                return True
-        return False
+        return query in self.alt_index
         
     def get_alternate_terms(self, query):
         list = []
-        for id, data in self.obo_graph.nodes(data=True):
-            if data['object'].has_alt_id(query):
-                list.append({ "id": data['object'].id , "name": data['object'].name })
+        for id in self.alt_index.get(query, []):
+            term = self.get_term(id)
+            list.append({ "id": term.id , "name": term.name })
         return list
         
     def count_all_metas(self, term_state = TermState.VALID, includeXRefs = True):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_metas(includeXRefs)
-        return count
+        return self._view(("metas", term_state, includeXRefs), lambda: sum(term.count_metas(includeXRefs) for term in self.get_terms(term_state).values()))
                 
     def count_all_xrefs(self, term_state = TermState.VALID):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_xrefs()
-        return count
+        return self._view(("xrefs", term_state), lambda: sum(term.count_xrefs() for term in self.get_terms(term_state).values()))
         
     def count_all_structurals(self, term_state = TermState.VALID):
-        count = 0
-        for id, data in self.obo_graph.nodes(data=True):
-            if term_state == TermState.ANY or (term_state == TermState.OBSOLETED and data['object'].is_obsolete) or (term_state == TermState.VALID and not data['object'].is_obsolete):
-                count += data['object'].count_structurals()
-        return count
+        return self._view(("structurals", term_state), lambda: sum(term.count_structurals() for term in self.get_terms(term_state).values()))
 
     def get_children(self, root):
         children = set()
-        for id, data in self.obo_graph.nodes(data=True):
-            current = data['object']
-            if current.is_obsolete:
-                continue
-            if current.is_a is None:
-                continue
-            if root.id in current.is_a:
+        for id in self.get_child_ids(root.id, ("is_a", )):
+            current = self.get_term(id)
+            if not current.is_obsolete:
                 children.add(current)
-                # locals = self.get_children(current)
-                # for local in locals:
-                #     children.add(local)
         return children
 
 
@@ -522,12 +844,8 @@ def main(argv):
     term = obo.get_term(term_id)
 
     print("using term: ", term.id , term.name)
-    derived_terms = obo.get_children(term)
-    print(len(derived_terms) , " derived terms")
-
-    derived_ids = []
-    for dterm in derived_terms:
-        derived_ids.append(dterm.id)
+    derived_ids = sorted(obo.get_descendants(term_id, CLOSURE_LABELS.ISA))
+    print(len(derived_ids) , " derived terms")
 
     not_derived_terms = " AND NOT \"" + "\" AND NOT \"".join(derived_ids)
 
@@ -0,0 +1,231 @@
+# Local index of NCBI taxon labels { taxon id: scientific name }
+#
+# The index is a single file, memory mapped when read:
+#   * a header: magic, capacity (max taxon id + 1), number of taxa
+#   * a table of capacity uint32 offsets directly indexed by taxon id (0 = unknown taxon, otherwise offset + 1 in the names block)
+#   * the names block: utf-8 labels, each one terminated by a new line
+# A lookup is thus one read in the table and one read in the names block, without loading the file.
+# New or renamed taxa are appended to the names block and their offset updated in place, the table being rebuilt only
+# when a taxon id exceeds its capacity.
+
+import sys, getopt, os, json, mmap, struct
+from array import array
+
+MAGIC = b"GOTAXON1"
+HEADER = struct.Struct("<8sII")
+OFFSET = struct.Struct("<I")
+
+# extra room left in the table for the taxa created after the index was built
+CAPACITY_MARGIN = 1.25
+
+
+class TaxonIndex:
+    """
+    Read only, memory mapped view of a taxon label index
+    Behaves as a map { "9606": "Homo sapiens" } (taxon ids given as str or int)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.capacity, self.size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not a taxon index: " + path)
+        self.names_start = HEADER.size + self.capacity * OFFSET.size
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def get(self, taxon_id, default = None):
+        try:
+            taxon_id = int(taxon_id)
+        except ValueError:
+            return default
+        if taxon_id < 0 or taxon_id >= self.capacity:
+            return default
+        offset = OFFSET.unpack_from(self.mm, HEADER.size + taxon_id * OFFSET.size)[0]
+        if offset == 0:
+            return default
+        start = self.names_start + offset - 1
+        end = self.mm.find(b"\n", start)
+        return self.mm[start:end].decode("utf-8")
+
+    def __getitem__(self, taxon_id):
+        label = self.get(taxon_id)
+        if label is None:
+            raise KeyError(taxon_id)
+        return label
+
+    def __contains__(self, taxon_id):
+        return self.get(taxon_id) is not None
+
+    def items(self):
+        for taxon_id, offset in enumerate(self.offsets()):
+            if offset != 0:
+                start = self.names_start + offset - 1
+                yield str(taxon_id), self.mm[start:self.mm.find(b"\n", start)].decode("utf-8")
+
+    def offsets(self):
+        table = array("I")
+        table.frombytes(self.mm[HEADER.size:self.names_start])
+        if sys.byteorder != "little":
+            table.byteswap()
+        return table
+
+
+def clean_label(label):
+    return label.replace("\n", " ").strip()
+
+def parse_labels(labels):
+    """
+    { taxon id (int): cleaned label } of an iterable of (taxon id, label), skipping the ids that are not numbers
+    """
+    parsed = { }
+    for taxon_id, label in labels:
+        try:
+            parsed[int(taxon_id)] = clean_label(label)
+        except ValueError:
+            print("Skipping taxon id that is not a number: ", taxon_id)
+    return parsed
+
+def build_index(path, labels):
+    """
+    Create (or replace) the index at path from an iterable of (taxon id, label)
+    Return the number of indexed taxa
+    """
+    labels = parse_labels(labels)
+    capacity = int((max(labels) + 1) * CAPACITY_MARGIN) if labels else 1
+
+    table = array("I", bytes(OFFSET.size * capacity))
+    names = bytearray()
+    for taxon_id, label in labels.items():
+        table[taxon_id] = len(names) + 1
+        names += label.encode("utf-8") + b"\n"
+    if sys.byteorder != "little":
+        table.byteswap()
+
+    # write to a temporary file first so that readers never see a partial index
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, capacity, len(labels)))
+        f.write(table.tobytes())
+        f.write(names)
+    os.replace(tmp_path, path)
+    return len(labels)
+
+def update_index(path, labels):
+    """
+    Add or rename taxa of an existing index (created if missing) from an iterable of (taxon id, label)
+    Only the new labels are appended; the whole index is rebuilt if a taxon id exceeds the capacity of the table
+    Return the number of added or renamed taxa
+    """
+    if not os.path.exists(path):
+        return build_index(path, labels)
+
+    with TaxonIndex(path) as index:
+        changes = { taxon_id : label for taxon_id, label in parse_labels(labels).items() if index.get(taxon_id) != label }
+        if not changes:
+            return 0
+        if max(changes) >= index.capacity:
+            merged = dict(index.items())
+            merged.update({ str(taxon_id) : label for taxon_id, label in changes.items() })
+            build_index(path, merged.items())
+            return len(changes)
+        capacity = index.capacity
+        size = index.size + sum(1 for taxon_id in changes if taxon_id not in index)
+
+    # the names are appended and flushed before any offset points to them, so that an interrupted update
+    # leaves at worst unused names at the end of the file
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        names_end = f.tell() - (HEADER.size + capacity * OFFSET.size)
+        offsets = { }
+        names = bytearray()
+        for taxon_id, label in changes.items():
+            offsets[taxon_id] = names_end + len(names) + 1
+            names += label.encode("utf-8") + b"\n"
+        f.write(names)
+        f.flush()
+        os.fsync(f.fileno())
+        for taxon_id, offset in offsets.items():
+            f.seek(HEADER.size + taxon_id * OFFSET.size)
+            f.write(OFFSET.pack(offset))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, capacity, size))
+    return len(changes)
+
+def read_names_dmp(path):
+    """
+    Yield the (taxon id, scientific name) of a NCBI taxonomy names.dmp file (ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdmp.zip)
+    """
+    with open(path, "r", encoding = "utf-8") as f:
+        for line in f:
+            cols = line.split("\t|\t")
+            if len(cols) >= 4 and cols[3].startswith("scientific name"):
+                yield cols[0], cols[1]
+
+def read_taxon_map(path):
+    """
+    Yield the (taxon id, label) of a taxon_map.json file { "9606": "Homo sapiens" }
+    """
+    with open(path, "r") as f:
+        return json.load(f).items()
+
+
+
+def print_help():
+    print('\nUsage: python taxon_index.py (-n <names.dmp> | -j <taxon_map.json>) -o <taxon_index> [-u]\n')
+    print('\t-u: update the existing index with the new or renamed taxa instead of rebuilding it\n')
+
+
+def main(argv):
+    names_dmp = ''
+    taxon_map_json = ''
+    output_index = ''
+    update = False
+
+    try:
+        opts, argv = getopt.getopt(argv,"n:j:o:uh",["names=","json=","output=","update"])
+    except getopt.GetoptError:
+        print_help()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print_help()
+            sys.exit()
+        elif opt in ("-n", "--names"):
+            names_dmp = arg
+        elif opt in ("-j", "--json"):
+            taxon_map_json = arg
+        elif opt in ("-o", "--output"):
+            output_index = arg
+        elif opt in ("-u", "--update"):
+            update = True
+
+    if output_index == '' or (names_dmp == '') == (taxon_map_json == ''):
+        print_help()
+        sys.exit(2)
+
+    labels = read_names_dmp(names_dmp) if names_dmp != '' else read_taxon_map(taxon_map_json)
+    if update:
+        print("Updated ", update_index(output_index, labels), " taxa in <" + output_index + ">")
+    else:
+        print("Indexed ", build_index(output_index, labels), " taxa in <" + output_index + ">")
+
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
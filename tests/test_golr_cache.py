@@ -0,0 +1,208 @@
+####
+#### Checks of the on-disk GOLr response cache (scripts/go_stats_utils.py) against a local stand-in GOLr.
+####
+#### Run with: python -m pytest tests/test_golr_cache.py (or python tests/test_golr_cache.py)
+####
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import go_stats_utils as utils
+
+
+## Canned GOLr responses, by select query.
+FACET_QUERY = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&facet=true&facet.field=taxon&rows=0"
+OTHER_QUERY = "select?fq=document_category:%22bioentity%22&q=*:*&wt=json&facet=true&facet.field=taxon&rows=0"
+REFERENCE_QUERY = "select?fq=document_category:%22annotation%22&q=*:*&wt=json&facet=true&facet.field=reference&rows=0"
+
+def facet_response(field, prefix, count):
+    items = [ ]
+    for i in range(count):
+        items += [prefix + str(i), count - i]
+    return { "response" : { "numFound" : count }, "facet_counts" : { "facet_fields" : { field : items } } }
+
+CANNED = {
+    FACET_QUERY : facet_response("taxon", "NCBITaxon:", 50),
+    OTHER_QUERY : facet_response("taxon", "NCBITaxon:", 20),
+    REFERENCE_QUERY : facet_response("reference", "PMID:", 5000)
+}
+
+
+class StubGolr(BaseHTTPRequestHandler):
+    """
+    Serve the canned responses under /solr/ and count the requests received
+    """
+    requests = [ ]
+
+    def do_GET(self):
+        query = self.path[len("/solr/"):]
+        StubGolr.requests.append(query)
+        if query not in CANNED:
+            self.send_response(400)
+            self.end_headers()
+            return
+        body = json.dumps(CANNED[query]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GolrCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), StubGolr)
+        cls.thread = threading.Thread(target = cls.server.serve_forever, daemon = True)
+        cls.thread.start()
+        cls.golr_base_url = "http://127.0.0.1:" + str(cls.server.server_port) + "/solr/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        StubGolr.requests = [ ]
+
+    def tearDown(self):
+        utils.golr_cache = None
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def entries(self, namespace):
+        folder = os.path.join(self.directory, namespace)
+        return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+
+    def test_miss_then_hit(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        first = utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        second = utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        self.assertEqual(first, CANNED[FACET_QUERY])
+        self.assertEqual(second, first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(StubGolr.requests, [FACET_QUERY])
+
+    def test_entries_survive_a_new_run(self):
+        utils.enable_golr_cache(self.directory, "2026-01-01")
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        self.assertEqual(utils.golr_fetch(self.golr_base_url, FACET_QUERY), CANNED[FACET_QUERY])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(len(StubGolr.requests), 1)
+
+    def test_stream_hit(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        streamed = list(utils.golr_stream_facet(self.golr_base_url, REFERENCE_QUERY, "reference"))
+        self.assertEqual(list(utils.golr_stream_facet(self.golr_base_url, REFERENCE_QUERY, "reference")), streamed)
+        self.assertEqual(utils.golr_fetch(self.golr_base_url, REFERENCE_QUERY), CANNED[REFERENCE_QUERY])
+        self.assertEqual(len(streamed), 5000)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(len(StubGolr.requests), 1)
+
+    def test_namespaces_are_separated(self):
+        utils.enable_golr_cache(self.directory, "2026-01-01")
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        cache = utils.enable_golr_cache(self.directory, "2026-02-01")
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(len(StubGolr.requests), 2)
+        self.assertEqual(len(self.entries("2026-01-01")), 1)
+        self.assertEqual(len(self.entries("2026-02-01")), 1)
+
+    def test_ttl_expiry(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01", ttl = 3600)
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        path = cache.path(self.golr_base_url, FACET_QUERY)
+
+        # still valid just before the ttl
+        os.utime(path, (os.path.getatime(path), os.path.getmtime(path) - 3000))
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # expired entries are dropped and fetched again
+        os.utime(path, (os.path.getatime(path), os.path.getmtime(path) - 3600))
+        self.assertEqual(utils.golr_fetch(self.golr_base_url, FACET_QUERY), CANNED[FACET_QUERY])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(StubGolr.requests), 2)
+        self.assertTrue(os.path.exists(path))
+
+    def test_lru_eviction(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        for query in (FACET_QUERY, OTHER_QUERY, REFERENCE_QUERY):
+            utils.golr_fetch(self.golr_base_url, query)
+        paths = { query : cache.path(self.golr_base_url, query) for query in CANNED }
+        sizes = { query : os.path.getsize(path) for query, path in paths.items() }
+
+        # FACET_QUERY is the least recently used, then REFERENCE_QUERY once OTHER_QUERY is read again
+        os.utime(paths[FACET_QUERY], (1000, os.path.getmtime(paths[FACET_QUERY])))
+        os.utime(paths[REFERENCE_QUERY], (2000, os.path.getmtime(paths[REFERENCE_QUERY])))
+        os.utime(paths[OTHER_QUERY], (3000, os.path.getmtime(paths[OTHER_QUERY])))
+
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01", max_size = sizes[OTHER_QUERY] + sizes[REFERENCE_QUERY])
+        self.assertEqual(cache.size, sum(sizes.values()))
+        cache.evict()
+        self.assertFalse(os.path.exists(paths[FACET_QUERY]))
+        self.assertTrue(os.path.exists(paths[OTHER_QUERY]))
+        self.assertTrue(os.path.exists(paths[REFERENCE_QUERY]))
+        self.assertEqual(cache.size, sizes[OTHER_QUERY] + sizes[REFERENCE_QUERY])
+
+        # adding an entry over the bound evicts on put
+        cache.max_size = sizes[OTHER_QUERY] + sizes[FACET_QUERY]
+        utils.golr_fetch(self.golr_base_url, FACET_QUERY)
+        self.assertFalse(os.path.exists(paths[REFERENCE_QUERY]))
+        self.assertTrue(os.path.exists(paths[FACET_QUERY]))
+        self.assertLessEqual(cache.size, cache.max_size)
+
+    def test_failed_queries_are_not_cached(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        with self.assertRaises(IOError):
+            list(utils.golr_stream(self.golr_base_url, "select?q=unknown", ["response", "docs"]))
+        self.assertEqual(self.entries("2026-01-01"), [])
+        self.assertEqual(cache.size, 0)
+
+    def test_atomic_write(self):
+        cache = utils.enable_golr_cache(self.directory, "2026-01-01")
+        path = cache.path(self.golr_base_url, REFERENCE_QUERY)
+        chunk_size = utils.STREAM_CHUNK_SIZE
+        utils.STREAM_CHUNK_SIZE = 1024
+        try:
+            # the entry only appears once the whole body is read
+            items = utils.golr_stream(self.golr_base_url, REFERENCE_QUERY, ["facet_fields", "reference"])
+            next(items)
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(len([name for name in self.entries("2026-01-01") if name.endswith(".tmp")]), 1)
+
+            # an interrupted download leaves neither an entry nor a temporary file
+            items.close()
+            self.assertEqual(self.entries("2026-01-01"), [])
+            self.assertEqual(cache.size, 0)
+
+            list(utils.golr_stream_facet(self.golr_base_url, REFERENCE_QUERY, "reference"))
+            self.assertEqual(self.entries("2026-01-01"), [os.path.basename(path)])
+            self.assertEqual(cache.size, os.path.getsize(path))
+        finally:
+            utils.STREAM_CHUNK_SIZE = chunk_size
+
+        # a corrupted entry is a miss, and is replaced
+        with open(path, "wb") as f:
+            f.write(b"not gzip")
+        self.assertEqual(utils.golr_fetch(self.golr_base_url, REFERENCE_QUERY), CANNED[REFERENCE_QUERY])
+        self.assertEqual(self.entries("2026-01-01"), [os.path.basename(path)])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
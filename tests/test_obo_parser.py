@@ -0,0 +1,153 @@
+####
+#### Regression checks of the OBO parser (scripts/obo_parser.py) on two small releases (tests/data/previous.obo, tests/data/current.obo).
+####
+#### Run with: python -m pytest tests/test_obo_parser.py (or python tests/test_obo_parser.py)
+####
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import obo_parser
+from obo_parser import OBO_Parser, Term, TermState
+from go_stats_utils import CLOSURE_LABELS
+
+
+def read(name):
+    with open(os.path.join(DATA, name), "r") as f:
+        return f.read()
+
+def fields(ontology):
+    """
+    { id: { slot: value } } of all the terms of an ontology, to compare two parses
+    """
+    return { id : { slot : getattr(data['object'], slot) for slot in Term.__slots__ } for id, data in ontology.get_nodes() }
+
+
+class OboParserTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.text = read("previous.obo")
+        cls.ontology = OBO_Parser(cls.text)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+
+    def test_parse_equivalence(self):
+        # the whole text, a file handle, utf-8 lines (a streamed response) and a snapshot give the same terms
+        expected = fields(self.ontology)
+        with open(os.path.join(DATA, "previous.obo"), "r") as f:
+            self.assertEqual(fields(OBO_Parser(f)), expected)
+        self.assertEqual(fields(OBO_Parser(line.encode("utf-8") for line in self.text.splitlines(True))), expected)
+        path = os.path.join(self.directory, "previous.pickle")
+        self.ontology.save(path)
+        self.assertEqual(fields(OBO_Parser.load(path)), expected)
+        self.assertEqual(len(expected), 11)
+
+    def test_parsed_values(self):
+        # values as read by the original parser: a value stops at the first ":" followed by a space
+        self.assertEqual(self.ontology.header["data-version"], "releases/2026-01-01")
+        term = self.ontology.get_term("GO:0000001")
+        self.assertEqual(term.name, "mitochondrion inheritance")
+        self.assertEqual(term.namespace, "biological_process")
+        self.assertEqual(term.definition, "\"The distribution of mitochondria")
+        self.assertEqual(term.alt_ids, ("GO:0000099", ))
+        self.assertEqual(term.synonyms, ("\"mitochondrial inheritance\" EXACT []", ))
+        self.assertEqual(term.xrefs, ("Wikipedia:Mitochondrion", ))
+        self.assertEqual(term.subsets, ("goslim_yeast", ))
+        self.assertEqual(term.is_a, ("GO:0008150", ))
+        self.assertFalse(term.is_obsolete)
+
+        term = self.ontology.get_term("GO:0000008")
+        self.assertEqual(term.relationship, ("regulates GO:0000003", ))
+        self.assertEqual(term.intersection_of, ("is_a GO:0008150", "regulates GO:0000003"))
+        self.assertTrue(self.ontology.get_term("GO:0000004").is_obsolete)
+
+        relation = self.ontology.relation_graph.nodes["part_of"]["object"]
+        self.assertEqual((relation.id, relation.name, relation.xref, relation.is_transitive), ("part_of", "part of", "BFO", "true"))
+
+    def test_tokenize(self):
+        self.assertEqual(obo_parser.tokenize("id: GO:0000001"), ("id", "GO:0000001"))
+        self.assertEqual(obo_parser.tokenize("def: \"a: b\" [GOC:x]"), ("def", "\"a"))
+        self.assertEqual(obo_parser.tokenize("property_value: http://purl.org/dc/terms/date \"2026\""), ("property_value", "http://purl.org/dc/terms/date \"2026\""))
+        self.assertIsNone(obo_parser.tokenize("no tag here"))
+
+    def test_alternate_ids(self):
+        self.assertEqual(self.ontology.alt_index, { "GO:0000099" : ["GO:0000001"] })
+        self.assertTrue(self.ontology.term_used_as_alternate("GO:0000099"))
+        self.assertFalse(self.ontology.term_used_as_alternate("GO:0000001"))
+        self.assertEqual(self.ontology.get_alternate_terms("GO:0000099"), [{ "id" : "GO:0000001", "name" : "mitochondrion inheritance" }])
+        self.assertEqual(self.ontology.get_alternate_terms("GO:0000005"), [])
+        self.assertEqual(self.ontology.get_merged_terms(TermState.ANY), { "GO:0000001" })
+
+        current = OBO_Parser(read("current.obo"))
+        self.assertEqual(current.get_alternate_terms("GO:0000005"), [{ "id" : "GO:0000003", "name" : "reproduction" }])
+        self.assertEqual(current.get_merged_terms(TermState.ANY), { "GO:0000001", "GO:0000003" })
+
+    def test_ancestors_and_descendants(self):
+        self.assertEqual(self.ontology.get_parents("GO:0000002"), ["GO:0000001", "GO:0000003"])
+        self.assertEqual(self.ontology.get_parents("GO:0000002", ("is_a", )), ["GO:0000001"])
+        self.assertEqual(self.ontology.get_child_ids("GO:0000003"), ["GO:0000002", "GO:0000008"])
+
+        self.assertEqual(self.ontology.get_ancestors("GO:0000002", CLOSURE_LABELS.ISA), { "GO:0000001", "GO:0008150" })
+        self.assertEqual(self.ontology.get_ancestors("GO:0000002"), { "GO:0000001", "GO:0000003", "GO:0008150" })
+        self.assertEqual(self.ontology.get_ancestors("GO:0000008", CLOSURE_LABELS.ISA_PARTOF), { "GO:0008150" })
+        self.assertEqual(self.ontology.get_ancestors("GO:0000008", CLOSURE_LABELS.REGULATES), { "GO:0000003", "GO:0008150" })
+        self.assertEqual(self.ontology.get_ancestors("GO:0008150"), set())
+        self.assertEqual(self.ontology.get_ancestors("GO:9999999"), set())
+
+        self.assertEqual(self.ontology.get_descendants("GO:0000003"), { "GO:0000002" })
+        self.assertEqual(self.ontology.get_descendants("GO:0000003", CLOSURE_LABELS.REGULATES), { "GO:0000002", "GO:0000008" })
+        self.assertEqual(self.ontology.get_descendants("GO:0008150", CLOSURE_LABELS.ISA), { "GO:0000001", "GO:0000002", "GO:0000003", "GO:0000005", "GO:0000008" })
+        self.assertEqual(self.ontology.get_descendants("GO:0005575"), { "GO:0000007" })
+
+        self.assertEqual(set(term.id for term in self.ontology.get_children(self.ontology.get_term("GO:0008150"))), { "GO:0000001", "GO:0000003", "GO:0000005", "GO:0000008" })
+
+    def test_views_invalidated_by_add_term(self):
+        ontology = OBO_Parser(self.text)
+        valid = ontology.get_terms()
+        self.assertIs(ontology.get_terms(), valid)
+        self.assertEqual(len(valid), 10)
+        self.assertEqual(ontology.get_terms_in("cellular_component"), ["GO:0005575", "GO:0000007"])
+        metas = ontology.count_all_metas()
+        structurals = ontology.count_all_structurals()
+        self.assertEqual(ontology.get_descendants("GO:0000007"), set())
+
+        term = Term()
+        term.id = "GO:0000009"
+        term.name = "nuclear envelope"
+        term.namespace = "cellular_component"
+        term.add_alternate_id("GO:0000098")
+        term.add_is_a("GO:0005575")
+        term.add_relationship("part_of", "GO:0000007", "nucleus")
+        ontology.add_term(term)
+
+        self.assertIsNot(ontology.get_terms(), valid)
+        self.assertEqual(len(ontology.get_terms()), 11)
+        self.assertEqual(ontology.get_terms_in("cellular_component"), ["GO:0005575", "GO:0000007", "GO:0000009"])
+        self.assertEqual(ontology.count_all_metas(), metas + 3)
+        self.assertEqual(ontology.count_all_structurals(), structurals + 2)
+        self.assertEqual(ontology.get_descendants("GO:0000007"), { "GO:0000009" })
+        self.assertEqual(ontology.get_ancestors("GO:0000009"), { "GO:0000007", "GO:0005575" })
+        self.assertEqual(ontology.get_alternate_terms("GO:0000098"), [{ "id" : "GO:0000009", "name" : "nuclear envelope" }])
+        self.assertIn("GO:0000009", ontology.get_merged_terms(TermState.ANY))
+
+        # a frozen term changed in place keeps up to date fingerprints
+        fingerprint = term.xrefs_fingerprint
+        term.add_xref("Wikipedia:Nuclear_envelope")
+        self.assertNotEqual(term.xrefs_fingerprint, fingerprint)
+        self.assertEqual(term.xrefs, ("Wikipedia:Nuclear_envelope", ))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+####
+#### Checks of the release history index (scripts/go_ontology_history.py) against go_ontology_changes.compute_changes,
+#### on two small releases (tests/data/previous.obo, tests/data/current.obo) served by a local HTTP server.
+####
+#### Run with: python -m pytest tests/test_ontology_history.py (or python tests/test_ontology_history.py)
+####
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import go_ontology_changes
+import go_ontology_history
+from obo_parser import OBO_Parser
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def ids(changes):
+    """
+    { namespace: sorted ids } of a detailed change map, without the empty namespaces (merged terms by previous -> current id)
+    """
+    grouped = { }
+    for namespace, items in changes.items():
+        if len(items) > 0:
+            grouped[namespace] = sorted(item["previous"]["id"] + " -> " + item["current"]["id"] if "previous" in item else item["id"] for item in items)
+    return grouped
+
+
+class OntologyHistoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory = DATA))
+        cls.thread = threading.Thread(target = cls.server.serve_forever, daemon = True)
+        cls.thread.start()
+        cls.base_url = "http://127.0.0.1:" + str(cls.server.server_port) + "/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def index(self):
+        history = go_ontology_history.OntologyHistory(self.directory)
+        for name in ["previous.obo", "current.obo"]:
+            with open(os.path.join(DATA, name), "r") as f:
+                history.add_release(OBO_Parser(f), self.base_url + name)
+        return history
+
+
+    def test_diff_matches_compute_changes(self):
+        history = self.index()
+        report = history.diff("2026-01-01", "2026-02-01")
+        detailed = go_ontology_changes.compute_changes(self.base_url + "current.obo", self.base_url + "previous.obo")["detailed_changes"]
+        for key in ["created_terms", "obsolete_terms", "merged_terms", "meta_statements", "cross_references", "relations"]:
+            self.assertEqual(ids(report[key]), ids(detailed[key]), key)
+
+        self.assertEqual(ids(report["created_terms"]), { "cellular_component" : ["GO:0000009"] })
+        self.assertEqual(ids(report["obsolete_terms"]), { "cellular_component" : ["GO:0000007"] })
+        self.assertEqual(ids(report["merged_terms"]), { "biological_process" : ["GO:0000005 -> GO:0000003"] })
+        self.assertEqual(ids(report["meta_statements"]), { "biological_process" : ["GO:0000001", "GO:0000003"] })
+        self.assertEqual(ids(report["cross_references"]), { "molecular_function" : ["GO:0000006"] })
+        self.assertEqual(ids(report["relations"]), { "biological_process" : ["GO:0000002"] })
+
+    def test_reopened_index(self):
+        expected = self.index().diff(0, 1)
+        history = go_ontology_history.OntologyHistory(self.directory)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.diff(0, 1), expected)
+        # no change between a release and itself
+        self.assertEqual(history.diff(1, 1), { key : { } for key in expected })
+        with self.assertRaises(ValueError):
+            with open(os.path.join(DATA, "current.obo"), "r") as f:
+                history.add_release(OBO_Parser(f))
+
+    def test_term_history(self):
+        history = self.index()
+        self.assertEqual(history.term_history("GO:0000005"), [{ "release" : "releases/2026-02-01", "event" : "merged", "into" : "GO:0000003" }])
+        self.assertEqual(history.term_history("GO:0000006"), [{ "release" : "releases/2026-02-01", "event" : "changed", "changes" : ["cross_references"] }])
+        self.assertEqual(history.term_history("GO:0000009"), [{ "release" : "releases/2026-02-01", "event" : "created" }])
+        self.assertEqual(history.term_history("GO:0008150"), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()